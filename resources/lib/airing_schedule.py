@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    airing_schedule.py
+    local store of the upcoming episodes of the library shows, refreshed by the service in the background
+    so the unaired, nextaired and airingtoday widgets never wait for the remote lookups
+'''
+
+import time
+import datetime
+import threading
+try:
+    import queue as Queue
+except ImportError:
+    import Queue
+from metadatautils import MetadataUtils
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file, log_msg, log_exception
+
+# bump when the stored format changes, the schedule is fetched again
+SCHEDULE_FORMAT = 1
+# the upcoming episodes are fetched for this amount of days, the most any of the widgets shows
+DAYS_AHEAD = 120
+# the schedule of a show is fetched again after: a show with upcoming episodes, a show without and an ended show
+TTL_RETURNING = 12 * 3600
+TTL_UNKNOWN = 24 * 3600
+TTL_ENDED = 7 * 86400
+# a failed lookup is retried after this amount of seconds
+RETRY_INTERVAL = 3600
+# the amount of shows looked up at the same time, every lookup worker has its own provider
+MAX_WORKERS = 4
+
+
+def get_today():
+    '''today's (local) date as used in the airdate field'''
+    return datetime.date.today().isoformat()
+
+
+def get_date(days_ahead):
+    '''the (local) date the given amount of days from now'''
+    return (datetime.date.today() + datetime.timedelta(days=days_ahead)).isoformat()
+
+
+class TvdbProvider(object):
+    '''
+        the upcoming episodes of a show from the thetvdb module of its own metadatautils instance,
+        the thetvdb module (its session and cache) is not shared between threads
+    '''
+
+    def __init__(self):
+        '''Initialization'''
+        self.metadatautils = MetadataUtils()
+        self.thetvdb = self.metadatautils.thetvdb
+        self.thetvdb.days_ahead = DAYS_AHEAD
+
+    def get_episodes(self, tvshow_id):
+        '''returns the upcoming episodes (kodi episode details with the airing fields) of a library show'''
+        return self.thetvdb.get_kodi_unaired_episodes(False, False, [tvshow_id])
+
+    def close(self):
+        '''release the metadatautils instance'''
+        self.metadatautils.close()
+        del self.metadatautils
+
+
+class AiringSchedule(object):
+    '''the upcoming episodes per tvshow id with their expiry, and an index of the episodes by airdate'''
+
+    def __init__(self, data=None):
+        '''Initialization'''
+        self.filename = get_profile_path("airing_schedule.json")
+        self.data = data or {"format": SCHEDULE_FORMAT, "shows": {}, "dates": {}}
+
+    @classmethod
+    def load(cls):
+        '''returns the stored schedule, None if the service didn't store one (yet)'''
+        data = read_json_file(get_profile_path("airing_schedule.json"))
+        if not data or data.get("format") != SCHEDULE_FORMAT:
+            return None
+        return cls(data)
+
+    def save(self):
+        '''store the schedule with a new date index'''
+        dates = {}
+        for key, show in self.data["shows"].items():
+            for index, episode in enumerate(show["episodes"]):
+                dates.setdefault(episode["airdate"][:10], []).append([key, index])
+        self.data["dates"] = dates
+        write_json_file(self.filename, self.data)
+
+    def get_due_shows(self, tvshow_ids, now):
+        '''drops the shows which are no longer in the library, returns the ids of the shows to (re)fetch'''
+        keys = set("%s" % tvshow_id for tvshow_id in tvshow_ids)
+        for key in list(self.data["shows"].keys()):
+            if key not in keys:
+                del self.data["shows"][key]
+        return [tvshow_id for tvshow_id in tvshow_ids
+                if self.data["shows"].get("%s" % tvshow_id, {}).get("expires", 0) <= now]
+
+    def get_next_expiry(self):
+        '''the time the first show needs to be fetched again, None if there are no shows'''
+        return min([show["expires"] for show in self.data["shows"].values()] or [None])
+
+    def set_show(self, tvshow_id, episodes, expires):
+        '''store the upcoming episodes of a show'''
+        self.data["shows"]["%s" % tvshow_id] = {"expires": expires, "episodes": episodes}
+
+    def set_retry(self, tvshow_id, expires):
+        '''keep the episodes of a show whose lookup failed, fetch it again at the given time'''
+        show = self.data["shows"].setdefault("%s" % tvshow_id, {"episodes": []})
+        show["expires"] = expires
+
+    def get_episodes(self, tvshow_ids, days_ahead, single_episode_per_show=False):
+        '''
+            the episodes of the given shows airing from today until days_ahead days from now, by airdate,
+            only the first of every show with single_episode_per_show
+        '''
+        today, last_date = get_today(), get_date(days_ahead)
+        all_items = []
+        for tvshow_id in tvshow_ids:
+            show = self.data["shows"].get("%s" % tvshow_id)
+            if not show:
+                continue
+            episodes = sorted((episode for episode in show["episodes"]
+                               if today <= episode["airdate"][:10] <= last_date),
+                              key=lambda x: (x["airdate"], x.get("airtime", "")))
+            all_items += episodes[:1] if single_episode_per_show else episodes
+        return sorted(all_items, key=lambda x: (x["airdate"], x.get("airtime", "")))
+
+    def get_airing_today(self, tvshow_ids):
+        '''the first episode of the given shows airing today, looked up in the date index'''
+        keys = set("%s" % tvshow_id for tvshow_id in tvshow_ids)
+        all_items = []
+        for key, index in self.data["dates"].get(get_today(), []):
+            if key in keys:
+                keys.discard(key)
+                all_items.append(self.data["shows"][key]["episodes"][index])
+        return sorted(all_items, key=lambda x: x.get("airtime", ""))
+
+
+def fetch_schedules(get_provider, tvshow_ids):
+    '''
+        fetch the episodes of the shows with at most MAX_WORKERS lookups at the same time: tvshowid -> episodes.
+        Every worker gets its own provider from get_provider.
+    '''
+    pending = Queue.Queue()
+    for tvshow_id in tvshow_ids:
+        pending.put(tvshow_id)
+    results = {}
+
+    def worker():
+        '''look up shows until there are none left, a failed lookup has no result'''
+        provider = get_provider()
+        try:
+            while True:
+                try:
+                    tvshow_id = pending.get(block=False)
+                except Queue.Empty:
+                    return
+                try:
+                    results[tvshow_id] = provider.get_episodes(tvshow_id) or []
+                except Exception as exc:
+                    log_exception(__name__, exc)
+        finally:
+            if hasattr(provider, "close"):
+                provider.close()
+    workers = [threading.Thread(target=worker) for _ in range(min(MAX_WORKERS, len(tvshow_ids)))]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results
+
+
+def refresh_schedule(metadatautils, get_provider):
+    '''
+        fetch the schedules of the shows which are missing or expired with providers from get_provider,
+        returns the schedule and the amount of fetched shows. The schedule is only stored if shows were due.
+    '''
+    schedule = AiringSchedule.load() or AiringSchedule()
+    now = time.time()
+    tvshows = dict((item["tvshowid"], item) for item in metadatautils.kodidb.tvshows())
+    due = schedule.get_due_shows(list(tvshows.keys()), now)
+    if due:
+        results = fetch_schedules(get_provider, due)
+        for tvshow_id in due:
+            if tvshow_id not in results:
+                schedule.set_retry(tvshow_id, now + RETRY_INTERVAL)
+            elif results[tvshow_id]:
+                schedule.set_show(tvshow_id, results[tvshow_id], now + TTL_RETURNING)
+            elif tvshows[tvshow_id].get("status", "").lower() == "ended":
+                schedule.set_show(tvshow_id, [], now + TTL_ENDED)
+            else:
+                schedule.set_show(tvshow_id, [], now + TTL_UNKNOWN)
+        log_msg("AiringSchedule: fetched %s shows, %s failed" % (len(results), len(due) - len(results)))
+        schedule.save()
+    return schedule, len(due)
+
+
+class ScheduleRefresher(threading.Thread):
+    '''background worker which keeps the airing schedule of all library shows fresh'''
+
+    def __init__(self, on_update, get_provider=None):
+        '''
+            Initialization, on_update is called after the schedule of some shows changed.
+            The schedules are looked up with the providers get_provider creates, thetvdb if not given.
+        '''
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.on_update = on_update
+        self.get_provider = get_provider or TvdbProvider
+        self.stop_event = threading.Event()
+        self.wakeup = threading.Event()
+
+    def stop(self):
+        '''stop the worker thread'''
+        self.stop_event.set()
+        self.wakeup.set()
+
+    def refresh(self):
+        '''check for due shows now, e.g. after the library changed'''
+        self.wakeup.set()
+
+    def run(self):
+        '''refresh the due shows, then sleep until the next show expires'''
+        metadatautils = MetadataUtils()
+        while not self.stop_event.is_set():
+            next_refresh = time.time() + RETRY_INTERVAL
+            try:
+                schedule, fetched = refresh_schedule(metadatautils, self.get_provider)
+                next_refresh = max(schedule.get_next_expiry() or next_refresh, time.time() + 60)
+                if fetched:
+                    self.on_update()
+            except Exception as exc:
+                log_exception(__name__, exc)
+            self.wakeup.wait(next_refresh - time.time())
+            self.wakeup.clear()
+        metadatautils.close()
+        del metadatautils
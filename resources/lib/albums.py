@@ -44,14 +44,16 @@ class Albums(object):
 
     def recommended(self):
         ''' get recommended albums - library albums with sorted by rating '''
-        all_items = self.metadatautils.kodidb.albums(sort=kodi_constants.SORT_RATING,
-                                                filters=[], limits=(0, self.options["limit"]))
+        from resources.lib.library_mirror import get_library_items
+        all_items = get_library_items(self.metadatautils, "albums", kodi_constants.SORT_RATING, [],
+                                      (0, self.options["limit"]))
         return self.metadatautils.process_method_on_list(self.process_album, all_items)
 
     def recent(self):
         ''' get recently added albums '''
-        all_items = self.metadatautils.kodidb.albums(sort=kodi_constants.SORT_DATEADDED, filters=[],
-                                                limits=(0, self.options["limit"]))
+        from resources.lib.library_mirror import get_library_items
+        all_items = get_library_items(self.metadatautils, "albums", kodi_constants.SORT_DATEADDED, [],
+                                      (0, self.options["limit"]))
         return self.metadatautils.process_method_on_list(self.process_album, all_items)
 
     def random(self):
@@ -62,8 +64,9 @@ class Albums(object):
 
     def recentplayed(self):
         ''' get in progress albums '''
-        all_items = self.metadatautils.kodidb.albums(sort=kodi_constants.SORT_LASTPLAYED, filters=[],
-                                                limits=(0, self.options["limit"]))
+        from resources.lib.library_mirror import get_library_items
+        all_items = get_library_items(self.metadatautils, "albums", kodi_constants.SORT_LASTPLAYED, [],
+                                      (0, self.options["limit"]))
         return self.metadatautils.process_method_on_list(self.process_album, all_items)
 
     def similar(self):
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    cowatch.py
+    item to item co-watch model: the movies and tvshows watched close after each other in the watch history,
+    maintained by the service and used by the cowatched widgets
+'''
+
+import os
+import time
+from hashlib import md5
+from metadatautils import kodi_constants
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file, log_msg
+from resources.lib.taste_profile import parse_lastplayed
+from resources.lib.library_mirror import get_library_items_by_id
+
+# bump when the stored format or the pair weights change, the model is rebuilt from the watch history
+MODEL_FORMAT = 1
+# a watched item is paired with this amount of items watched before it
+WINDOW_SIZE = 5
+# ... if they were watched at most this amount of days before it
+MAX_GAP_DAYS = 7
+# the amount of co-watched items kept per item, the ones with the lowest weight are dropped
+MAX_NEIGHBORS = 50
+# the rows are spread over this amount of files, the plugin only reads the one it needs
+NUM_BUCKETS = 64
+# the amount of last watched movies and episodes the model is built from initially
+HISTORY_SIZE = 1000
+
+
+def get_key(media_type, item_id):
+    '''the key of a movie or tvshow in the model, e.g. movie:12'''
+    return "%s:%s" % (media_type, item_id)
+
+
+def get_bucket(key):
+    '''the file a row is stored in'''
+    return int(md5(key.encode("utf-8")).hexdigest()[:4], 16) % NUM_BUCKETS
+
+
+class CoWatchModel(object):
+    '''
+        sparse symmetric co-occurrence matrix of the watched movies and tvshows (the shows of the watched episodes):
+        per item the summed pair weights of the items watched close before or after it
+    '''
+
+    def __init__(self):
+        '''Initialization'''
+        self.folder = get_profile_path("cowatch")
+        self.info = None
+        self.buckets = {}
+        self.changed = set()
+
+    def get_filename(self, bucket):
+        '''returns the file of the given bucket'''
+        return os.path.join(self.folder, "%s.json" % bucket)
+
+    def get_bucket(self, bucket):
+        '''returns the rows of a bucket, read once'''
+        if bucket not in self.buckets:
+            self.buckets[bucket] = read_json_file(self.get_filename(bucket), {})
+        return self.buckets[bucket]
+
+    def get_info(self):
+        '''returns the format and the last watched items ([timestamp, key]) the next watched item is paired with'''
+        if self.info is None:
+            self.info = read_json_file(os.path.join(self.folder, "info.json"), {})
+        return self.info
+
+    def is_current(self):
+        '''checks if the model was built with the current format'''
+        return self.get_info().get("format") == MODEL_FORMAT
+
+    def reset(self):
+        '''drop the model, it will be rebuilt from the watch history'''
+        log_msg("CoWatchModel: resetting model")
+        for bucket in range(NUM_BUCKETS):
+            if os.path.exists(self.get_filename(bucket)):
+                os.remove(self.get_filename(bucket))
+        self.info = {"format": MODEL_FORMAT, "recent": []}
+        self.buckets = {}
+        self.changed = set()
+
+    def save(self):
+        '''store the changed rows'''
+        for bucket in self.changed:
+            write_json_file(self.get_filename(bucket), self.buckets[bucket])
+        write_json_file(os.path.join(self.folder, "info.json"), self.get_info())
+        self.changed = set()
+
+    def lookup(self, key):
+        '''returns the [key, weight] list of the items co-watched with the given item, the highest weight first'''
+        row = self.get_bucket(get_bucket(key)).get(key, {})
+        return sorted(row.items(), key=lambda x: (-x[1], x[0]))
+
+    def add_pair(self, key, other_key, weight):
+        '''add a pair weight to the row of key, capped at MAX_NEIGHBORS'''
+        bucket = get_bucket(key)
+        row = self.get_bucket(bucket).setdefault(key, {})
+        row[other_key] = row.get(other_key, 0) + weight
+        if len(row) > MAX_NEIGHBORS:
+            del row[min(row, key=lambda x: (row[x], x))]
+        self.changed.add(bucket)
+
+    def add(self, key, timestamp=None):
+        '''pair a watched item with the items watched before it, call save to store the changes'''
+        timestamp = timestamp or time.time()
+        recent = self.get_info()["recent"]
+        if recent and recent[-1][1] == key:
+            # the next episode of the same show
+            recent[-1][0] = timestamp
+            return
+        recent[:] = [entry for entry in recent if entry[1] != key]
+        for distance, (other_timestamp, other_key) in enumerate(reversed(recent), 1):
+            if timestamp - other_timestamp > MAX_GAP_DAYS * 86400:
+                break
+            # the closer in the history, the stronger the pair
+            weight = 1.0 / distance
+            self.add_pair(key, other_key, weight)
+            self.add_pair(other_key, key, weight)
+        recent.append([timestamp, key])
+        del recent[:-WINDOW_SIZE]
+
+
+def build_model(metadatautils):
+    '''build the model from the watched movies and the watched episodes (as their shows)'''
+    model = CoWatchModel()
+    model.reset()
+    events = []
+    for item in metadatautils.kodidb.movies(sort=kodi_constants.SORT_LASTPLAYED,
+                                            filters=[kodi_constants.FILTER_WATCHED], limits=(0, HISTORY_SIZE)):
+        events.append((parse_lastplayed(item.get("lastplayed")), get_key("movie", item["movieid"])))
+    for item in metadatautils.kodidb.episodes(sort=kodi_constants.SORT_LASTPLAYED,
+                                              filters=[kodi_constants.FILTER_WATCHED], limits=(0, HISTORY_SIZE)):
+        events.append((parse_lastplayed(item.get("lastplayed")), get_key("tvshow", item["tvshowid"])))
+    # replay the history, the oldest first
+    for timestamp, key in sorted((event for event in events if event[0]), key=lambda x: x[0]):
+        model.add(key, timestamp)
+    model.save()
+    log_msg("CoWatchModel: built from %s watched items" % len(events))
+    return model
+
+
+def get_cowatched_items(metadatautils, ref_key, media_types, limit):
+    '''
+        returns the library items (of the given types: movie, tvshow) most watched together with the reference,
+        with their cowatchscore. Only the row of the reference is read, whatever the size of the library.
+        The model only holds watched items, so the watched items are never hidden.
+    '''
+    model = CoWatchModel()
+    if not model.is_current():
+        return []
+    row = [(key.split(":")[0], int(key.split(":")[1]), weight) for key, weight in model.lookup(ref_key)]
+    row = [entry for entry in row if entry[0] in media_types]
+    items = {}
+    for media_type in media_types:
+        ids = [item_id for entry_type, item_id, _ in row if entry_type == media_type]
+        if ids:
+            for item_id, item in zip(ids, get_library_items_by_id(metadatautils, "%ss" % media_type, ids)):
+                items[(media_type, item_id)] = item
+    all_items = []
+    for media_type, item_id, weight in row:
+        item = items.get((media_type, item_id))
+        if not item:
+            # removed from the library since
+            continue
+        item["cowatchscore"] = weight
+        all_items.append(item)
+        if len(all_items) == limit:
+            break
+    return all_items
@@ -6,11 +6,18 @@
     episodes.py
     all episodes widgets provided by the script
 '''
-import os, sys
-from operator import itemgetter
+import os
+import time
+import datetime
 import xbmc
 from metadatautils import kodi_constants
-from resources.lib.utils import create_main_entry,log_msg
+from resources.lib.utils import create_main_entry
+
+# the episode fields needed to group the recently added episodes
+RECENT_FIELDS = ["tvshowid", "season", "dateadded"]
+# the first page of recently added episodes holds this many episodes per requested group
+RECENT_PAGE_FACTOR = 4
+
 
 class Episodes(object):
     '''all episode widgets provided by the script'''
@@ -56,18 +63,16 @@ class Episodes(object):
 
     def recommended(self):
         ''' get recommended episodes - library episodes with score higher than 7 '''
+        from resources.lib.library_mirror import get_library_items
         filters = [kodi_constants.FILTER_RATING]
         if self.options["hide_watched"]:
             filters.append(kodi_constants.FILTER_UNWATCHED)
-        return self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_RATING, filters=filters,
-                                                  limits=(0, self.options["limit"]))
+        return get_library_items(self.metadatautils, "episodes", kodi_constants.SORT_RATING, filters,
+                                 (0, self.options["limit"]))
 
     def recent(self):
         ''' get recently added episodes '''
-        log_msg("recent widget", xbmc.LOGINFO)
-        tvshow_episodes = {}
-        total_count = 0
-        unique_count = 0
+        from resources.lib.nextup import get_episode_details
         filters = []
         if self.options["hide_watched"]:
             filters.append(kodi_constants.FILTER_UNWATCHED)
@@ -75,38 +80,48 @@ class Episodes(object):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
         if self.options.get("path"):
             filters.append({"operator": "startswith", "field": "path", "value": self.options["path"]})
-        while unique_count < self.options["limit"]:
-            recent_episodes = self.metadatautils.kodidb.episodes(
-                sort=kodi_constants.SORT_DATEADDED, filters=filters, limits=(
-                    total_count, self.options["limit"] + total_count))
-            log_msg("Check grouping setting", xbmc.LOGINFO)
-            if not self.options["group_episodes"]:
-                # grouping is not enabled, just return the result
-                log_msg("Grouping not enabled, return normal result", xbmc.LOGINFO)
-                return recent_episodes
-
-            if len(recent_episodes) < self.options["limit"]:
-                # break the loop if there are no more episodes
-                unique_count = self.options["limit"]
-
-            # if multiple episodes for the same show with same addition date, we combine them into one
-            # to do that we build a dict with recent episodes for all episodes of the same season added on the same date
-            for episode in recent_episodes:
-                total_count += 1
-                unique_key = "%s-%s-%s" % (episode["tvshowid"], episode["dateadded"].split(" ")[0], episode["season"])
-                log_msg("Unique %s" % unique_key, xbmc.LOGINFO)
-                if unique_key not in tvshow_episodes:
-                    tvshow_episodes[unique_key] = []
-                    unique_count += 1
-                tvshow_episodes[unique_key].append(episode)
+        if not self.options["group_episodes"]:
+            # grouping is not enabled, just return the result
+            return self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_DATEADDED, filters=filters,
+                                                      limits=(0, self.options["limit"]))
+        # if multiple episodes for the same show with same addition date, we combine them into one
+        # to do that we group the episodes of the same season added on the same date, in the order they come in
+        groups = []
+        group_sizes = {}
+        complete = 0
+        for episode in self.iter_recent_episodes(filters):
+            date = episode["dateadded"].split(" ")[0]
+            # the episodes come newest first, so the groups of a later date can't grow anymore
+            while complete < len(groups) and groups[complete][1] > date:
+                complete += 1
+            if complete >= self.options["limit"]:
+                break
+            unique_key = "%s-%s-%s" % (episode["tvshowid"], date, episode["season"])
+            if unique_key not in group_sizes:
+                groups.append((unique_key, date, episode["episodeid"]))
+                group_sizes[unique_key] = 0
+            group_sizes[unique_key] += 1
+        groups = groups[:self.options["limit"]]
+        # only now get the details of the newest episode of every group
+        all_items = []
+        for (unique_key, _, _), episode in zip(groups, get_episode_details([group[2] for group in groups])):
+            if episode:
+                all_items.append(self.create_grouped_entry(episode, group_sizes[unique_key]))
+        return all_items
 
-        log_msg("Return entries sorted by dateadded", xbmc.LOGINFO)
-        # create our entries and return the result sorted by dateadded
-        if sys.version_info.major == 3:
-            all_items = self.metadatautils.process_method_on_list(self.create_grouped_entry, tvshow_episodes.values())
-        else:
-            all_items = self.metadatautils.process_method_on_list(self.create_grouped_entry, tvshow_episodes.itervalues())
-        return sorted(all_items, key=itemgetter("dateadded"), reverse=True)[:self.options["limit"]]
+    def iter_recent_episodes(self, filters):
+        '''yields the (minimal fields of the) recently added episodes, fetched in pages of growing size'''
+        start = 0
+        page_size = self.options["limit"] * RECENT_PAGE_FACTOR
+        while True:
+            episodes = self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_DATEADDED, filters=filters,
+                                                          limits=(start, start + page_size), fields=RECENT_FIELDS)
+            for episode in episodes:
+                yield episode
+            if len(episodes) < page_size:
+                return
+            start += page_size
+            page_size *= 2
 
     def random(self):
         ''' get random episodes '''
@@ -122,13 +137,14 @@ class Episodes(object):
 
     def inprogress(self):
         ''' get in progress episodes '''
+        from resources.lib.library_mirror import get_library_items
         filters = [kodi_constants.FILTER_INPROGRESS]
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
         if self.options.get("path"):
             filters.append({"operator": "startswith", "field": "path", "value": self.options["path"]})
-        return self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_LASTPLAYED, filters=filters,
-                                                  limits=(0, self.options["limit"]))
+        return get_library_items(self.metadatautils, "episodes", kodi_constants.SORT_LASTPLAYED, filters,
+                                 (0, self.options["limit"]))
 
     def inprogressandrecommended(self):
         ''' get recommended AND in progress episodes '''
@@ -150,6 +166,12 @@ class Episodes(object):
 
     def continuewatching(self):
         """ get continue watching episodes """
+        from resources.lib.nextup import NextUpState, get_nextup_episodes
+        state = NextUpState.load()
+        if state and not self.options.get("tag") and not self.options.get("path"):
+            # the service keeps the continue watching episode of every show
+            return state.get_episodes(self.options["limit"], self.options["episodes_enable_specials"],
+                                      continue_watching=True)
         filters = []
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
@@ -157,11 +179,17 @@ class Episodes(object):
             filters.append({"operator": "startswith", "field": "path", "value": self.options["path"]})
         all_shows = self.metadatautils.kodidb.tvshows(sort=kodi_constants.SORT_LASTPLAYED, filters=filters,
                                                       limits=(0, self.options["limit"]))
-        return self.metadatautils.process_method_on_list(self.get_continue_episode_for_show, [
-                                                         d['tvshowid'] for d in all_shows])
+        return get_nextup_episodes(self.metadatautils, [d['tvshowid'] for d in all_shows],
+                                   self.options["episodes_enable_specials"], continue_watching=True)
 
     def next(self):
         ''' get next episodes '''
+        from resources.lib.nextup import NextUpState, get_nextup_episodes
+        state = NextUpState.load()
+        if state and not self.options.get("tag") and not self.options.get("path"):
+            # the service keeps the next up episode of every show
+            return state.get_episodes(self.options["limit"], self.options["episodes_enable_specials"],
+                                      self.options["next_inprogress_only"])
         filters = [kodi_constants.FILTER_UNWATCHED]
         if self.options["next_inprogress_only"]:
             filters = [kodi_constants.FILTER_INPROGRESS]
@@ -172,86 +200,13 @@ class Episodes(object):
         # First we get a list of all the inprogress/unwatched TV shows ordered by lastplayed
         all_shows = self.metadatautils.kodidb.tvshows(sort=kodi_constants.SORT_LASTPLAYED, filters=filters,
                                                       limits=(0, self.options["limit"]))
-        return self.metadatautils.process_method_on_list(self.get_next_episode_for_show,
-                                                         [d['tvshowid'] for d in all_shows])
-
-    def get_continue_episode_for_show(self, show_id):
-        """
-        get last played episode for show, if it's in-progress then returns the episode, else returns the next episode
-        if no episode has played or no episode left then returns none
-        """
-        filters = []
-        fields = ["playcount", "season", "resume"]
-        continue_episode = None
-        if not self.options["episodes_enable_specials"]:
-            filters.append({"field": "season", "operator": "greaterthan", "value": "0"})
-        last_played_episode = self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_LASTPLAYED,
-                    filters=filters, limits=(0, 1), tvshowid=show_id, fields=fields)
-        if last_played_episode:
-            last_played_episode = last_played_episode[0]
-            filter_season = last_played_episode["season"] - 1
-            filter_season = [{"field": "season", "operator": "greaterthan", "value": "%s" % filter_season}]
-            all_episodes = self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_EPISODE,
-                    filters=filters + filter_season, tvshowid=show_id, fields=fields)
-            # find index of last_played_episode in the list all_episodes and return inprogress episode or the next episode
-            try:
-                for index, episode in enumerate(all_episodes):
-                    if episode['episodeid'] == last_played_episode['episodeid']:
-                        if int(all_episodes[index]["resume"]["position"]) > 0:
-                            continue_episode = all_episodes[index]
-                        else:
-                            continue_episode = all_episodes[index + 1]
-            except IndexError:
-                # no episodes left
-                continue_episode = None
-        return self.metadatautils.kodidb.episode(continue_episode["episodeid"]) if continue_episode else None
-
-    def get_next_episode_for_show(self, show_id):
-        '''
-        get last played watched episode for show,
-        return next unwatched episode after that,
-        unless nothing after that, then return first episode
-        '''
-        filters = []
-        fields = ["playcount", "season"]
-        next_episode = None
-        if not self.options["episodes_enable_specials"]:
-            filters.append({"field": "season", "operator": "greaterthan", "value": "0"})
-
-        # get the next unwatched episode after the last played episode
-        last_played_episode = self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_LASTPLAYED,
-                    filters=filters + [kodi_constants.FILTER_WATCHED], limits=(0, 1), tvshowid=show_id, fields=fields)
-        if last_played_episode:
-            last_played_episode = last_played_episode[0]
-            filter_season = last_played_episode["season"] - 1
-            filter_season = [{"field": "season", "operator": "greaterthan", "value": "%s" % filter_season}]
-            all_episodes = self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_EPISODE,
-                    filters=filters + filter_season, tvshowid=show_id, fields=fields)
-            # find index of last_played_episode in the list all_episodes
-            try:
-                for index, episode in enumerate(all_episodes):
-                    if episode['episodeid'] == last_played_episode['episodeid']:
-                        i = 1
-                        while True:
-                            if int(all_episodes[index + i]['playcount']) < 1:
-                                next_episode = all_episodes[index + i]
-                                break
-                            i += 1
-            except IndexError:
-                # no unplayed episodes left
-                next_episode = None
-        # just get the first unwatched episode (e.g. when we simply do not yet have any fully played episodes)
-        if not next_episode:
-            next_episode = self.metadatautils.kodidb.episodes(
-                sort=kodi_constants.SORT_EPISODE, filters=filters + [kodi_constants.FILTER_UNWATCHED],
-                limits=(0, 1), tvshowid=show_id, fields=fields)
-            next_episode = next_episode[0] if next_episode else None
-        # return full details for our episode
-        return self.metadatautils.kodidb.episode(next_episode["episodeid"]) if next_episode else None
-
+        # then the next episode of all of them at once
+        return get_nextup_episodes(self.metadatautils, [d['tvshowid'] for d in all_shows],
+                                   self.options["episodes_enable_specials"])
 
     def unaired(self):
         ''' get all unaired episodes for shows in the library - provided by tvdb module'''
+        from resources.lib.airing_schedule import AiringSchedule, DAYS_AHEAD
         self.metadatautils.thetvdb.days_ahead = 120
 
         filters = [kodi_constants.FILTER_UNWATCHED]
@@ -266,12 +221,18 @@ class Episodes(object):
         all_shows = self.metadatautils.kodidb.tvshows(sort=kodi_constants.SORT_LASTPLAYED, filters=filters,
                                                       limits=(0, self.options["limit"]))
         tvshows_ids = [d['tvshowid'] for d in all_shows]
-        episodes = self.metadatautils.thetvdb.get_kodi_unaired_episodes(False, False, tvshows_ids)
+        schedule = AiringSchedule.load()
+        if schedule:
+            # the schedule the service keeps
+            episodes = schedule.get_episodes(tvshows_ids, DAYS_AHEAD)
+        else:
+            episodes = self.metadatautils.thetvdb.get_kodi_unaired_episodes(False, False, tvshows_ids)
         episodes = episodes[:self.options["limit"]]
         return [self.map_episode_props(episode) for episode in episodes]
 
     def nextaired(self, days_ahead=60):
         ''' get all next airing episodes for shows in the library - provided by tvdb module'''
+        from resources.lib.airing_schedule import AiringSchedule
         self.metadatautils.thetvdb.days_ahead = days_ahead
 
         filters = [kodi_constants.FILTER_UNWATCHED]
@@ -286,7 +247,14 @@ class Episodes(object):
         all_shows = self.metadatautils.kodidb.tvshows(sort=kodi_constants.SORT_LASTPLAYED, filters=filters,
                                                       limits=(0, self.options["limit"]))
         tvshows_ids = [d['tvshowid'] for d in all_shows]
-        episodes = self.metadatautils.thetvdb.get_kodi_unaired_episodes(True, False, tvshows_ids)
+        schedule = AiringSchedule.load()
+        if schedule and not days_ahead:
+            # the episodes of today from the date index of the schedule the service keeps
+            episodes = schedule.get_airing_today(tvshows_ids)
+        elif schedule:
+            episodes = schedule.get_episodes(tvshows_ids, days_ahead, single_episode_per_show=True)
+        else:
+            episodes = self.metadatautils.thetvdb.get_kodi_unaired_episodes(True, False, tvshows_ids)
         return [self.map_episode_props(episode) for episode in episodes]
 
     def airingtoday(self):
@@ -294,19 +262,24 @@ class Episodes(object):
         return self.nextaired(0)
 
     @staticmethod
-    def create_grouped_entry(tvshow_episodes):
-        '''helper for grouped episodes'''
-        firstepisode = tvshow_episodes[0]
-        if len(tvshow_episodes) > 2:
+    def get_next_refresh(now):
+        '''the unaired, nextaired and airingtoday widgets change at (local) midnight'''
+        tomorrow = datetime.date.fromtimestamp(now) + datetime.timedelta(days=1)
+        return time.mktime(tomorrow.timetuple()) + 60
+
+    @staticmethod
+    def create_grouped_entry(firstepisode, episode_count):
+        '''helper for grouped episodes: the newest episode of a group of episode_count episodes'''
+        if episode_count > 2:
             # add as season entry if there were multiple episodes for the same show
             # use first episode as reference to keep the correct sorting order
             item = firstepisode
             item["type"] = "season"
             item["label"] = "%s %s" % (xbmc.getLocalizedString(20373), firstepisode["season"])
             item["plot"] = u"[B]%s[/B] • %s %s[CR]%s: %s"\
-                % (item["label"], len(tvshow_episodes), xbmc.getLocalizedString(20387),
+                % (item["label"], episode_count, xbmc.getLocalizedString(20387),
                    xbmc.getLocalizedString(570), firstepisode["dateadded"].split(" ")[0])
-            item["extraproperties"] = {"UnWatchedEpisodes": "%s" % len(tvshow_episodes)}
+            item["extraproperties"] = {"UnWatchedEpisodes": "%s" % episode_count}
             return item
         # just add the single item
         return firstepisode
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    imdb_index.py
+    imdb id -> library id index of the movies and tvshows, maintained by the service on library changes,
+    and the top250 matches of the library, recomputed only when the index or the imdb top250 changes
+'''
+
+import json
+import time
+from hashlib import md5
+import xbmcgui
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file, log_msg, KODI_VERSION
+from resources.lib.library_mirror import get_item_details
+
+# bump when the stored format changes, the index is rebuilt
+INDEX_FORMAT = 1
+# the service publishes the version of the index it keeps current in this window property,
+# the plugin ignores a stored index which doesn't match (e.g. when the service doesn't run)
+INDEX_PROPERTY = "SkinHelper.Widgets.ImdbIndex"
+# indexed mediatypes and their id field
+ID_FIELDS = {"movies": "movieid", "tvshows": "tvshowid"}
+LIST_METHODS = {"movies": "VideoLibrary.GetMovies", "tvshows": "VideoLibrary.GetTVShows"}
+
+
+def get_raw_id(item):
+    '''the imdb id of a library item, or the id of its scraper (e.g. the tvdb id of a tvshow) if it has none'''
+    imdbnumber = item.get("imdbnumber") or ""
+    if imdbnumber.startswith("tt"):
+        return imdbnumber
+    uniqueid = item.get("uniqueid") or {}
+    for value in (uniqueid.values() if isinstance(uniqueid, dict) else uniqueid):
+        if value.startswith("tt"):
+            return value
+    return imdbnumber
+
+
+def resolve_imdb_id(metadatautils, media_type, raw_id):
+    '''the imdb id for the raw id of an item, a tvdb id of a tvshow is looked up'''
+    if not raw_id or raw_id.startswith("tt"):
+        return raw_id
+    if media_type == "tvshows":
+        tvdb_info = metadatautils.thetvdb.get_series(raw_id)
+        if tvdb_info:
+            return tvdb_info["imdbnumber"]
+    return ""
+
+
+def get_raw_ids(metadatautils, media_type, filters=None):
+    '''returns the raw ids of the library items (matching the filters) in one query: item id -> raw id'''
+    fields = ["imdbnumber"]
+    if KODI_VERSION > 16:
+        fields.append("uniqueid")
+    all_items = metadatautils.kodidb.get_json(LIST_METHODS[media_type], fields=fields, returntype=media_type,
+                                              filters=filters or [])
+    return dict((item[ID_FIELDS[media_type]], get_raw_id(item)) for item in all_items)
+
+
+class ImdbIndex(object):
+    '''per mediatype the raw id and imdb id of every item, and the reverse lookup imdb id -> item id'''
+
+    def __init__(self, data=None):
+        '''Initialization'''
+        self.filename = get_profile_path("imdb_index.json")
+        if data is None:
+            # the service continues from the stored index, it's reconciled with the library before it's published
+            data = read_json_file(self.filename)
+            if not data or data.get("format") != INDEX_FORMAT:
+                data = {"format": INDEX_FORMAT, "version": "", "movies": {}, "tvshows": {}}
+        self.data = data
+        self.lookups = {}
+
+    @classmethod
+    def load(cls):
+        '''returns the stored index, None if the service doesn't keep it current'''
+        data = read_json_file(get_profile_path("imdb_index.json"))
+        if not data or data.get("format") != INDEX_FORMAT or \
+                data.get("version") != xbmcgui.Window(10000).getProperty(INDEX_PROPERTY):
+            return None
+        return cls(data)
+
+    def save(self, win, changed):
+        '''store the index, it gets a new version only if an imdb id changed, and publish its version'''
+        if changed or not self.data["version"]:
+            self.data["version"] = "%s" % time.time()
+            write_json_file(self.filename, self.data)
+        win.setProperty(INDEX_PROPERTY, self.data["version"])
+
+    def set_items(self, metadatautils, media_type, raw_ids, removed_ids):
+        '''store the raw ids of the given items, returns True if an imdb id changed'''
+        items = self.data[media_type]
+        changed = False
+        for item_id, raw_id in raw_ids.items():
+            key = "%s" % item_id
+            if items.get(key, [None])[0] == raw_id:
+                # keep the resolved imdb id, the tvdb lookups are only done once per show
+                continue
+            items[key] = [raw_id, resolve_imdb_id(metadatautils, media_type, raw_id)]
+            changed = True
+        for item_id in removed_ids:
+            changed = items.pop("%s" % item_id, None) is not None or changed
+        self.lookups.pop(media_type, None)
+        return changed
+
+    def reconcile(self, metadatautils, media_type):
+        '''compare all items of a mediatype with the library, returns True if an imdb id changed'''
+        raw_ids = get_raw_ids(metadatautils, media_type)
+        removed_ids = [key for key in self.data[media_type] if int(key) not in raw_ids]
+        changed = self.set_items(metadatautils, media_type, raw_ids, removed_ids)
+        log_msg("ImdbIndex: reconciled %s %s" % (len(raw_ids), media_type))
+        return changed
+
+    def update(self, metadatautils, media_type, changed_ids, removed_ids):
+        '''update the given items of a mediatype, returns True if an imdb id changed'''
+        raw_ids = {}
+        for item_id, item in zip(changed_ids, get_item_details(media_type, list(changed_ids))):
+            if item:
+                raw_ids[item_id] = get_raw_id(item)
+            else:
+                removed_ids = list(removed_ids) + [item_id]
+        return self.set_items(metadatautils, media_type, raw_ids, removed_ids)
+
+    def get_lookup(self, media_type):
+        '''returns the imdb id -> item id lookup of a mediatype'''
+        if media_type not in self.lookups:
+            self.lookups[media_type] = dict((imdb_id, int(key)) for key, (_, imdb_id)
+                                            in self.data[media_type].items() if imdb_id)
+        return self.lookups[media_type]
+
+
+def get_imdb_lookup(metadatautils, media_type):
+    '''the imdb id -> item id lookup of a mediatype from the index, from one library query if the index is missing'''
+    index = ImdbIndex.load()
+    if index:
+        return index.get_lookup(media_type), index.data["version"]
+    lookup = {}
+    for item_id, raw_id in get_raw_ids(metadatautils, media_type).items():
+        imdb_id = resolve_imdb_id(metadatautils, media_type, raw_id)
+        if imdb_id:
+            lookup[imdb_id] = item_id
+    return lookup, None
+
+
+def get_matches(lookup, imdb_ids):
+    '''the [item id, position] of the library items in the given list of imdb ids, by position'''
+    positions = {}
+    for position, imdb_id in enumerate(imdb_ids):
+        positions.setdefault(imdb_id, position)
+    return sorted(([lookup[imdb_id], position] for imdb_id, position in positions.items() if imdb_id in lookup),
+                  key=lambda x: x[1])
+
+
+def get_top250_matches(metadatautils, media_type):
+    '''
+        the [item id, rank] of the library items in the imdb top250, by rank. Stored with the versions of the
+        index and the top250 they were computed from, so they are only recomputed when one of them changes.
+    '''
+    top_250 = metadatautils.imdb.get_top250_db()
+    lookup, index_version = get_imdb_lookup(metadatautils, media_type)
+    top250_version = md5(json.dumps(top_250, sort_keys=True).encode("utf-8")).hexdigest()
+    filename = get_profile_path("top250.json")
+    stored = read_json_file(filename, {})
+    if index_version and stored.get(media_type, {}).get("versions") == [index_version, top250_version]:
+        return stored[media_type]["matches"]
+    matches = sorted(([lookup[imdb_id], int(rank)] for imdb_id, rank in top_250.items() if imdb_id in lookup),
+                     key=lambda x: x[1])
+    if index_version:
+        stored[media_type] = {"versions": [index_version, top250_version], "matches": matches}
+        write_json_file(filename, stored)
+    return matches
@@ -8,11 +8,29 @@
 '''
 
 import os, sys
-from resources.lib.utils import log_msg
+import threading
+from resources.lib.utils import log_msg, ADDON_ID
+from resources.lib.prewarm import VIDEO_WIDGET_TYPES, MUSIC_WIDGET_TYPES, WIDGET_TYPES
+from resources.lib.registry import get_change_predicates, create_change, merge_changes, PREDICATE_RANDOM, \
+    REVALIDATE_MESSAGE
 import xbmc
 import time
 import json
 
+# all window properties the skins use as reload parameter for the widgets
+ALL_RELOAD_PROPERTIES = ["widgetreload", "widgetreloadmusic", "widgetreload2"] + \
+    ["widgetreload-%s" % media_type for media_type in
+     ["episodes", "tvshows", "music", "songs", "albums", "artists", "movies", "musicvideos", "media", "pvr"]]
+# the only notifications we are interested in, all others are ignored before parsing the data
+NOTIFICATION_METHODS = ["VideoLibrary.OnUpdate", "VideoLibrary.OnRemove", "AudioLibrary.OnUpdate",
+                        "AudioLibrary.OnRemove", "Player.OnStop", "Other.%s" % REVALIDATE_MESSAGE]
+# a burst of library changes is published when no new change arrived for SETTLE_TIME seconds
+# or at the latest MAX_LATENCY seconds after the first change of the burst
+SETTLE_TIME = 2
+MAX_LATENCY = 10
+# the same widget listing is revalidated at most once in this amount of seconds
+REVALIDATE_INTERVAL = 60
+
 
 class KodiMonitor(xbmc.Monitor):
     '''Monitor all events in Kodi'''
@@ -23,6 +41,11 @@ class KodiMonitor(xbmc.Monitor):
         xbmc.Monitor.__init__(self)
         self.win = kwargs.get("win")
         self.addon = kwargs.get("addon")
+        self.prewarmer = kwargs.get("prewarmer")
+        self.scheduler = kwargs.get("scheduler")
+        self.airing_refresher = kwargs.get("airing_refresher")
+        self.coalescer = NotificationCoalescer(self.publish_changes, self.scheduler)
+        self.revalidated = {}
 
     def onDatabaseUpdated(self, database):
         '''builtin function for the xbmc.Monitor class'''
@@ -31,9 +54,19 @@ class KodiMonitor(xbmc.Monitor):
             self.refresh_music_widgets("")
         else:
             self.refresh_video_widgets("")
+            if self.airing_refresher:
+                # fetch the schedules of new shows
+                self.airing_refresher.refresh()
+
+    def onCleanFinished(self, library):
+        '''builtin function for the xbmc.Monitor class'''
+        # a clean may remove items in bulk, the library mirror needs a full resync
+        self.onDatabaseUpdated(library)
 
     def onNotification(self, sender, method, data):
         '''builtin function for the xbmc.Monitor class'''
+        if method not in NOTIFICATION_METHODS:
+            return
         try:
             log_msg("Kodi_Monitor: sender %s - method: %s  - data: %s" % (sender, method, data))
             if sys.version_info.major == 3:
@@ -41,22 +74,37 @@ class KodiMonitor(xbmc.Monitor):
             else:
                 data = json.loads(data.decode('utf-8'))
             mediatype = ""
+            item_id = None
             if data and isinstance(data, dict):
                 if data.get("item"):
                     mediatype = data["item"].get("type", "")
+                    item_id = data["item"].get("id")
                 elif data.get("type"):
                     mediatype = data["type"]
+                    item_id = data.get("id")
+            else:
+                data = {}
 
-            if method == "VideoLibrary.OnUpdate":
+            if method in ["VideoLibrary.OnUpdate", "VideoLibrary.OnRemove"]:
                 if not mediatype:
                     mediatype = self.last_mediatype # temp hack
-                self.refresh_video_widgets(mediatype)
+                    item_id = None
+                self.refresh_video_widgets(mediatype, item_id,
+                                           get_change_predicates(method, data) if item_id else None,
+                                           method.endswith("OnRemove"))
 
-            if method == "AudioLibrary.OnUpdate":
-                self.refresh_music_widgets(mediatype)
+            if method in ["AudioLibrary.OnUpdate", "AudioLibrary.OnRemove"]:
+                self.refresh_music_widgets(mediatype, item_id,
+                                           get_change_predicates(method, data) if item_id else None,
+                                           method.endswith("OnRemove"))
+
+            if method == "Other.%s" % REVALIDATE_MESSAGE and sender == ADDON_ID:
+                self.revalidate_widget(data["cache_str"], data["checksum"])
 
             if method == "Player.OnStop":
                 self.last_mediatype = mediatype
+                if mediatype in ["movie", "episode"] and item_id and self.prewarmer:
+                    self.prewarmer.add_watched(mediatype, item_id, data.get("end", False))
                 if mediatype in ["movie", "episode", "musicvideo"]:
                     if self.addon.getSetting("aggresive_refresh") == "true":
                         self.refresh_video_widgets(mediatype)
@@ -64,24 +112,65 @@ class KodiMonitor(xbmc.Monitor):
         except Exception as exc:
             log_msg("Exception in KodiMonitor: %s" % exc, xbmc.LOGERROR)
 
-    def refresh_music_widgets(self, media_type):
+    def refresh_music_widgets(self, media_type, item_id=None, predicates=None, removed=False):
         '''refresh music widgets'''
         log_msg("Music database changed - type: %s - refreshing widgets...." % media_type)
-        timestr = time.strftime("%Y%m%d%H%M%S", time.gmtime())
-        self.win.setProperty("widgetreload-music", timestr)
-        self.win.setProperty("widgetreloadmusic", timestr)
+        properties = ["widgetreload-music", "widgetreloadmusic", "widgetreload2"]
         if media_type:
-            self.win.setProperty("widgetreload-%ss" % media_type, timestr)
+            properties.append("widgetreload-%ss" % media_type)
+        self.coalescer.add(create_change(MUSIC_WIDGET_TYPES, media_type, item_id, predicates, removed), properties)
 
-    def refresh_video_widgets(self, media_type):
+    def refresh_video_widgets(self, media_type, item_id=None, predicates=None, removed=False):
         '''refresh video widgets'''
         log_msg("Video database changed - type: %s - refreshing widgets...." % media_type)
-        timestr = time.strftime("%Y%m%d%H%M%S", time.gmtime())
-        self.win.setProperty("widgetreload", timestr)
+        properties = ["widgetreload", "widgetreload2"]
         if media_type:
-            self.win.setProperty("widgetreload-%ss" % media_type, timestr)
+            properties.append("widgetreload-%ss" % media_type)
             if "episode" in media_type:
-                self.win.setProperty("widgetreload-tvshows", timestr)
+                properties.append("widgetreload-tvshows")
+        widget_types = VIDEO_WIDGET_TYPES.get(media_type, VIDEO_WIDGET_TYPES[""])
+        self.coalescer.add(create_change(widget_types, media_type, item_id, predicates, removed), properties)
+
+    def revalidate_widget(self, cache_str, checksum):
+        '''refresh an outdated widget listing the plugin served from the cache and let the skin reload it'''
+        now = time.time()
+        if now - self.revalidated.get(cache_str, 0) < REVALIDATE_INTERVAL:
+            # don't keep on refreshing a listing which fails to compute
+            return
+        # forget the listings which are no longer rate limited
+        self.revalidated = dict((key, value) for key, value in self.revalidated.items()
+                                if now - value < REVALIDATE_INTERVAL)
+        self.revalidated[cache_str] = now
+        log_msg("Kodi_Monitor: revalidate widget listing %s" % cache_str)
+        properties = [prop for prop in ALL_RELOAD_PROPERTIES if self.win.getProperty(prop) == checksum]
+        change = create_change([], predicates=[])
+        change["revalidate"][cache_str] = checksum
+        self.coalescer.add(change, properties)
+
+    def publish_changes(self, change, properties):
+        '''let the prewarmer refresh the affected widgets before the reload properties are set'''
+        if self.prewarmer:
+            self.prewarmer.refresh(change, properties)
+        else:
+            timestr = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+            for prop in properties:
+                self.win.setProperty(prop, timestr)
+
+    def schedule_refresh(self, name, get_next_refresh, widget_types, predicates):
+        '''let a widget type refresh its listings at its own deadlines'''
+        def refresh_job():
+            '''publish the refresh and return the next deadline'''
+            self.refresh_widget_types(widget_types, predicates)
+            return get_next_refresh(time.time())
+        deadline = get_next_refresh(time.time())
+        if deadline:
+            self.scheduler.schedule(name, deadline, refresh_job)
+        else:
+            self.scheduler.cancel(name)
+
+    def refresh_widget_types(self, widget_types, predicates):
+        '''refresh the listings of the given widget types, e.g. after the data they show changed outside the library'''
+        self.publish_changes(create_change(widget_types, predicates=predicates), get_reload_properties(widget_types))
 
     def onSettingsChanged(self):
         '''called by Kodi when the addon settings are changed'''
@@ -91,3 +180,65 @@ class KodiMonitor(xbmc.Monitor):
         self.win.setProperty("widgetreload2", timestr)
         for media_type in ["episodes", "tvshows", "music", "songs", "albums", "movies", "musicvideos"]:
             self.win.setProperty("widgetreload-%s" % media_type, timestr)
+        self.schedule_random_rotation()
+
+    def schedule_random_rotation(self):
+        '''refresh the random widgets at the interval configured in the addon settings'''
+        interval = int(self.addon.getSetting("random_rotation") or 0) * 60
+
+        def get_next_refresh(now):
+            '''next rotation of the random widgets'''
+            return now + interval if interval else None
+        self.schedule_refresh("random", get_next_refresh, WIDGET_TYPES, [PREDICATE_RANDOM])
+
+
+def get_reload_properties(widget_types):
+    '''
+        the reload properties to publish for a refresh of the given widget types outside of library changes:
+        the property of every widget type and the generic one of the widgets which change over time
+    '''
+    return ["widgetreload2"] + ["widgetreload-%s" % widget_type for widget_type in widget_types]
+
+
+class NotificationCoalescer(object):
+    '''collects the library changes of a burst of notifications and publishes them as one refresh'''
+
+    def __init__(self, callback, scheduler):
+        '''Initialization'''
+        self.callback = callback
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.change = None
+        self.properties = set()
+        self.first_change = 0
+        self.last_change = 0
+
+    def add(self, change, properties):
+        '''add a library change to the pending burst'''
+        with self.lock:
+            if self.change:
+                merge_changes(self.change, change)
+            else:
+                self.change = change
+                self.first_change = time.time()
+            self.last_change = time.time()
+            self.properties.update(properties)
+            due_time = self.due_time()
+        self.scheduler.schedule("coalescer", due_time, self.flush)
+
+    def due_time(self):
+        '''returns the time the pending burst should be published'''
+        return min(self.last_change + SETTLE_TIME, self.first_change + MAX_LATENCY)
+
+    def flush(self):
+        '''scheduler job: publish the pending burst once it settled'''
+        with self.lock:
+            if not self.change:
+                return None
+            if time.time() < self.due_time():
+                return self.due_time()
+            change, properties = self.change, list(self.properties)
+            self.change = None
+            self.properties = set()
+        self.callback(change, properties)
+        return None
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    leases.py
+    cross process locks for the plugin processes kodi launches in parallel
+'''
+
+import os
+import time
+import xbmc
+from resources.lib.utils import get_profile_path, log_msg
+
+# a lease expires after this amount of seconds, so a crashed plugin process can't block the others
+LEASE_TIME = 60
+# interval in seconds at which a waiting process checks a held lease
+POLL_INTERVAL = 0.1
+
+
+class Lease(object):
+    '''
+        lock on a name shared by all plugin processes: the process which created the lock file
+        holds the lease until it releases it or the lease expires
+    '''
+
+    def __init__(self, name, lease_time=LEASE_TIME):
+        '''Initialization'''
+        self.filename = get_profile_path("locks", "%s.lock" % name)
+        self.lease_time = lease_time
+        self.acquired = False
+
+    def acquire(self):
+        '''try to take the lease, returns False if it is held by another process'''
+        for _ in range(2):
+            try:
+                os.close(os.open(self.filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                self.acquired = True
+                break
+            except OSError:
+                if not self.is_expired():
+                    break
+                # break the lease of a crashed process and try again
+                log_msg("Lease %s expired, taking over" % self.filename, xbmc.LOGWARNING)
+                self.remove()
+        return self.acquired
+
+    def is_expired(self):
+        '''checks if the lease (held by any process) is released or expired'''
+        try:
+            return os.path.getmtime(self.filename) + self.lease_time < time.time()
+        except OSError:
+            return True
+
+    def wait(self, timeout=LEASE_TIME):
+        '''wait until another process released the lease, returns False on timeout or kodi exit'''
+        monitor = xbmc.Monitor()
+        end_time = time.time() + timeout
+        released = False
+        while time.time() < end_time and not monitor.abortRequested():
+            if self.is_expired():
+                released = True
+                break
+            monitor.waitForAbort(POLL_INTERVAL)
+        del monitor
+        return released
+
+    def release(self):
+        '''release the lease if we hold it'''
+        if self.acquired:
+            self.remove()
+            self.acquired = False
+
+    def remove(self):
+        '''remove the lock file'''
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+def acquire_slot(name, slots, timeout=LEASE_TIME):
+    '''
+        take one of a fixed amount of leases to cap the number of processes doing the same expensive work,
+        returns the lease or None if no slot came free within the timeout
+    '''
+    leases = [Lease("%s.%s" % (name, slot)) for slot in range(slots)]
+    monitor = xbmc.Monitor()
+    end_time = time.time() + timeout
+    result = None
+    while not result and time.time() < end_time and not monitor.abortRequested():
+        for lease in leases:
+            if lease.acquire():
+                result = lease
+                break
+        else:
+            monitor.waitForAbort(POLL_INTERVAL)
+    del monitor
+    return result
@@ -0,0 +1,453 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    library_mirror.py
+    in-memory copy of the kodi library kept by the service, queried by the plugin over a local socket
+'''
+
+import os, sys
+import json
+import socket
+from hashlib import md5
+import tempfile
+import threading
+if sys.version_info.major == 3:
+    import socketserver
+else:
+    import SocketServer as socketserver
+import xbmc
+from resources.lib.utils import log_msg, log_exception, ADDON_ID
+from resources.lib.stats import timed_rpc
+
+# mirrored mediatypes and their id field
+MIRROR_TYPES = {
+    "movies": "movieid",
+    "tvshows": "tvshowid",
+    "episodes": "episodeid",
+    "albums": "albumid",
+    "songs": "songid"
+}
+# sort methods we keep a sorted index for
+SORT_INDEXES = ["dateadded", "lastplayed", "rating"]
+# list fields we keep a lookup index for
+SET_INDEXES = ["genre", "tag"]
+# the filter rules the mirror can evaluate
+SUPPORTED_FILTERS = {
+    "inprogress": ["true", "false"],
+    "playcount": ["is", "isnot", "lessthan", "greaterthan"],
+    "rating": ["is", "isnot", "lessthan", "greaterthan"],
+    "year": ["is", "isnot", "lessthan", "greaterthan"],
+    "genre": ["is", "isnot", "contains"],
+    "tag": ["is", "isnot", "contains"]
+}
+# fields fetched for the content checksum of a table, a resync only fetches the full rows which differ
+CHECKSUM_FIELDS = {
+    "movies": ("VideoLibrary.GetMovies", ["playcount", "lastplayed", "dateadded", "resume"]),
+    "tvshows": ("VideoLibrary.GetTVShows", ["watchedepisodes", "episode", "lastplayed", "dateadded"]),
+    "episodes": ("VideoLibrary.GetEpisodes", ["playcount", "lastplayed", "dateadded", "resume"]),
+    "albums": ("AudioLibrary.GetAlbums", ["playcount", "lastplayed"]),
+    "songs": ("AudioLibrary.GetSongs", ["playcount", "lastplayed", "dateadded"])
+}
+# above this amount of differing rows a resync reloads the complete table
+MAX_DELTA_ROWS = 50
+SOCKET_TIMEOUT = 5
+# the json api method, id param, result key and fields (the name of the kodi_constants list) to get
+# the details of an item
+DETAILS_METHODS = {
+    "movies": ("VideoLibrary.GetMovieDetails", "movieid", "moviedetails", "FIELDS_MOVIES"),
+    "tvshows": ("VideoLibrary.GetTVShowDetails", "tvshowid", "tvshowdetails", "FIELDS_TVSHOWS"),
+    "episodes": ("VideoLibrary.GetEpisodeDetails", "episodeid", "episodedetails", "FIELDS_EPISODES")
+}
+
+
+def get_socket_path():
+    '''returns the path of the unix socket the service listens on, None if not supported on this platform'''
+    if not hasattr(socket, "AF_UNIX") or not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        return None
+    return os.path.join(tempfile.gettempdir(), "%s-%s.sock" % (ADDON_ID, os.getuid()))
+
+
+class UnsupportedQuery(Exception):
+    '''raised when a query uses a filter or sort method the mirror can't answer'''
+    pass
+
+
+class LibraryMirror(object):
+    '''all mirrored library items with their secondary indexes'''
+
+    def __init__(self):
+        '''Initialization'''
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.indexes = {}
+        self.checksums = {}
+
+    def is_loaded(self, media_type):
+        '''returns True if the given mediatype is available in the mirror'''
+        return media_type in self.tables
+
+    def load(self, metadatautils, media_types=None):
+        '''(re)load the complete table for the given mediatypes from the kodi json api'''
+        for media_type in media_types or MIRROR_TYPES.keys():
+            id_field = MIRROR_TYPES[media_type]
+            all_items = getattr(metadatautils.kodidb, media_type)()
+            table = dict((item[id_field], item) for item in all_items)
+            self.set_table(media_type, table)
+            log_msg("LibraryMirror: loaded %s %s" % (len(table), media_type))
+
+    def update(self, metadatautils, change):
+        '''apply a library change: patch the changed rows, resync the tables when the change has no details'''
+        resynced = []
+        if change["unknown"]:
+            # e.g. after a library scan or clean, we don't know which rows changed
+            for media_type in change["widget_types"]:
+                if media_type in MIRROR_TYPES:
+                    self.resync(metadatautils, media_type)
+                    resynced.append(media_type)
+        removed = change.get("removed", {})
+        for dbtype, ids in change["items"].items():
+            media_type = "%ss" % dbtype
+            if media_type not in MIRROR_TYPES or media_type in resynced:
+                continue
+            if not self.is_loaded(media_type):
+                self.load(metadatautils, [media_type])
+                continue
+            try:
+                self.patch(metadatautils, media_type, ids.difference(removed.get(dbtype, [])),
+                           ids.intersection(removed.get(dbtype, [])))
+            except Exception as exc:
+                # don't serve a mirror with a gap
+                log_exception(__name__, exc)
+                self.resync(metadatautils, media_type)
+
+    def patch(self, metadatautils, media_type, changed_ids, removed_ids):
+        '''fetch the changed rows of a table (one call per row) and drop the removed ones'''
+        get_item = getattr(metadatautils.kodidb, media_type[:-1])
+        with self.lock:
+            table = self.tables[media_type]
+        # the watched counts of a tvshow change with its episodes
+        tvshow_ids = set(table[item_id]["tvshowid"] for item_id in removed_ids
+                         if media_type == "episodes" and table.get(item_id, {}).get("tvshowid"))
+        rows = {}
+        for item_id in changed_ids:
+            rows[item_id] = get_item(item_id) or None
+            if media_type == "episodes" and rows[item_id] and rows[item_id].get("tvshowid"):
+                tvshow_ids.add(rows[item_id]["tvshowid"])
+        for item_id in removed_ids:
+            rows[item_id] = None
+        self.patch_table(media_type, rows)
+        log_msg("LibraryMirror: patched %s rows of %s" % (len(rows), media_type))
+        if tvshow_ids and self.is_loaded("tvshows"):
+            self.patch(metadatautils, "tvshows", tvshow_ids, [])
+
+    def resync(self, metadatautils, media_type):
+        '''compare the content checksum of a table with the kodi database, fetch only the rows which differ'''
+        if not self.is_loaded(media_type):
+            self.load(metadatautils, [media_type])
+            return
+        method, fields = CHECKSUM_FIELDS[media_type]
+        id_field = MIRROR_TYPES[media_type]
+        all_items = metadatautils.kodidb.get_json(method, fields=fields, returntype=media_type)
+        signatures = dict((item[id_field], get_signature(item, fields)) for item in all_items)
+        with self.lock:
+            table = self.tables[media_type]
+            checksum = self.checksums[media_type]
+        if get_checksum(signatures) == checksum:
+            log_msg("LibraryMirror: %s unchanged" % media_type)
+            return
+        changed_ids = [item_id for item_id, signature in signatures.items()
+                       if item_id not in table or get_signature(table[item_id], fields) != signature]
+        removed_ids = [item_id for item_id in table if item_id not in signatures]
+        if len(changed_ids) > MAX_DELTA_ROWS:
+            self.load(metadatautils, [media_type])
+        else:
+            self.patch(metadatautils, media_type, changed_ids, removed_ids)
+
+    def patch_table(self, media_type, rows):
+        '''replace (or remove if None) the given rows of a table'''
+        with self.lock:
+            table = dict(self.tables[media_type])
+        for item_id, item in rows.items():
+            if item:
+                table[item_id] = item
+            else:
+                table.pop(item_id, None)
+        self.set_table(media_type, table)
+
+    def set_table(self, media_type, table):
+        '''replace the table of the given mediatype and rebuild its indexes'''
+        indexes = build_indexes(table)
+        fields = CHECKSUM_FIELDS[media_type][1]
+        checksum = get_checksum(dict((item_id, get_signature(item, fields)) for item_id, item in table.items()))
+        with self.lock:
+            self.tables[media_type] = table
+            self.indexes[media_type] = indexes
+            self.checksums[media_type] = checksum
+
+    def get_item(self, media_type, item_id):
+        '''returns a single mirrored item, None if not available'''
+        with self.lock:
+            return self.tables.get(media_type, {}).get(item_id)
+
+    def get_table(self, media_type):
+        '''returns the table (id -> item) of the given mediatype, it is replaced (not changed) on updates'''
+        with self.lock:
+            return self.tables.get(media_type)
+
+    def get_items(self, media_type, ids):
+        '''returns the mirrored items with the given ids (None for unknown ids)'''
+        with self.lock:
+            table = self.tables.get(media_type)
+        if table is None:
+            raise UnsupportedQuery("%s not loaded" % media_type)
+        return [table.get(item_id) for item_id in ids]
+
+    def query(self, media_type, sort=None, filters=None, limits=None):
+        '''returns the items matching the kodi style sort, filters and limits'''
+        with self.lock:
+            table = self.tables.get(media_type)
+            indexes = self.indexes.get(media_type)
+        if table is None:
+            raise UnsupportedQuery("%s not loaded" % media_type)
+        if sort:
+            if not indexes.get(sort.get("method")):
+                raise UnsupportedQuery("sort method %s" % sort.get("method"))
+            ordered_ids = indexes[sort["method"]]
+            if sort.get("order") != "descending":
+                ordered_ids = reversed(ordered_ids)
+        else:
+            ordered_ids = table.keys()
+        start, end = limits if limits else (0, None)
+        candidates = None
+        for rule in filters or []:
+            if rule.get("operator") not in SUPPORTED_FILTERS.get(rule.get("field"), []):
+                raise UnsupportedQuery("filter %s %s" % (rule.get("field"), rule.get("operator")))
+            # use the lookup indexes to limit the candidates where possible
+            if rule.get("field") in SET_INDEXES and rule.get("operator") == "is":
+                ids = indexes[rule["field"]].get(rule["value"].lower(), set())
+                candidates = ids if candidates is None else candidates.intersection(ids)
+            elif rule.get("field") == "inprogress" and rule.get("operator") == "true":
+                candidates = indexes["inprogress"] if candidates is None else \
+                    candidates.intersection(indexes["inprogress"])
+        result = []
+        count = 0
+        for item_id in ordered_ids:
+            if candidates is not None and item_id not in candidates:
+                continue
+            item = table[item_id]
+            if all(match_rule(item, rule) for rule in filters or []):
+                if count >= start:
+                    result.append(item)
+                count += 1
+                if end is not None and count >= end:
+                    break
+        return result
+
+
+def build_indexes(table):
+    '''build the secondary indexes for a mirrored table'''
+    indexes = {"inprogress": set()}
+    for index in SORT_INDEXES:
+        if all(index in item for item in table.values()):
+            indexes[index] = sorted(table, key=lambda key: table[key][index], reverse=True)
+        else:
+            # the field is not available for this mediatype
+            indexes[index] = None
+    for index in SET_INDEXES:
+        indexes[index] = {}
+    for key, item in table.items():
+        for index in SET_INDEXES:
+            for value in item.get(index) or []:
+                indexes[index].setdefault(value.lower(), set()).add(key)
+        if is_inprogress(item):
+            indexes["inprogress"].add(key)
+    return indexes
+
+
+def is_inprogress(item):
+    '''
+        the kodi inprogress flag of a mirrored item: a movie or episode with a resume position,
+        a tvshow with some but not all episodes watched. None if the item has neither.
+    '''
+    if "resume" in item:
+        return bool(item["resume"].get("position"))
+    if "watchedepisodes" in item and "episode" in item:
+        return 0 < item["watchedepisodes"] < item["episode"]
+    return None
+
+
+def get_signature(item, fields):
+    '''the values of the checksum fields of a single row'''
+    return json.dumps([item.get(field) for field in fields], sort_keys=True)
+
+
+def get_checksum(signatures):
+    '''content checksum of a table from the signatures of its rows'''
+    return md5(json.dumps(sorted(signatures.items())).encode("utf-8")).hexdigest()
+
+
+def match_rule(item, rule):
+    '''evaluate a single kodi filter rule against a mirrored item'''
+    field = rule.get("field")
+    operator = rule.get("operator")
+    value = rule.get("value")
+    if field == "inprogress":
+        actual = is_inprogress(item)
+        if actual is None:
+            raise UnsupportedQuery("field %s" % field)
+        return actual == (operator == "true")
+    if field in ["playcount", "rating", "year"]:
+        if field not in item:
+            raise UnsupportedQuery("field %s" % field)
+        actual = float(item[field] or 0)
+        value = float(value)
+        if operator == "is":
+            return actual == value
+        if operator == "isnot":
+            return actual != value
+        if operator == "lessthan":
+            return actual < value
+        if operator == "greaterthan":
+            return actual > value
+    elif field in SET_INDEXES:
+        if field not in item:
+            raise UnsupportedQuery("field %s" % field)
+        actual = [entry.lower() for entry in item[field]]
+        value = value.lower()
+        if operator == "is":
+            return value in actual
+        if operator == "isnot":
+            return value not in actual
+        if operator == "contains":
+            return any(value in entry for entry in actual)
+    raise UnsupportedQuery("filter %s %s" % (field, operator))
+
+
+class MirrorRequestHandler(socketserver.StreamRequestHandler):
+    '''answers a single json query from a plugin process'''
+
+    def handle(self):
+        '''read the query line and write the result line'''
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            if "ids" in request:
+                result = self.server.mirror.get_items(request["mediatype"], request["ids"])
+            else:
+                result = self.server.mirror.query(request["mediatype"], request.get("sort"),
+                                                  request.get("filters"), request.get("limits"))
+            response = {"items": result}
+        except UnsupportedQuery as exc:
+            response = {"error": "%s" % exc}
+        except Exception as exc:
+            log_exception(__name__, exc)
+            response = {"error": "%s" % exc}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class MirrorServer(threading.Thread):
+    '''serves the library mirror to the plugin processes over a local unix socket'''
+
+    def __init__(self, mirror):
+        '''Initialization'''
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.mirror = mirror
+        self.server = None
+
+    def run(self):
+        '''listen for queries until stopped'''
+        socket_path = get_socket_path()
+        if not socket_path:
+            log_msg("LibraryMirror: unix sockets not supported on this platform, mirror disabled")
+            return
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(socket_path, MirrorRequestHandler)
+        self.server.daemon_threads = True
+        self.server.mirror = self.mirror
+        self.server.serve_forever()
+
+    def stop(self):
+        '''stop listening and remove the socket'''
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            if os.path.exists(get_socket_path()):
+                os.remove(get_socket_path())
+
+
+def query_mirror(media_type, sort=None, filters=None, limits=None, ids=None):
+    '''query the service's library mirror, returns None if the mirror can't answer'''
+    socket_path = get_socket_path()
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    request = {"mediatype": media_type, "sort": sort, "filters": filters, "limits": limits}
+    if ids is not None:
+        request = {"mediatype": media_type, "ids": ids}
+    response = timed_rpc("LibraryMirror.%s" % media_type, send_query, socket_path, request)
+    return response.get("items") if response else None
+
+
+def send_query(socket_path, request):
+    '''send a query to the mirror server, returns the response or None if it failed'''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(SOCKET_TIMEOUT)
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return json.loads(b"".join(chunks).decode("utf-8"))
+    except (socket.error, ValueError) as exc:
+        log_msg("LibraryMirror: query failed - %s" % exc)
+        return None
+    finally:
+        client.close()
+
+
+def get_library_items(metadatautils, media_type, sort=None, filters=None, limits=None):
+    '''get library items from the service's mirror, falls back to the kodi json api'''
+    all_items = query_mirror(media_type, sort, filters, limits)
+    if all_items is None:
+        all_items = getattr(metadatautils.kodidb, media_type)(sort=sort, filters=filters, limits=limits)
+    return all_items
+
+
+def get_library_items_by_id(metadatautils, media_type, ids):
+    '''
+        get library items by their ids from the service's mirror, falls back to one kodi json api call per item.
+        Yields the items in the order of the ids, None for items which don't exist (anymore).
+    '''
+    all_items = query_mirror(media_type, ids=ids)
+    if all_items is not None:
+        for item in all_items:
+            yield item
+    elif media_type in DETAILS_METHODS:
+        for item in get_item_details(media_type, ids):
+            yield item
+    else:
+        get_item = getattr(metadatautils.kodidb, media_type[:-1])
+        for item_id in ids:
+            yield get_item(item_id) or None
+
+
+def get_item_details(media_type, ids):
+    '''returns the full details of the given movies, tvshows or episodes (None for unknown ids) in one request'''
+    if not ids:
+        return []
+    from metadatautils import kodi_constants
+    method, id_param, returntype, fields = DETAILS_METHODS[media_type]
+    fields = getattr(kodi_constants, fields)
+    # one batch of json rpc requests instead of one request per item
+    request = [{"jsonrpc": "2.0", "method": method, "id": item_id,
+                "params": {id_param: item_id, "properties": fields}} for item_id in ids]
+    response = json.loads(timed_rpc(method, xbmc.executeJSONRPC, json.dumps(request)))
+    details = dict((result["id"], result["result"][returntype]) for result in response
+                   if returntype in result.get("result", {}))
+    return [details.get(item_id) for item_id in ids]
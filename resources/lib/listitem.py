@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    listitem.py
+    create the kodi listitems for the (prepared) items of a widget listing, a cache hit doesn't need
+    to load metadatautils for it. Creates the same listitems as create_listitem of metadatautils' kodidb,
+    importing only that function would still run the whole metadatautils package.
+'''
+
+import xbmc
+import xbmcgui
+from resources.lib.utils import log_msg, log_exception, KODI_VERSION
+
+# the version of script.module.metadatautils whose kodidb.create_listitem this mirrors, the one addon.xml imports.
+# When the import is bumped, compare create_listitem with the new version and update this (a test checks it)
+METADATAUTILS_VERSION = "1.0.0"
+# the infolabels of the video items: infolabel -> item field
+VIDEO_INFOLABELS = {
+    "title": "title", "size": "size", "genre": "genre", "year": "year", "top250": "top250",
+    "tracknumber": "tracknumber", "rating": "rating", "playcount": "playcount", "overlay": "overlay",
+    "cast": "cast", "castandrole": "castandrole", "director": "director", "mpaa": "mpaa", "plot": "plot",
+    "plotoutline": "plotoutline", "originaltitle": "originaltitle", "sorttitle": "sorttitle",
+    "duration": "duration", "studio": "studio", "tagline": "tagline", "writer": "writer",
+    "tvshowtitle": "tvshowtitle", "premiered": "premiered", "status": "status", "code": "imdbnumber",
+    "imdbnumber": "imdbnumber", "aired": "aired", "credits": "credits", "album": "album", "artist": "artist",
+    "votes": "votes", "trailer": "trailer", "progress": "progresspercentage"
+}
+# the item types which don't have a kodi mediatype
+NO_MEDIATYPE = ["recording", "channel", "favourite", "genre", "categorie"]
+
+
+def get_infolabels(item, nodetype):
+    '''the infolabels of a prepared item'''
+    if nodetype == "Video":
+        infolabels = dict((label, item.get(field)) for label, field in VIDEO_INFOLABELS.items())
+        if item["type"] == "episode":
+            infolabels["season"] = item["season"]
+            infolabels["episode"] = item["episode"]
+        for field in ["dateadded", "date"]:
+            if field in item:
+                infolabels[field] = item[field]
+    else:
+        infolabels = {
+            "title": item.get("title"),
+            "size": item.get("size"),
+            "genre": item.get("genre"),
+            "year": item.get("year"),
+            "tracknumber": item.get("track"),
+            "album": item.get("album"),
+            "artist": " / ".join(item.get("artist") or []),
+            "rating": str(item.get("rating", 0)),
+            "lyrics": item.get("lyrics"),
+            "playcount": item.get("playcount")
+        }
+        for field in ["date", "duration"]:
+            if field in item:
+                infolabels[field] = item[field]
+    if KODI_VERSION > 16 and item["type"] not in NO_MEDIATYPE:
+        infolabels["mediatype"] = item["type"]
+        if nodetype == "Video" and "DBID" in item["extraproperties"]:
+            infolabels["dbid"] = item["extraproperties"]["DBID"]
+    if "lastplayed" in item:
+        infolabels["lastplayed"] = item["lastplayed"]
+    return infolabels
+
+
+def create_listitem(item):
+    '''returns the (path, listitem, isfolder) tuple of a prepared item, None if it can't be created'''
+    try:
+        if KODI_VERSION > 17:
+            liz = xbmcgui.ListItem(label=item.get("label", ""), label2=item.get("label2", ""), path=item["file"],
+                                   offscreen=True)
+        else:
+            liz = xbmcgui.ListItem(label=item.get("label", ""), label2=item.get("label2", ""), path=item["file"])
+        # only set the isplayable property if really needed
+        if item.get("isFolder", False):
+            liz.setProperty("IsPlayable", "false")
+        elif "plugin://script.skin.helper" not in item["file"]:
+            liz.setProperty("IsPlayable", "true")
+        nodetype = "Music" if item["type"] in ["song", "album", "artist"] else "Video"
+        for key, value in item["extraproperties"].items():
+            liz.setProperty(key, value)
+        if nodetype == "Video" and item.get("streamdetails"):
+            for stream_type in ["video", "audio", "subtitle"]:
+                liz.addStreamInfo(stream_type, item["streamdetails"].get(stream_type, {}))
+        liz.setInfo(type=nodetype, infoLabels=get_infolabels(item, nodetype))
+        # artwork
+        liz.setArt(item.get("art", {}))
+        if KODI_VERSION > 17:
+            if "icon" in item:
+                liz.setArt({"icon": item["icon"]})
+            if "thumbnail" in item:
+                liz.setArt({"thumb": item["thumbnail"]})
+        else:
+            if "icon" in item:
+                liz.setIconImage(item["icon"])
+            if "thumbnail" in item:
+                liz.setThumbnailImage(item["thumbnail"])
+        # add the series and season level to the contextmenu of the episode widgets
+        contextmenu = list(item.get("contextmenu", []))
+        if item["type"] in ["episode", "season"] and "season" in item and "tvshowid" in item:
+            contextmenu += [
+                (xbmc.getLocalizedString(20364), "ActivateWindow(Video,videodb://tvshows/titles/%s/,return)"
+                 % item["tvshowid"]),
+                (xbmc.getLocalizedString(20373), "ActivateWindow(Video,videodb://tvshows/titles/%s/%s/,return)"
+                 % (item["tvshowid"], item["season"]))]
+        if contextmenu:
+            liz.addContextMenuItems(contextmenu)
+        return (item["file"], liz, item.get("isFolder", False))
+    except Exception as exc:
+        log_exception(__name__, exc)
+        log_msg(item)
+        return None
+
+
+def create_listitems(all_items):
+    '''returns the listitem tuples of the prepared items, skipping the ones which can't be created'''
+    return [listitem for listitem in (create_listitem(item) for item in all_items) if listitem]
@@ -12,15 +12,27 @@ if sys.version_info.major == 3:
     import urllib.parse as urlparse
 else:
     import urlparse
+import time
+import json
 import random
+from hashlib import md5
 import xbmcplugin
 import xbmc
 import xbmcaddon
 import xbmcgui
-from metadatautils import MetadataUtils
+from simplecache import SimpleCache
 from resources.lib.utils import log_msg, log_exception, ADDON_ID, create_main_entry
+from resources.lib.registry import WidgetRegistry, REVALIDATE_MESSAGE, PREDICATE_ACTIONS, PREDICATE_INPROGRESS
+from resources.lib.leases import Lease, acquire_slot
+from resources.lib.stats import InvocationStats, instrument_kodidb, timed_rpc
+from resources.lib.listitem import create_listitems
 
-ADDON_HANDLE = int(sys.argv[1])
+# the service imports this module too, it has no plugin handle
+ADDON_HANDLE = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else -1
+
+# widget actions which score the whole library, only this many of them are computed at the same time
+EXPENSIVE_ACTIONS = ["similar", "recommended", "becauseyouwatched"]
+MAX_EXPENSIVE_WIDGETS = 2
 
 
 class Main(object):
@@ -29,10 +41,15 @@ class Main(object):
     def __init__(self):
         ''' Initialization '''
 
-        self.metadatautils = MetadataUtils()
+        # a cache hit only needs the cache and the addon, metadatautils is loaded when we query kodi
+        self.stats = InvocationStats()
+        self._metadatautils = None
+        self.cache = SimpleCache()
         self.addon = xbmcaddon.Addon(ADDON_ID)
         self.win = xbmcgui.Window(10000)
+        start_time = time.time()
         self.options = self.get_options()
+        self.stats.add("options", start_time)
 
         # skip if shutdown requested
         if self.win.getProperty("SkinHelperShutdownRequested"):
@@ -50,78 +67,27 @@ class Main(object):
 
     def close(self):
         '''Cleanup Kodi Cpython instances'''
-        self.metadatautils.close()
+        if self._metadatautils:
+            self._metadatautils.close()
+        self.cache.close()
         del self.addon
         del self.win
         log_msg("MainModule exited")
 
-    def get_options(self):
-        '''get the options provided to the plugin path'''
+    @property
+    def metadatautils(self):
+        '''the metadatautils instance, only created when we actually need it (expensive to load)'''
+        if not self._metadatautils:
+            from metadatautils import MetadataUtils
+            start_time = time.time()
+            self._metadatautils = MetadataUtils()
+            instrument_kodidb(self._metadatautils.kodidb)
+            self.stats.add("metadatautils", start_time)
+        return self._metadatautils
 
-        if sys.version_info.major == 3:
-            options = dict(urlparse.parse_qsl(sys.argv[2].replace('?', '').lower()))
-        else:
-            options = dict(urlparse.parse_qsl(sys.argv[2].replace('?', '').lower().decode("utf-8")))
-
-        # set the widget settings as options
-        options["hide_watched"] = self.addon.getSetting("hide_watched") == "true"
-        if self.addon.getSetting("hide_watched_recent") == "true" and "recent" in options.get("action", ""):
-            options["hide_watched"] = True
-        options["num_recent_similar"] = int(self.addon.getSetting("num_recent_similar"))
-        options["exp_recommended"] = self.addon.getSetting("exp_recommended") == "true"
-        options["mylist"] = self.addon.getSetting("mylist") == "true"
-        options["extended_info"] = self.addon.getSetting("extended_info") == "true"
-        options["hide_watched_similar"] = self.addon.getSetting("hide_watched_similar") == "true"
-        options["next_inprogress_only"] = self.addon.getSetting("nextup_inprogressonly") == "true"
-        options["episodes_enable_specials"] = self.addon.getSetting("episodes_enable_specials") == "true"
-        options["group_episodes"] = self.addon.getSetting("episodes_grouping") == "true"
-        if "limit" in options:
-            options["limit"] = int(options["limit"])
-        else:
-            options["limit"] = int(self.addon.getSetting("default_limit"))
-
-        if "mediatype" not in options and "action" in options:
-            # get the mediatype and action from the path (for backwards compatability with old style paths)
-            for item in [
-                    ("movies", "movies"),
-                    ("shows", "tvshows"),
-                    ("episode", "episodes"),
-                    ("musicvideos", "musicvideos"),
-                    ("pvr", "pvr"),
-                    ("albums", "albums"),
-                    ("songs", "songs"),
-                    ("artists", "artists"),
-                    ("media", "media"),
-                    ("favourites", "favourites"),
-                    ("favorites", "favourites")]:
-                if item[0] in options["action"]:
-                    options["mediatype"] = item[1]
-                    options["action"] = options["action"].replace(item[1], "").replace(item[0], "")
-                    break
-
-        # prefer reload param for the mediatype
-        if "mediatype" in options:
-            alt_reload = self.win.getProperty("widgetreload-%s" % options["mediatype"])
-            if options["mediatype"] == "favourites" or "favourite" in options["action"]:
-                options["skipcache"] = "true"
-            elif alt_reload:
-                options["reload"] = alt_reload
-            if not options.get("action") and options["mediatype"] == "favourites":
-                options["action"] = "favourites"
-            elif not options.get("action"):
-                options["action"] = "listing"
-            if "listing" in options["action"]:
-                options["skipcache"] = "true"
-            if options["action"] == "browsegenres" and options["mediatype"] == "randommovies":
-                options["mediatype"] = "movies"
-                options["random"] = True
-            elif options["action"] == "browsegenres" and options["mediatype"] == "randomtvshows":
-                options["mediatype"] = "tvshows"
-                options["random"] = True
-
-        #options["skipcache"] = "true"
-
-        return options
+    def get_options(self):
+        '''get the options provided to the plugin path, the widget settings are added on a cache miss'''
+        return parse_options(sys.argv[2], self.addon, self.win)
 
     def show_widget_listing(self):
         '''display the listing for the provided action and mediatype'''
@@ -135,24 +101,9 @@ class Main(object):
 
         # try to get from cache first...
         all_items = []
-        # alter cache_str depending on whether "tag" is available
-        if self.options["action"] == "similar":
-            # if action is similar, use imdbid
-            cache_id = self.options.get("imdbid", "")
-            # if similar was called without imdbid, skip cache
-            if not cache_id:
-                self.options["skipcache"] = "true"
-        elif self.options["action"] == "playlist" and self.options["mediatype"] == "media":
-            # if action is mixed playlist, use playlist labels
-            cache_id = self.options.get("movie_label") + self.options.get("tv_label") + self.options.get("sort")
-        elif self.options["action"] == "forgenre" and "genre" in self.options:
-            cache_id = self.options.get("genre")
-        else:
-            # use tag otherwise
-            cache_id = self.options.get("tag")
-        # set cache_str
-        cache_str = "SkinHelper.Widgets.%s.%s.%s.%s.%s" % \
-            (media_type, action, self.options["limit"], self.options.get("path"), cache_id)
+        cache_state = "skip"
+        start_time = time.time()
+        cache_str = get_cache_str(self.options)
         if not self.win.getProperty("widgetreload2"):
             # at startup we simply accept whatever is in the cache
             cache_checksum = None
@@ -161,45 +112,91 @@ class Main(object):
             cache_checksum = self.options.get("reload", "")
         # only check cache if not "skipcache"
         if not self.options.get("skipcache") == "true":
-            cache = self.metadatautils.cache.get(cache_str, checksum=cache_checksum)
+            cache_state = "miss"
+            cache = self.cache.get(cache_str, checksum=cache_checksum)
             if cache:
+                cache_state = "hit"
                 log_msg("MEDIATYPE: %s - ACTION: %s - PATH: %s - TAG: %s -- got items from cache - CHECKSUM: %s"
                         % (media_type, action, self.options.get("path"), self.options.get("tag"), cache_checksum))
                 all_items = cache
+                WidgetRegistry().touch(cache_str)
+            elif cache_checksum:
+                all_items = self.get_stale_listing(cache_str, cache_checksum)
+                if all_items:
+                    cache_state = "stale"
+        self.stats.add("cache", start_time)
 
         # Call the correct method to get the content from json when no cache
         if not all_items:
             log_msg("MEDIATYPE: %s - ACTION: %s - PATH: %s - TAG: %s -- no cache, quering kodi api to get items - CHECKSUM: %s"
                     % (media_type, action, self.options.get("path"), self.options.get("tag"), cache_checksum))
-
-            # dynamically import and load the correct module, class and function
-            try:
-                media_module = __import__(media_type)
-                media_class = getattr(
-                    media_module,
-                    media_type.capitalize())(self.addon, self.metadatautils, self.options)
-                all_items = getattr(media_class, action)()
-                del media_class
-            except AttributeError:
-                log_exception(__name__, "Incorrect widget action or type called")
-            except Exception as exc:
-                log_exception(__name__, exc)
-
-            # randomize output if requested by skinner or user
-            if self.options.get("randomize", "") == "true":
-                all_items = sorted(all_items, key=lambda k: random.random())
-
-            # prepare listitems and store in cache
-            all_items = self.metadatautils.process_method_on_list(self.metadatautils.kodidb.prepare_listitem, all_items)
-            self.metadatautils.cache.set(cache_str, all_items, checksum=cache_checksum)
+            all_items = self.compute_listing(cache_str, cache_checksum)
 
         # fill that listing...
         xbmcplugin.addSortMethod(int(sys.argv[1]), xbmcplugin.SORT_METHOD_UNSORTED)
-        all_items = self.metadatautils.process_method_on_list(self.metadatautils.kodidb.create_listitem, all_items)
+        start_time = time.time()
+        # a cache hit doesn't load metadatautils for this
+        all_items = create_listitems(all_items)
+        self.stats.add("create_listitem", start_time)
+        start_time = time.time()
         xbmcplugin.addDirectoryItems(ADDON_HANDLE, all_items, len(all_items))
+        self.stats.add("add_items", start_time)
 
         # end directory listing
         xbmcplugin.endOfDirectory(handle=ADDON_HANDLE)
+        self.stats.finish(self.options, cache_state, len(all_items), self.addon.getSetting("collect_stats") == "true")
+
+    def compute_listing(self, cache_str, cache_checksum):
+        '''compute and cache the listing, plugin processes requesting the same listing wait for the first one'''
+        lease = None
+        if not self.options.get("skipcache") == "true":
+            lease = Lease("listing.%s" % md5(cache_str.encode("utf-8")).hexdigest())
+            if not lease.acquire():
+                log_msg("MEDIATYPE: %s - ACTION: %s -- waiting for another process computing the listing"
+                        % (self.options["mediatype"], self.options["action"]))
+                start_time = time.time()
+                lease.wait()
+                self.stats.add("wait", start_time)
+                all_items = self.cache.get(cache_str, checksum=cache_checksum)
+                if all_items is not None:
+                    return all_items
+                # the other process failed, compute it ourselves
+                lease.acquire()
+        slot = None
+        if any(action in self.options["action"] for action in EXPENSIVE_ACTIONS):
+            start_time = time.time()
+            slot = acquire_slot("expensive", MAX_EXPENSIVE_WIDGETS)
+            self.stats.add("wait", start_time)
+        try:
+            add_widget_settings(self.options, self.addon)
+            all_items = get_widget_items(self.addon, self.metadatautils, self.options, self.stats)
+            self.cache.set(cache_str, all_items, checksum=cache_checksum)
+            if not self.options.get("skipcache") == "true":
+                # remember this listing so the service can refresh it in the background
+                WidgetRegistry().register(cache_str, sys.argv[2], self.options, cache_checksum, all_items)
+        finally:
+            if slot:
+                slot.release()
+            if lease:
+                lease.release()
+        return all_items
+
+    def get_stale_listing(self, cache_str, cache_checksum):
+        '''returns the outdated listing if it is recent enough for this widget, the service refreshes it'''
+        max_staleness = get_max_staleness(self.options, self.addon)
+        if not max_staleness:
+            return []
+        registry = WidgetRegistry()
+        entry = registry.get(cache_str)
+        if not entry or time.time() - entry["updated"] > max_staleness:
+            return []
+        all_items = self.cache.get(cache_str, checksum=entry["checksum"])
+        if all_items:
+            log_msg("MEDIATYPE: %s - ACTION: %s -- got outdated items from cache, refreshing in the background"
+                    % (self.options["mediatype"], self.options["action"]))
+            registry.touch(cache_str)
+            request_revalidation(cache_str, cache_checksum)
+        return all_items or []
 
     def mainlisting(self):
         '''main listing'''
@@ -243,3 +240,171 @@ class Main(object):
         all_items = self.metadatautils.process_method_on_list(self.metadatautils.kodidb.create_listitem, all_items)
         xbmcplugin.addDirectoryItems(ADDON_HANDLE, all_items, len(all_items))
         xbmcplugin.endOfDirectory(handle=ADDON_HANDLE)
+
+
+def get_options(paramstring, addon, win):
+    '''parse the options provided to the plugin path and add the widget settings'''
+    return add_widget_settings(parse_options(paramstring, addon, win), addon)
+
+
+def add_widget_settings(options, addon):
+    '''set the widget settings as options, only needed to compute a listing'''
+    options["hide_watched"] = addon.getSetting("hide_watched") == "true"
+    if addon.getSetting("hide_watched_recent") == "true" and "recent" in options.get("action", ""):
+        options["hide_watched"] = True
+    options["num_recent_similar"] = int(addon.getSetting("num_recent_similar"))
+    options["exp_recommended"] = addon.getSetting("exp_recommended") == "true"
+    options["mylist"] = addon.getSetting("mylist") == "true"
+    options["extended_info"] = addon.getSetting("extended_info") == "true"
+    options["hide_watched_similar"] = addon.getSetting("hide_watched_similar") == "true"
+    options["next_inprogress_only"] = addon.getSetting("nextup_inprogressonly") == "true"
+    options["episodes_enable_specials"] = addon.getSetting("episodes_enable_specials") == "true"
+    options["group_episodes"] = addon.getSetting("episodes_grouping") == "true"
+    options["approximate_similarity"] = addon.getSetting("approximate_similarity") == "true"
+    return options
+
+
+def parse_options(paramstring, addon, win):
+    '''parse the options provided to the plugin path, just enough to look up the listing in the cache'''
+
+    if sys.version_info.major == 3:
+        options = dict(urlparse.parse_qsl(paramstring.replace('?', '').lower()))
+    else:
+        options = dict(urlparse.parse_qsl(paramstring.replace('?', '').lower().decode("utf-8")))
+
+    if "limit" in options:
+        options["limit"] = int(options["limit"])
+    else:
+        options["limit"] = int(addon.getSetting("default_limit"))
+
+    if "mediatype" not in options and "action" in options:
+        # get the mediatype and action from the path (for backwards compatability with old style paths)
+        for item in [
+                ("movies", "movies"),
+                ("shows", "tvshows"),
+                ("episode", "episodes"),
+                ("musicvideos", "musicvideos"),
+                ("pvr", "pvr"),
+                ("albums", "albums"),
+                ("songs", "songs"),
+                ("artists", "artists"),
+                ("media", "media"),
+                ("favourites", "favourites"),
+                ("favorites", "favourites")]:
+            if item[0] in options["action"]:
+                options["mediatype"] = item[1]
+                options["action"] = options["action"].replace(item[1], "").replace(item[0], "")
+                break
+
+    # prefer reload param for the mediatype
+    if "mediatype" in options:
+        alt_reload = win.getProperty("widgetreload-%s" % options["mediatype"])
+        if options["mediatype"] == "favourites" or "favourite" in options["action"]:
+            options["skipcache"] = "true"
+        elif alt_reload:
+            options["reload"] = alt_reload
+        if not options.get("action") and options["mediatype"] == "favourites":
+            options["action"] = "favourites"
+        elif not options.get("action"):
+            options["action"] = "listing"
+        if "listing" in options["action"]:
+            options["skipcache"] = "true"
+        if options["action"] == "browsegenres" and options["mediatype"] == "randommovies":
+            options["mediatype"] = "movies"
+            options["random"] = True
+        elif options["action"] == "browsegenres" and options["mediatype"] == "randomtvshows":
+            options["mediatype"] = "tvshows"
+            options["random"] = True
+
+    #options["skipcache"] = "true"
+
+    return options
+
+
+def get_max_staleness(options, addon):
+    '''returns the seconds an outdated listing may be shown while it is refreshed, 0 to wait for the refresh'''
+    if options.get("maxstale"):
+        return int(options["maxstale"]) * 60
+    if any(action in options["action"] for action in PREDICATE_ACTIONS[PREDICATE_INPROGRESS]):
+        # the in progress widgets must reflect what was just watched
+        return 0
+    return int(addon.getSetting("max_staleness") or 0) * 60
+
+
+def request_revalidation(cache_str, checksum):
+    '''ask the service to refresh the listing for the given reload token and publish it to the skin'''
+    request = {
+        "jsonrpc": "2.0",
+        "method": "JSONRPC.NotifyAll",
+        "params": {"sender": ADDON_ID, "message": REVALIDATE_MESSAGE,
+                   "data": {"cache_str": cache_str, "checksum": checksum}},
+        "id": 1
+    }
+    timed_rpc(request["method"], xbmc.executeJSONRPC, json.dumps(request))
+
+
+def cache_listing(addon, metadatautils, paramstring, all_items):
+    '''
+        cache (and register) a listing computed on behalf of the widget with the given paramstring,
+        so that widget gets a cache hit. The items must not be prepared yet.
+    '''
+    win = xbmcgui.Window(10000)
+    options = get_options(paramstring, addon, win)
+    del win
+    cache_str = get_cache_str(options)
+    if options.get("skipcache") == "true":
+        return
+    checksum = options.get("reload", "")
+    all_items = metadatautils.process_method_on_list(metadatautils.kodidb.prepare_listitem, all_items)
+    metadatautils.cache.set(cache_str, all_items, checksum=checksum)
+    WidgetRegistry().register(cache_str, paramstring, options, checksum, all_items)
+
+
+def get_cache_str(options):
+    '''returns the cache key for the widget listing described by the options'''
+    # alter cache_str depending on whether "tag" is available
+    if options["action"] == "similar":
+        # if action is similar, use imdbid
+        cache_id = options.get("imdbid", "")
+        # if similar was called without imdbid, skip cache
+        if not cache_id:
+            options["skipcache"] = "true"
+    elif options["action"] == "playlist" and options["mediatype"] == "media":
+        # if action is mixed playlist, use playlist labels
+        cache_id = options.get("movie_label") + options.get("tv_label") + options.get("sort")
+    elif options["action"] == "forgenre" and "genre" in options:
+        cache_id = options.get("genre")
+    else:
+        # use tag otherwise
+        cache_id = options.get("tag")
+    return "SkinHelper.Widgets.%s.%s.%s.%s.%s" % \
+        (options["mediatype"], options["action"], options["limit"], options.get("path"), cache_id)
+
+
+def get_widget_items(addon, metadatautils, options, stats=None):
+    '''dynamically load the correct module, class and function and return the prepared listitems'''
+    all_items = []
+    start_time = time.time()
+    media_type = options["mediatype"]
+    try:
+        media_module = __import__(media_type)
+        media_class = getattr(media_module, media_type.capitalize())(addon, metadatautils, options)
+        all_items = getattr(media_class, options["action"])()
+        del media_class
+    except AttributeError:
+        log_exception(__name__, "Incorrect widget action or type called")
+    except Exception as exc:
+        log_exception(__name__, exc)
+
+    # randomize output if requested by skinner or user
+    if options.get("randomize", "") == "true":
+        all_items = sorted(all_items, key=lambda k: random.random())
+
+    if stats:
+        stats.add("widget", start_time)
+        start_time = time.time()
+    # prepare listitems
+    all_items = metadatautils.process_method_on_list(metadatautils.kodidb.prepare_listitem, all_items)
+    if stats:
+        stats.add("prepare_listitem", start_time)
+    return all_items
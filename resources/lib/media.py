@@ -11,12 +11,10 @@ from operator import itemgetter
 import random
 from metadatautils import kodi_constants
 from resources.lib.utils import create_main_entry
-from resources.lib.movies import Movies
-from resources.lib.tvshows import Tvshows
-from resources.lib.songs import Songs
-from resources.lib.pvr import Pvr
-from resources.lib.albums import Albums
-from resources.lib.episodes import Episodes
+
+# the widget classes of the other mediatypes we combine, only loaded when an action needs them
+SUB_WIDGETS = ["movies", "tvshows", "songs", "albums", "pvr", "episodes"]
+
 
 class Media(object):
     '''all media (mixed) widgets provided by the script'''
@@ -26,12 +24,17 @@ class Media(object):
         self.metadatautils = metadatautils
         self.addon = addon
         self.options = options
-        self.movies = Movies(self.addon, self.metadatautils, self.options)
-        self.tvshows = Tvshows(self.addon, self.metadatautils, self.options)
-        self.songs = Songs(self.addon, self.metadatautils, self.options)
-        self.albums = Albums(self.addon, self.metadatautils, self.options)
-        self.pvr = Pvr(self.addon, self.metadatautils, self.options)
-        self.episodes = Episodes(self.addon, self.metadatautils, self.options)
+        # the feature sets of the reference items, computed once per reference and scoring method
+        self.reference_sets = {}
+
+    def __getattr__(self, name):
+        '''import and create the widget class of another mediatype on first use (e.g. self.movies)'''
+        if name not in SUB_WIDGETS:
+            raise AttributeError(name)
+        media_module = __import__("resources.lib.%s" % name, fromlist=[name])
+        widgets = getattr(media_module, name.capitalize())(self.addon, self.metadatautils, self.options)
+        setattr(self, name, widgets)
+        return widgets
 
     def listing(self):
         """main listing with all our media nodes"""
@@ -145,7 +148,7 @@ class Media(object):
             tvshows = self.metadatautils.kodidb.tvshows(filters=[kodi_constants.FILTER_UNWATCHED])
             tvshows = self.metadatautils.process_method_on_list(self.tvshows.process_tvshow, tvshows)
             # return list sorted by recommended score, and capped by limit
-            return self.sort_by_recommended(movies+tvshows)
+            return self.sort_by_recommended(movies+tvshows, use_profile=True)
         all_items = self.movies.recommended()
         all_items += self.tvshows.recommended()
         all_items += self.albums.recommended()
@@ -329,13 +332,10 @@ class Media(object):
                     self.tvshows.process_tvshow, self.metadatautils.kodidb.tvshows())
             if not ref_item:
                 return None
+            # define sets for speed
+            mixed_sets = self.get_reference_sets(ref_item, "media")
             if is_ref_movie:
-                # define sets for speed
-                set_genres = set(ref_item["genre"])
-                set_directors = set(ref_item["director"])
-                set_writers = set(ref_item["writer"])
-                set_cast = set([x["name"] for x in ref_item["cast"][:5]])
-                sets = (set_genres, set_directors, set_writers, set_cast)
+                sets = self.get_reference_sets(ref_item, "movies")
                 # get similarity score for all items
                 for item in all_items:
                     if item.has_key("uniqueid"):
@@ -349,15 +349,12 @@ class Media(object):
                                 ref_item, item, sets=sets)
                     else:
                         # if item isn't movie, use mixed method
-                        similarscore = self.get_similarity_score(ref_item, item)
+                        similarscore = self.get_similarity_score(ref_item, item, sets=mixed_sets)
                     # set extraproperties
                     item["similarscore"] = similarscore
                     item["extraproperties"] = {"similartitle": ref_item["title"], "originalpath": item["file"]}
             else:
-                # define sets for speed
-                set_genres = set(ref_item["genre"])
-                set_cast = set([x["name"] for x in ref_item["cast"][:10]])
-                sets = (set_genres, set_cast)
+                sets = self.get_reference_sets(ref_item, "tvshows")
                 # get similarity score for all items
                 for item in all_items:
                     if not item.has_key("uniqueid"):
@@ -371,7 +368,7 @@ class Media(object):
                                 ref_item, item, sets=sets)
                     else:
                         # if item isn't tvshow, use mixed method
-                        similarscore = self.get_similarity_score(ref_item, item)
+                        similarscore = self.get_similarity_score(ref_item, item, sets=mixed_sets)
                     # set extraproperties
                     item["similarscore"] = similarscore
                     item["extraproperties"] = {"similartitle": ref_item["title"], "originalpath": item["file"]}
@@ -383,6 +380,23 @@ class Media(object):
         all_items += self.songs.similar()
         return sorted(all_items, key=lambda k: random.random())[:self.options["limit"]]
 
+    def cowatched(self):
+        '''get the movies and shows most watched together with a recently watched movie or show'''
+        from resources.lib.cowatch import get_cowatched_items, get_key
+        ref_item = self.get_recently_watched_item()
+        if not ref_item:
+            return None
+        if "movieid" in ref_item:
+            ref_key = get_key("movie", ref_item["movieid"])
+        else:
+            ref_key = get_key("tvshow", ref_item["tvshowid"])
+        all_items = get_cowatched_items(self.metadatautils, ref_key, ["movie", "tvshow"], self.options["limit"])
+        for item in all_items:
+            item["extraproperties"] = {"similartitle": ref_item["title"], "originalpath": item["file"]}
+            if "movieid" not in item:
+                self.tvshows.process_tvshow(item)
+        return all_items
+
     def top250(self):
         ''' get imdb top250 movies in library '''
         all_items = self.movies.top250()
@@ -428,14 +442,26 @@ class Media(object):
         item = random.choice(recent_items)
         # if item is an episode, get its tvshow
         if not item.has_key("genre"):
-            show_title = item['showtitle']
-            title_filter = [{"field": "title", "operator": "is", "value": "%s" % show_title}]
-            tvshow = self.metadatautils.kodidb.tvshows(filters=title_filter, limits=(0, 1))
-            return tvshow[0]
+            tvshows = self.tvshows.get_tvshows_from_episodes([item])
+            return tvshows[0] if tvshows else None
         return item
 
-    def sort_by_recommended(self, all_items, ref_items=None):
-        ''' sort list of mixed movies/tvshows by recommended score'''
+    def sort_by_recommended(self, all_items, ref_items=None, use_profile=False):
+        '''
+            sort list of mixed movies/tvshows by recommended score,
+            the recommended widgets (use_profile) score against the taste profile if there is one
+        '''
+        from resources.lib.taste_profile import TasteProfile
+        if not ref_items and use_profile:
+            # score against the taste profile the service keeps of the watched items, if available
+            profile = TasteProfile.load()
+            if profile and (profile.get_weight("movies") or profile.get_weight("tvshows")):
+                for item in all_items:
+                    media_type = "movies" if "uniqueid" in item else "tvshows"
+                    similarscore = profile.score(item, media_type, mixed=True,
+                                                 convert_genres=self.convert_tvshow_genres)
+                    item["recommendedscore"] = similarscore / (1+item["playcount"])
+                return sorted(all_items, key=itemgetter("recommendedscore"), reverse=True)[:self.options["limit"]]
         # use recent items if ref_items not given
         if not ref_items:
             num_recent_similar = self.options["num_recent_similar"]
@@ -474,21 +500,28 @@ class Media(object):
             weights = dict()
             for item in ref_items:
                 weights[item['title']] = 1
+        # define the sets of every reference once, for the same type and for the mixed method
+        references = []
+        for ref_item in ref_items:
+            is_ref_movie = "uniqueid" in ref_item
+            references.append((ref_item, weights[ref_item['title']], is_ref_movie,
+                               self.get_reference_sets(ref_item, "movies" if is_ref_movie else "tvshows"),
+                               self.get_reference_sets(ref_item, "media")))
         # average scores together for every item
         for item in all_items:
             similarscore = 0
-            for ref_item in ref_items:
-                title = ref_item['title']
+            is_movie = "uniqueid" in item
+            for ref_item, weight, is_ref_movie, sets, mixed_sets in references:
                 # add all similarscores for item
-                if ref_item.has_key("uniqueid") and item.has_key("uniqueid"):
+                if is_ref_movie and is_movie:
                     # use movies method if both items are movies
-                    similarscore += weights[title] * self.movies.get_similarity_score(ref_item, item)
-                elif ref_item.has_key("uniqueid") or item.has_key("uniqueid"):
+                    similarscore += weight * self.movies.get_similarity_score(ref_item, item, sets=sets)
+                elif is_ref_movie or is_movie:
                     # use media method if only one item is a movie
-                    similarscore += weights[title] * self.get_similarity_score(ref_item, item)
+                    similarscore += weight * self.get_similarity_score(ref_item, item, sets=mixed_sets)
                 else:
                     # use tvshows method if neither items are movies
-                    similarscore += weights[title] * self.tvshows.get_similarity_score(ref_item, item)
+                    similarscore += weight * self.tvshows.get_similarity_score(ref_item, item, sets=sets)
             # average score and scale down based on playcount
             item["recommendedscore"] = similarscore / (1+item["playcount"]) / len(ref_items)
         # return sorted list capped by limit
@@ -522,17 +555,35 @@ class Media(object):
     def playlist_title(self, all_items):
         return sorted(all_items, key=itemgetter("title"))[:self.options["limit"]]
 
-    def get_similarity_score(self, ref_item, other_item):
+    def get_reference_sets(self, ref_item, method):
+        '''
+            returns the sets the similarity method ("movies", "tvshows" or "media" for the mixed method) needs
+            of the reference item, computed once per reference during this invocation
+        '''
+        key = (method, ref_item.get("movieid"), ref_item.get("tvshowid"), ref_item["title"])
+        if key not in self.reference_sets:
+            if method == "movies":
+                sets = (set(ref_item["genre"]), set(ref_item["director"]), set(ref_item["writer"]),
+                        set([x["name"] for x in ref_item["cast"][:5]]))
+            elif method == "tvshows":
+                sets = (set(ref_item["genre"]), set([x["name"] for x in ref_item["cast"][:10]]))
+            else:
+                # get set of genres
+                if "uniqueid" in ref_item:
+                    set_genres = set(ref_item["genre"])
+                else:
+                    # change genres to movie equivalents if tvshow
+                    set_genres = self.convert_tvshow_genres(ref_item["genre"])
+                sets = (set_genres, set([x["name"] for x in ref_item["cast"][:5]]))
+            self.reference_sets[key] = sets
+        return self.reference_sets[key]
+
+    def get_similarity_score(self, ref_item, other_item, sets=None):
         '''
             get a similarity score (0-.625) between movie and tvshow
+            optional parameters should be calculated beforehand if called inside loop
         '''
-        # get set of genres
-        if ref_item.has_key("uniqueid"):
-            set_genres = set(ref_item["genre"])
-        else:
-            # change genres to movie equivalents if tvshow
-            set_genres = self.convert_tvshow_genres(ref_item["genre"])
-        set_cast = set([x["name"] for x in ref_item["cast"][:5]])
+        set_genres, set_cast = sets or self.get_reference_sets(ref_item, "media")
         # calculate individual scores for contributing factors
         # genre_score = (numer of matching genres) / (number of unique genres between both)
         genre_score = 0 if not set_genres else \
@@ -566,7 +617,4 @@ class Media(object):
                          'TV Dramas': 'Drama',
                          'TV Crime Dramas': 'Crime Dramas',
                         }
-        for genre in genres:
-            if mapped_genres.has_key(genre):
-                genre = mapped_genres[genre]
-        return set(genres)
+        return set(mapped_genres.get(genre, genre) for genre in genres)
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    minhash.py
+    approximate similar items for very large libraries: MinHash signatures of the set features
+    bucketed with LSH, only the items sharing a bucket with the reference are scored exactly
+'''
+
+import os
+import json
+import random
+from hashlib import md5
+from resources.lib.similarity import SimilarityEngine, SCORE_TERMS, SET_METHODS, get_feature
+
+# bump when the signatures change, the index is rebuilt
+INDEX_FORMAT = 2
+# per type a signature of bands * rows hashes, items are candidates if all rows of one band match.
+# Tuned with the benchmark to reach RECALL_TARGET with the fewest candidates
+LSH_PARAMS = {"movies": (24, 1), "tvshows": (32, 1)}
+# a feature value is hashed as this many tokens per unit of score weight, so the signatures agree
+# the most on the features which weigh the most in the score (e.g. genre)
+TOKEN_COPIES = 10
+# the approximate mode is only used from this amount of library items
+APPROXIMATE_THRESHOLD = 50000
+# the benchmark checks the approximate top items contain at least this part of the exact top items
+RECALL_TARGET = 0.9
+# the buckets are stored in this many files by band key, a lookup only reads the files of its band keys
+NUM_SHARDS = 1024
+PRIME = 4294967311
+MAX_HASH = (1 << 32) - 1
+HASH_SEED = 42
+
+
+def get_hash_functions():
+    '''the (a, b) parameters of the hash functions, the same in every process'''
+    generator = random.Random(HASH_SEED)
+    num_hashes = max(bands * rows for bands, rows in LSH_PARAMS.values())
+    return [(generator.randint(1, PRIME - 1), generator.randint(0, PRIME - 1)) for _ in range(num_hashes)]
+
+
+HASH_FUNCTIONS = get_hash_functions()
+TOKEN_HASHES = {}
+
+
+def get_tokens(item, media_type):
+    '''the values of the set features the similarity score is based on, repeated by the weight of their feature'''
+    tokens = set()
+    for feature, method, weight in SCORE_TERMS[media_type]:
+        if method in SET_METHODS:
+            copies = max(1, int(round(weight * TOKEN_COPIES)))
+            for value in get_feature(item, feature):
+                tokens.update("%s:%s:%s" % (feature, value, copy) for copy in range(copies))
+    return tokens
+
+
+def get_token_hashes(token):
+    '''the values of all hash functions for a token'''
+    if token not in TOKEN_HASHES:
+        value = int(md5(token.encode("utf-8")).hexdigest()[:8], 16)
+        TOKEN_HASHES[token] = [(a * value + b) % PRIME & MAX_HASH for a, b in HASH_FUNCTIONS]
+    return TOKEN_HASHES[token]
+
+
+def get_signature(tokens, media_type):
+    '''the MinHash signature of a token set for the given type, None for an empty set'''
+    if not tokens:
+        return None
+    bands, rows = LSH_PARAMS[media_type]
+    return [min(values) for values in zip(*[get_token_hashes(token)[:bands * rows] for token in tokens])]
+
+
+def get_band_keys(signature, media_type):
+    '''the LSH bucket key of every band of a signature'''
+    bands, rows = LSH_PARAMS[media_type]
+    keys = []
+    for band in range(bands):
+        values = signature[band * rows:(band + 1) * rows]
+        keys.append(md5(("%s:%s" % (band, values)).encode("utf-8")).hexdigest()[:12])
+    return keys
+
+
+def get_item_band_keys(item, media_type):
+    '''the LSH bucket keys of an item, empty if it has no set feature values'''
+    signature = get_signature(get_tokens(item, media_type), media_type)
+    return get_band_keys(signature, media_type) if signature else []
+
+
+def get_digest(tokens):
+    '''short checksum of the tokens of an item, to detect changed items'''
+    return md5(json.dumps(sorted(tokens)).encode("utf-8")).hexdigest()[:8]
+
+
+def get_candidates(buckets, ref_item, media_type):
+    '''returns the ids of the items sharing a bucket (buckets: band key -> ids) with the reference'''
+    candidates = set()
+    for band_key in get_item_band_keys(ref_item, media_type):
+        candidates.update(buckets.get(band_key, []))
+    return candidates
+
+
+def get_shard(band_key):
+    '''the file a bucket is stored in'''
+    return int(band_key[:8], 16) % NUM_SHARDS
+
+
+def get_shard_file(folder, shard):
+    '''the path of a shard file in the index folder'''
+    return os.path.join(folder, "%s.json" % shard)
+
+
+def read_shard(folder, shard):
+    '''the buckets (band key -> ids) stored in a shard file'''
+    try:
+        with open(get_shard_file(folder, shard)) as shard_file:
+            return json.load(shard_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def read_candidates(folder, ref_item, media_type):
+    '''
+        returns the ids of the items sharing a bucket with the reference from the index stored in the folder,
+        only the shard files of the band keys of the reference are read
+    '''
+    shards = {}
+    for band_key in get_item_band_keys(ref_item, media_type):
+        shards.setdefault(get_shard(band_key), []).append(band_key)
+    candidates = set()
+    for shard, band_keys in shards.items():
+        buckets = read_shard(folder, shard)
+        for band_key in band_keys:
+            candidates.update(buckets.get(band_key, []))
+    return candidates
+
+
+def get_approximate_top(all_items, candidates, id_field, ref_item, media_type, limit, excluded_rows=None):
+    '''
+        returns (row, score) of the limit best scoring items among the candidates (ids),
+        None if there are not enough candidates
+    '''
+    rows = [row for row, item in enumerate(all_items) if item[id_field] in candidates]
+    if excluded_rows:
+        rows = [row for row in rows if row not in excluded_rows]
+    if len(rows) < limit:
+        return None
+    ranked = SimilarityEngine([all_items[row] for row in rows]).top(ref_item, media_type, limit)
+    return [(rows[row], score) for row, score in ranked]
+
+
+def get_recall(approximate, exact):
+    '''the part of the exact top items the approximate top items contain'''
+    if not exact:
+        return 1.0
+    exact_rows = set(row for row, _ in exact)
+    return float(len(exact_rows.intersection(row for row, _ in approximate))) / len(exact_rows)
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    minhash_index.py
+    the persisted LSH buckets of the movies and tvshows, maintained by the service
+'''
+
+import os
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file, log_msg
+from resources.lib.minhash import INDEX_FORMAT, LSH_PARAMS, NUM_SHARDS, APPROXIMATE_THRESHOLD, get_tokens, \
+    get_item_band_keys, get_digest, get_approximate_top, get_shard, get_shard_file, read_shard, read_candidates
+
+# bump when the layout of the bucket files changes, the index is rebuilt
+LAYOUT_FORMAT = 3
+# the index is reset (and rebuilt) when more than this part of the bucket entries is outdated
+MAX_STALE = 0.2
+# indexing an item is much cheaper than computing a similarity table row,
+# a build step indexes this many items per row it is given
+ITEMS_PER_ROW = 20
+# while building, the buckets are written after this many new items (and when the build is done)
+SAVE_INTERVAL = 10000
+ID_FIELDS = {"movies": "movieid", "tvshows": "tvshowid"}
+
+
+def get_index_version(media_type):
+    '''version of the index contents: changes with the signatures and with the layout of the bucket files'''
+    return [INDEX_FORMAT, LAYOUT_FORMAT, NUM_SHARDS, list(LSH_PARAMS[media_type])]
+
+
+class MinHashIndex(object):
+    '''
+        the LSH buckets (band key -> item ids) of all items of a type, stored in shard files by band key.
+        The digests of the indexed items are kept apart, only the service needs them.
+    '''
+
+    def __init__(self, media_type):
+        '''Initialization'''
+        self.media_type = media_type
+        self.id_field = ID_FIELDS[media_type]
+        self.folder = get_profile_path("minhash", media_type)
+        self.info = None
+        self.digests = None
+        self.shards = {}
+        self.changed = set()
+        self.unsaved = 0
+
+    def get_shard(self, shard):
+        '''returns the buckets of a shard, read once'''
+        if shard not in self.shards:
+            self.shards[shard] = read_shard(self.folder, shard)
+        return self.shards[shard]
+
+    def get_info(self):
+        '''returns the format, the amount of (outdated) bucket entries and if the index is complete'''
+        if self.info is None:
+            self.info = read_json_file(os.path.join(self.folder, "index.json"), {})
+        return self.info
+
+    def get_digests(self):
+        '''returns the digests of the tokens of the indexed items by item id'''
+        if self.digests is None:
+            self.digests = read_json_file(os.path.join(self.folder, "digests.json"), {})
+        return self.digests
+
+    def is_current(self):
+        '''checks if the index was built with the current signatures'''
+        return self.get_info().get("format") == get_index_version(self.media_type)
+
+    def is_complete(self):
+        '''checks if all items were indexed once since the last reset'''
+        return self.is_current() and self.get_info().get("complete", False)
+
+    def reset(self):
+        '''drop the index, it will be rebuilt'''
+        log_msg("MinHashIndex: resetting %s index" % self.media_type)
+        # also drop the shard files of an older layout
+        for filename in os.listdir(self.folder):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(self.folder, filename))
+        self.info = {"format": get_index_version(self.media_type), "entries": 0, "stale": 0, "complete": False}
+        self.digests = {}
+        self.shards = {}
+        self.changed = set()
+        self.unsaved = 0
+        self.save()
+
+    def save(self):
+        '''store the changed shards, the digests and the info'''
+        for shard in self.changed:
+            write_json_file(get_shard_file(self.folder, shard), self.shards[shard])
+        write_json_file(os.path.join(self.folder, "digests.json"), self.get_digests())
+        write_json_file(os.path.join(self.folder, "index.json"), self.get_info())
+        self.changed = set()
+        self.unsaved = 0
+
+    def add_items(self, table, item_ids):
+        '''add the given items of the (mirrored) library table to the buckets, call save to store them'''
+        info = self.get_info()
+        digests = self.get_digests()
+        for item_id in item_ids:
+            digests["%s" % item_id] = get_digest(get_tokens(table[item_id], self.media_type))
+            for band_key in get_item_band_keys(table[item_id], self.media_type):
+                shard = get_shard(band_key)
+                self.get_shard(shard).setdefault(band_key, []).append(item_id)
+                self.changed.add(shard)
+                info["entries"] += 1
+        self.unsaved += len(item_ids)
+
+    def update(self, table, changed_ids, removed_ids=None):
+        '''
+            forget the changed and removed items of the (mirrored) library table, build adds them (again).
+            Their old bucket entries are left, the exact scoring skips them. Removed items are found by
+            their digests so removed_ids is not needed. Small libraries are not indexed.
+        '''
+        if len(table) < APPROXIMATE_THRESHOLD or not self.is_current():
+            return
+        info = self.get_info()
+        digests = self.get_digests()
+        outdated = [key for key in ("%s" % item_id for item_id in changed_ids)
+                    if key in digests and int(key) in table and
+                    digests[key] != get_digest(get_tokens(table[int(key)], self.media_type))]
+        outdated += [key for key in digests if int(key) not in table]
+        if not outdated:
+            return
+        for key in outdated:
+            del digests[key]
+            info["stale"] += LSH_PARAMS[self.media_type][0]
+        log_msg("MinHashIndex: %s outdated items in %s index" % (len(outdated), self.media_type))
+        if info["entries"] and info["stale"] > MAX_STALE * info["entries"]:
+            # too many outdated entries, the index is rebuilt while the service is idle
+            self.reset()
+        else:
+            write_json_file(os.path.join(self.folder, "digests.json"), digests)
+            write_json_file(os.path.join(self.folder, "index.json"), info)
+
+    def build(self, table, max_rows):
+        '''index the next batch of items which are not indexed (anymore), returns the amount still missing'''
+        if len(table) < APPROXIMATE_THRESHOLD:
+            return 0
+        info = self.get_info()
+        digests = self.get_digests()
+        missing = [item_id for item_id in table if "%s" % item_id not in digests]
+        if not missing:
+            return 0
+        batch_size = max_rows * ITEMS_PER_ROW
+        self.add_items(table, missing[:batch_size])
+        remaining = max(len(missing) - batch_size, 0)
+        if not remaining:
+            info["complete"] = True
+            log_msg("MinHashIndex: %s index complete" % self.media_type)
+        if not remaining or self.unsaved >= SAVE_INTERVAL:
+            self.save()
+        return remaining
+
+    def get_candidates(self, ref_item):
+        '''returns the ids of the items sharing a bucket with the reference, only the needed shards are read'''
+        return read_candidates(self.folder, ref_item, self.media_type)
+
+
+def get_approximate_similar(all_items, ref_item, media_type, limit, excluded_rows=None):
+    '''
+        returns (row, score) of the limit best scoring items among the items sharing a bucket with the reference,
+        None if the library is too small for the approximate mode or the index can't provide enough candidates
+    '''
+    if len(all_items) < APPROXIMATE_THRESHOLD:
+        return None
+    index = MinHashIndex(media_type)
+    if not index.is_complete():
+        return None
+    return get_approximate_top(all_items, index.get_candidates(ref_item), ID_FIELDS[media_type], ref_item,
+                               media_type, limit, excluded_rows)
@@ -11,7 +11,7 @@ from operator import itemgetter
 import random
 import xbmc
 from metadatautils import kodi_constants
-from resources.lib.utils import create_main_entry, KODI_VERSION
+from resources.lib.utils import create_main_entry
 
 
 class Movies(object):
@@ -50,6 +50,7 @@ class Movies(object):
         if not tag:
             all_items += [
                 (self.addon.getLocalizedString(32006), "similar&mediatype=movies&tag=%s" % tag, icon),
+                (self.addon.getLocalizedString(32125), "cowatched&mediatype=movies", icon),
                 (xbmc.getLocalizedString(10134), "favourites&mediatype=movies&tag=%s" % tag, icon),
                 (self.addon.getLocalizedString(32078), "playlistslisting&mediatype=movies", icon),
                 (self.addon.getLocalizedString(32076), "playlistslisting&mediatype=movies&tag=ref", icon),
@@ -111,17 +112,19 @@ class Movies(object):
 
     def toprated(self):
         """ library movies with score higher than 7"""
+        from resources.lib.library_mirror import get_library_items
         filters = [kodi_constants.FILTER_RATING]
         if self.options["hide_watched"]:
             filters.append(kodi_constants.FILTER_UNWATCHED)
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        return self.metadatautils.kodidb.movies(sort=kodi_constants.SORT_RATING, filters=filters,
-                                                limits=(0, self.options["limit"]))
+        return get_library_items(self.metadatautils, "movies", kodi_constants.SORT_RATING, filters,
+                                 (0, self.options["limit"]))
 
     def recommended(self):
         ''' get recommended movies - library movies with score higher than 7
         or if using experimental settings - similar with all recently watched '''
+        from resources.lib.library_mirror import get_library_items
         if self.options["exp_recommended"]:
             # get list of all unwatched movies (optionally filtered by tag)
             filters = [kodi_constants.FILTER_UNWATCHED]
@@ -129,25 +132,26 @@ class Movies(object):
                 filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
             all_items = self.metadatautils.kodidb.movies(filters=filters)
             # return list sorted by recommended score
-            return self.sort_by_recommended(all_items)
+            return self.sort_by_recommended(all_items, use_profile=True)
         else:
             filters = [kodi_constants.FILTER_RATING]
             if self.options["hide_watched"]:
                 filters.append(kodi_constants.FILTER_UNWATCHED)
             if self.options.get("tag"):
                 filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-            return self.metadatautils.kodidb.movies(sort=kodi_constants.SORT_RATING, filters=filters,
-                                                    limits=(0, self.options["limit"]))
+            return get_library_items(self.metadatautils, "movies", kodi_constants.SORT_RATING, filters,
+                                     (0, self.options["limit"]))
 
     def recent(self):
         ''' get recently added movies '''
+        from resources.lib.library_mirror import get_library_items
         filters = []
         if self.options["hide_watched"]:
             filters.append(kodi_constants.FILTER_UNWATCHED)
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        return self.metadatautils.kodidb.movies(sort=kodi_constants.SORT_DATEADDED, filters=filters,
-                                                limits=(0, self.options["limit"]))
+        return get_library_items(self.metadatautils, "movies", kodi_constants.SORT_DATEADDED, filters,
+                                 (0, self.options["limit"]))
 
     def random(self):
         ''' get random movies '''
@@ -161,12 +165,12 @@ class Movies(object):
 
     def inprogress(self):
         ''' get in progress movies '''
+        from resources.lib.library_mirror import get_library_items
         filters = [kodi_constants.FILTER_INPROGRESS]
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        return self.metadatautils.kodidb.movies(sort=kodi_constants.SORT_LASTPLAYED,
-                                                filters=filters,
-                                                limits=(0, self.options["limit"]))
+        return get_library_items(self.metadatautils, "movies", kodi_constants.SORT_LASTPLAYED, filters,
+                                 (0, self.options["limit"]))
 
     def newrelease(self):
         """ get recently added sorted by year movies """
@@ -189,6 +193,7 @@ class Movies(object):
 
     def similar(self):
         ''' get similar movies for given imdbid, or from a recently watched title if no imdbid'''
+        from resources.lib.similarity_table import get_similar_items
         imdb_id = self.options.get("imdbid", "")
         ref_movie = None
         if imdb_id:
@@ -204,28 +209,91 @@ class Movies(object):
             hide_watched = False
         if not ref_movie:
             return None
+        # use the similarity table maintained by the service if it can answer
+        similar_items = get_similar_items(self.metadatautils, "movies", ref_movie, self.options["limit"], hide_watched)
+        if similar_items is None:
+            similar_items = self.get_similar_movies(ref_movie, hide_watched)
+        for item in similar_items:
+            item["extraproperties"] = {"similartitle": ref_movie["title"], "originalpath": item["file"]}
+        return similar_items
+
+    def cowatched(self):
+        '''get the movies most watched together with the movie of the given imdbid, or with a recently watched one'''
+        from resources.lib.cowatch import get_cowatched_items, get_key
+        imdb_id = self.options.get("imdbid", "")
+        ref_movie = None
+        if imdb_id:
+            ref_movie = self.metadatautils.kodidb.movie_by_imdbid(imdb_id)
+        if not ref_movie:
+            # pick a random recently watched movie (for homescreen widget)
+            ref_movie = self.get_recently_watched_movie()
+        if not ref_movie:
+            return None
+        all_items = get_cowatched_items(self.metadatautils, get_key("movie", ref_movie["movieid"]), ["movie"],
+                                        self.options["limit"])
+        for item in all_items:
+            item["extraproperties"] = {"similartitle": ref_movie["title"], "originalpath": item["file"]}
+        return all_items
+
+    def becauseyouwatched(self):
+        '''
+            the reference movies of several "because you watched" rows: the movies of the imdbids param or else
+            the last watched movies. The similar movies of all references are computed in one pass and cached for
+            the similar widget of every row (action=similar&imdbid=[IMDBID], with limit=rowlimit and the same reload)
+        '''
+        from resources.lib.library_mirror import get_library_items
+        from resources.lib.similarity import get_similar_rows
+        from resources.lib.main import cache_listing
+        if self.options.get("imdbids"):
+            ref_movies = [self.metadatautils.kodidb.movie_by_imdbid(imdb_id)
+                          for imdb_id in self.options["imdbids"].split(",")[:self.options["limit"]]]
+            ref_movies = [item for item in ref_movies if item]
+        else:
+            ref_movies = self.metadatautils.kodidb.movies(sort=kodi_constants.SORT_LASTPLAYED,
+                                                          filters=[kodi_constants.FILTER_WATCHED],
+                                                          limits=(0, self.options["limit"]))
+        ref_movies = [item for item in ref_movies if item.get("imdbnumber")]
+        if not ref_movies:
+            return []
+        row_limit = int(self.options.get("rowlimit") or self.addon.getSetting("default_limit"))
+        all_items = get_library_items(self.metadatautils, "movies")
+        for ref_movie, row in zip(ref_movies, get_similar_rows(all_items, ref_movies, "movies", row_limit)):
+            similar_items = []
+            for item, similarscore in row:
+                item["similarscore"] = similarscore
+                item["extraproperties"] = {"similartitle": ref_movie["title"], "originalpath": item["file"]}
+                similar_items.append(item)
+            paramstring = "?action=similar&mediatype=movies&imdbid=%s&limit=%s&reload=%s" % \
+                (ref_movie["imdbnumber"], row_limit, self.options.get("reload", ""))
+            cache_listing(self.addon, self.metadatautils, paramstring, similar_items)
+        return ref_movies
+
+    def get_similar_movies(self, ref_movie, hide_watched):
+        '''score all movies against the reference movie, returns the best scoring movies capped by limit'''
+        from resources.lib.library_mirror import get_library_items
+        from resources.lib.similarity import SimilarityEngine
+        from resources.lib.minhash_index import get_approximate_similar
         # create list of all items
         if hide_watched:
-            all_items = self.metadatautils.kodidb.movies(filters=[kodi_constants.FILTER_UNWATCHED])
+            all_items = get_library_items(self.metadatautils, "movies", filters=[kodi_constants.FILTER_UNWATCHED])
         else:
-            all_items = self.metadatautils.kodidb.movies()
-        # define ref_movie sets for speed
-        set_genres = set(ref_movie["genre"])
-        set_directors = set(ref_movie["director"])
-        set_writers = set(ref_movie["writer"])
-        set_cast = set([x["name"] for x in ref_movie["cast"][:5]])
-        sets = (set_genres, set_directors, set_writers, set_cast)
-        # get similarity score for all movies
-        for item in all_items:
-            if item["title"] == ref_movie["title"] and item["year"] == ref_movie["year"]:
-                # don't rank the reference movie
-                similarscore = 0
-            else:
-                similarscore = self.get_similarity_score(ref_movie, item, sets=sets)
+            all_items = get_library_items(self.metadatautils, "movies")
+        # don't rank the reference movie
+        ref_rows = set(row for row, item in enumerate(all_items)
+                       if item["title"] == ref_movie["title"] and item["year"] == ref_movie["year"])
+        # return the movies with the highest similarity score, capped by limit
+        similar_items = []
+        ranked = None
+        if self.options.get("approximate_similarity"):
+            # very large libraries: only score the items sharing an LSH bucket with the reference
+            ranked = get_approximate_similar(all_items, ref_movie, "movies", self.options["limit"], ref_rows)
+        if ranked is None:
+            ranked = SimilarityEngine(all_items).top(ref_movie, "movies", self.options["limit"], ref_rows)
+        for row, similarscore in ranked:
+            item = all_items[row]
             item["similarscore"] = similarscore
-            item["extraproperties"] = {"similartitle": ref_movie["title"], "originalpath": item["file"]}
-        # return list sorted by score and capped by limit
-        return sorted(all_items, key=itemgetter("similarscore"), reverse=True)[:self.options["limit"]]
+            similar_items.append(item)
+        return similar_items
 
     def forgenre(self):
         ''' get top rated movies for given genre'''
@@ -265,27 +333,21 @@ class Movies(object):
 
     def top250(self):
         ''' get imdb top250 movies in library '''
-        all_items = []
-        filters = []
+        from resources.lib.library_mirror import get_library_items_by_id
+        from resources.lib.imdb_index import get_top250_matches, get_raw_ids
+        matches = get_top250_matches(self.metadatautils, "movies")
         if self.options.get("tag"):
-            filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        fields = ["imdbnumber"]
-        if KODI_VERSION > 16:
-            fields.append("uniqueid")
-        all_movies = self.metadatautils.kodidb.get_json(
-            'VideoLibrary.GetMovies', fields=fields, returntype="movies", filters=filters)
-        top_250 = self.metadatautils.imdb.get_top250_db()
-        for movie in all_movies:
-            imdbnumber = movie["imdbnumber"]
-            if not imdbnumber and "uniqueid" in movie:
-                for value in movie["uniqueid"]:
-                    if value.startswith("tt"):
-                        imdbnumber = value
-            if imdbnumber and imdbnumber in top_250:
-                movie = self.metadatautils.kodidb.movie(movie["movieid"])
-                movie["top250_rank"] = int(top_250[imdbnumber])
+            filters = [{"operator": "contains", "field": "tag", "value": self.options["tag"]}]
+            tag_ids = get_raw_ids(self.metadatautils, "movies", filters)
+            matches = [match for match in matches if match[0] in tag_ids]
+        matches = matches[:self.options["limit"]]
+        all_items = []
+        for (_, rank), movie in zip(matches, get_library_items_by_id(self.metadatautils, "movies",
+                                                                    [match[0] for match in matches])):
+            if movie:
+                movie["top250_rank"] = rank
                 all_items.append(movie)
-        return sorted(all_items, key=itemgetter("top250_rank"))[:self.options["limit"]]
+        return all_items
 
     def extendedpopulartmdb(self):
         """gets popular movies in library from tmdb"""
@@ -312,26 +374,19 @@ class Movies(object):
         all_items = self.get_extended_matches(self.get_extended_list('mostwatchedmovies'))
         return all_items[:self.options["limit"]]
 
-    def get_extended_matches(self,extended_items):
+    def get_extended_matches(self, extended_items):
         """gets movies that are in the given extended info list of items"""
+        from resources.lib.library_mirror import get_library_items_by_id
+        from resources.lib.imdb_index import get_imdb_lookup, get_matches
+        lookup = get_imdb_lookup(self.metadatautils, "movies")[0]
+        matches = get_matches(lookup, extended_items)
         all_items = []
-        filters = []
-        fields = ["imdbnumber"]
-        if KODI_VERSION > 16:
-            fields.append("uniqueid")
-        all_movies = self.metadatautils.kodidb.get_json(
-            'VideoLibrary.GetMovies', fields=fields, returntype="movies", filters=filters)
-        for movie in all_movies:
-            imdbnumber = movie["imdbnumber"]
-            if not imdbnumber and "uniqueid" in movie:
-                for value in movie["uniqueid"]:
-                    if value.startswith("tt"):
-                        imdbnumber = value
-            if imdbnumber and imdbnumber in extended_items:
-                movie = self.metadatautils.kodidb.movie(movie["movieid"])
-                movie["extendedindex"] = extended_items.index(imdbnumber)
+        for (_, position), movie in zip(matches, get_library_items_by_id(self.metadatautils, "movies",
+                                                                        [match[0] for match in matches])):
+            if movie:
+                movie["extendedindex"] = position
                 all_items.append(movie)
-        return sorted(all_items, key=itemgetter("extendedindex"))
+        return all_items
 
     def get_extended_list(self,query):
         """gets extended info list for the given query"""
@@ -416,28 +471,25 @@ class Movies(object):
         '''synonym to favourites'''
         return self.favourites()
 
-    def sort_by_recommended(self, all_items, ref_movies=None):
+    def sort_by_recommended(self, all_items, ref_movies=None, use_profile=False):
         ''' sort list of movies by recommended score'''
+        from resources.lib.similarity import SimilarityEngine
+        from resources.lib.taste_profile import TasteProfile
+        if not ref_movies and use_profile:
+            # score against the taste profile the service keeps of the watched items, if available
+            profile = TasteProfile.load()
+            if profile and profile.get_weight("movies"):
+                for item in all_items:
+                    item["recommendedscore"] = profile.score(item, "movies") / (1+item["playcount"])
+                return sorted(all_items, key=itemgetter("recommendedscore"), reverse=True)[:self.options["limit"]]
         if not ref_movies:
             # get recently watched movies
             ref_movies = self.metadatautils.kodidb.movies(sort=kodi_constants.SORT_LASTPLAYED,
                                                           filters=[kodi_constants.FILTER_WATCHED],
                                                           limits=(0, self.options["num_recent_similar"]))
-        # predefine feature sets
-        ref_sets = dict()
-        for ref_movie in ref_movies:
-            title = ref_movie['title']
-            set_genres = set(ref_movie["genre"])
-            set_directors = set(ref_movie["director"])
-            set_writers = set(ref_movie["writer"])
-            set_cast = set([x["name"] for x in ref_movie["cast"][:5]])
-            ref_sets[title] = (set_genres, set_directors, set_writers, set_cast)
         # average scores together for every item
-        for item in all_items:
-            similarscore = 0
-            for ref_movie in ref_movies:
-                title = ref_movie['title']
-                similarscore += self.get_similarity_score(ref_movie, item, sets=ref_sets[title])
+        scores = SimilarityEngine(all_items).score_many(ref_movies, "movies")
+        for item, similarscore in zip(all_items, scores):
             item["recommendedscore"] = similarscore / (1+item["playcount"]) / len(ref_movies)
         # return list sorted by score and capped by limit
         return sorted(all_items, key=itemgetter("recommendedscore"), reverse=True)[:self.options["limit"]]
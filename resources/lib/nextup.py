@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    nextup.py
+    next up and continue watching episodes of many shows at once: one query for the episodes of all shows,
+    one pass to find the episode per show and one batched request for the details of the found episodes.
+    The service keeps the result per show as the next up state, the widgets then only look it up.
+'''
+
+import time
+import xbmcgui
+from metadatautils import kodi_constants
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file, log_msg
+from resources.lib.library_mirror import query_mirror, get_item_details
+
+# the episode fields needed to find the next up and continue watching episodes
+NEXTUP_FIELDS = ["tvshowid", "season", "episode", "playcount", "resume", "lastplayed"]
+# bump when the stored records change, the state is rebuilt
+STATE_FORMAT = 1
+# the service publishes the version of the state it keeps current in this window property,
+# the plugin ignores a stored state which doesn't match (e.g. when the service doesn't run)
+STATE_PROPERTY = "SkinHelper.Widgets.NextUpState"
+
+
+def get_show_episodes(metadatautils, tvshow_ids, include_specials=False):
+    '''returns the episodes (with NEXTUP_FIELDS only) of the given shows per tvshowid, in episode order'''
+    filters = []
+    if not include_specials:
+        filters.append({"field": "season", "operator": "greaterthan", "value": "0"})
+    tvshow_ids = set(tvshow_ids)
+    show_episodes = dict((tvshow_id, []) for tvshow_id in tvshow_ids)
+    for episode in metadatautils.kodidb.get_json("VideoLibrary.GetEpisodes", fields=NEXTUP_FIELDS,
+                                                 returntype="episodes", filters=filters):
+        if episode["tvshowid"] in tvshow_ids:
+            show_episodes[episode["tvshowid"]].append(episode)
+    for episodes in show_episodes.values():
+        episodes.sort(key=lambda x: (x["season"], x["episode"]))
+    return show_episodes
+
+
+def get_last_played(episodes, watched_only=False):
+    '''returns the position of the last played (and watched) episode, None if there is none'''
+    last_played = None
+    for index, episode in enumerate(episodes):
+        if not episode.get("lastplayed") or (watched_only and not episode["playcount"]):
+            continue
+        if last_played is None or episode["lastplayed"] > episodes[last_played]["lastplayed"]:
+            last_played = index
+    return last_played
+
+
+def get_next_episode(episodes):
+    '''
+        the first unwatched episode after the last watched episode,
+        or the first unwatched episode if there is none after it (or none was watched yet)
+    '''
+    last_watched = get_last_played(episodes, watched_only=True)
+    if last_watched is not None:
+        for episode in episodes[last_watched + 1:]:
+            if not episode["playcount"]:
+                return episode
+    for episode in episodes:
+        if not episode["playcount"]:
+            return episode
+    return None
+
+
+def get_continue_episode(episodes):
+    '''the last played episode if it's in progress, else the episode after it, None if no episode was played'''
+    last_played = get_last_played(episodes)
+    if last_played is None:
+        return None
+    if int(episodes[last_played]["resume"]["position"]) > 0:
+        return episodes[last_played]
+    if last_played + 1 < len(episodes):
+        return episodes[last_played + 1]
+    return None
+
+
+def get_episode_details(episode_ids):
+    '''returns the full details of the given episodes (None for unknown ids) in one request'''
+    if not episode_ids:
+        return []
+    all_items = query_mirror("episodes", ids=episode_ids)
+    if all_items is not None:
+        return all_items
+    return get_item_details("episodes", episode_ids)
+
+
+def get_nextup_episodes(metadatautils, tvshow_ids, include_specials=False, continue_watching=False):
+    '''
+        returns the next up episode (or with continue_watching the continue watching episode)
+        of every given show which has one, in the order of the shows
+    '''
+    state = NextUpState.load()
+    if state and all("%s" % tvshow_id in state.data["shows"] for tvshow_id in tvshow_ids):
+        # the service keeps the records of these shows
+        episode_ids = [x for x in state.get_episode_ids(tvshow_ids, include_specials, continue_watching) if x]
+    else:
+        show_episodes = get_show_episodes(metadatautils, tvshow_ids, include_specials)
+        get_episode = get_continue_episode if continue_watching else get_next_episode
+        episodes = [get_episode(show_episodes[tvshow_id]) for tvshow_id in tvshow_ids]
+        episode_ids = [episode["episodeid"] for episode in episodes if episode]
+    return [episode for episode in get_episode_details(episode_ids) if episode]
+
+
+def get_show_record(episodes):
+    '''
+        the compact next up record of a show from all its episodes (in episode order): the next up and continue
+        watching episode ids without and with the specials, the last played episode and the watched counts
+    '''
+    regular_episodes = [episode for episode in episodes if episode["season"] > 0]
+    record = {"lastplayed": "", "last": None, "resume": 0, "next": [], "continue": [],
+              "watched": len([episode for episode in episodes if episode["playcount"]]), "episodes": len(episodes)}
+    last_played = get_last_played(episodes)
+    if last_played is not None:
+        record["lastplayed"] = episodes[last_played]["lastplayed"]
+        record["last"] = episodes[last_played]["episodeid"]
+        record["resume"] = int(episodes[last_played]["resume"]["position"])
+    for show_episodes in [regular_episodes, episodes]:
+        for key, get_episode in [("next", get_next_episode), ("continue", get_continue_episode)]:
+            episode = get_episode(show_episodes)
+            record[key].append(episode["episodeid"] if episode else None)
+    return record
+
+
+class NextUpState(object):
+    '''the next up record of every show, maintained by the service from the playback and library events'''
+
+    def __init__(self, data=None):
+        '''Initialization'''
+        self.filename = get_profile_path("nextup.json")
+        self.data = data or {"format": STATE_FORMAT, "version": "", "shows": {}}
+
+    @classmethod
+    def load(cls):
+        '''returns the stored state, None if the service doesn't keep it current'''
+        data = read_json_file(get_profile_path("nextup.json"))
+        if not data or data.get("format") != STATE_FORMAT or \
+                data.get("version") != xbmcgui.Window(10000).getProperty(STATE_PROPERTY):
+            return None
+        return cls(data)
+
+    def save(self, win):
+        '''store the state and publish its version'''
+        self.data["version"] = "%s" % time.time()
+        write_json_file(self.filename, self.data)
+        win.setProperty(STATE_PROPERTY, self.data["version"])
+
+    def reconcile(self, metadatautils):
+        '''rebuild the records of all shows with one query for all episodes'''
+        show_episodes = {}
+        for episode in metadatautils.kodidb.get_json("VideoLibrary.GetEpisodes", fields=NEXTUP_FIELDS,
+                                                     returntype="episodes"):
+            show_episodes.setdefault(episode["tvshowid"], []).append(episode)
+        self.data["shows"] = {}
+        for tvshow_id, episodes in show_episodes.items():
+            episodes.sort(key=lambda x: (x["season"], x["episode"]))
+            self.data["shows"]["%s" % tvshow_id] = get_show_record(episodes)
+        log_msg("NextUpState: reconciled %s shows" % len(show_episodes))
+
+    def update_shows(self, metadatautils, tvshow_ids):
+        '''recompute the records of the given shows'''
+        for tvshow_id in tvshow_ids:
+            episodes = metadatautils.kodidb.episodes(sort=kodi_constants.SORT_EPISODE, tvshowid=tvshow_id,
+                                                     fields=NEXTUP_FIELDS)
+            if episodes:
+                episodes.sort(key=lambda x: (x["season"], x["episode"]))
+                self.data["shows"]["%s" % tvshow_id] = get_show_record(episodes)
+            else:
+                self.data["shows"].pop("%s" % tvshow_id, None)
+
+    def get_shows(self, episode_id):
+        '''returns the ids of the shows whose record refers to the given episode'''
+        return [int(key) for key, record in self.data["shows"].items()
+                if episode_id == record["last"] or episode_id in record["next"] or episode_id in record["continue"]]
+
+    def get_show_ids(self, limit, inprogress_only=False, unwatched_only=True):
+        '''
+            the ids of the last played shows, like the kodi tvshows query sorted by lastplayed
+            with the unwatched (or in progress) filter
+        '''
+        shows = []
+        for key, record in self.data["shows"].items():
+            if unwatched_only and record["watched"] >= record["episodes"]:
+                continue
+            if inprogress_only and not record["watched"]:
+                continue
+            shows.append((record["lastplayed"], int(key)))
+        return [tvshow_id for _, tvshow_id in sorted(shows, key=lambda x: (x[0], -x[1]), reverse=True)[:limit]]
+
+    def get_episode_ids(self, tvshow_ids, include_specials=False, continue_watching=False):
+        '''the next up (or continue watching) episode ids of the given shows, None for shows without a record'''
+        key = "continue" if continue_watching else "next"
+        records = [self.data["shows"].get("%s" % tvshow_id) for tvshow_id in tvshow_ids]
+        return [record[key][int(include_specials)] if record else None for record in records]
+
+    def get_episodes(self, limit, include_specials=False, inprogress_only=False, continue_watching=False):
+        '''the next up (or continue watching) episodes of the last played shows, looked up in the records'''
+        if continue_watching:
+            tvshow_ids = self.get_show_ids(limit, unwatched_only=False)
+        else:
+            tvshow_ids = self.get_show_ids(limit, inprogress_only)
+        episode_ids = self.get_episode_ids(tvshow_ids, include_specials, continue_watching)
+        return [episode for episode in get_episode_details([x for x in episode_ids if x]) if episode]
@@ -0,0 +1,324 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    prewarm.py
+    recompute cached widget listings in the background service after library changes
+'''
+
+import sys
+import time
+import threading
+if sys.version_info.major == 3:
+    import queue as Queue
+else:
+    import Queue
+import xbmcaddon
+from metadatautils import MetadataUtils
+from resources.lib.utils import log_msg, log_exception, ADDON_ID
+from resources.lib.registry import WidgetRegistry, get_dependencies, is_affected, create_change
+from resources.lib.main import get_options, get_cache_str, get_widget_items
+from resources.lib.similarity_table import SimilarityTable
+from resources.lib.minhash_index import MinHashIndex
+from resources.lib.taste_profile import TasteProfile, build_profile
+from resources.lib.cowatch import CoWatchModel, build_model, get_key
+from resources.lib.nextup import NextUpState, STATE_PROPERTY
+from resources.lib.imdb_index import ImdbIndex, INDEX_PROPERTY
+
+# widget mediatypes which need to be recomputed when a library item of the given type changes
+VIDEO_WIDGET_TYPES = {
+    "movie": ["movies", "media"],
+    "episode": ["episodes", "tvshows", "media"],
+    "tvshow": ["tvshows", "episodes", "media"],
+    "musicvideo": ["musicvideos"],
+    "": ["movies", "tvshows", "episodes", "musicvideos", "media"]
+}
+MUSIC_WIDGET_TYPES = ["albums", "songs", "artists", "media"]
+WIDGET_TYPES = ["movies", "tvshows", "episodes", "musicvideos", "albums", "songs", "artists", "media", "pvr"]
+
+# above this amount of changed episodes we don't resolve their tvshows but refresh all listings
+MAX_EPISODE_LOOKUPS = 20
+# the amount of similarity table rows computed at once while the worker is idle
+SIMILARITY_BATCH_SIZE = 50
+
+
+class WidgetPrewarmer(threading.Thread):
+    '''
+        background worker which fills the widget cache for the registered widgets affected by a
+        library change before the new reload token is published, so the skin only gets cache hits
+    '''
+
+    def __init__(self, win, monitor, mirror=None):
+        '''Initialization'''
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.win = win
+        self.monitor = monitor
+        self.mirror = mirror
+        self.jobs = Queue.Queue()
+        self.metadatautils = None
+        self.similarity_tables = [SimilarityTable("movies"), SimilarityTable("tvshows")]
+        self.nextup_state = NextUpState()
+        self.imdb_index = ImdbIndex()
+
+    def refresh(self, change, properties):
+        '''queue a refresh for the given library change, the window properties are set when done'''
+        self.jobs.put((change, properties))
+
+    def stop(self):
+        '''stop the worker thread'''
+        self.jobs.put(None)
+
+    def add_watched(self, media_type, item_id, ended=False):
+        '''
+            queue adding a stopped movie or episode to the taste profile and the co-watch model
+            (and updating the next up record of the show of an episode), before the widgets are refreshed
+        '''
+        if media_type == "episode":
+            # the resume position or the next episode of the show changed
+            self.jobs.put(lambda: self.update_nextup_state(create_change(["episodes"], "episode", item_id, [])))
+        self.jobs.put(lambda: self.update_watched(media_type, item_id, ended))
+
+    def run(self):
+        '''process the queued refresh jobs'''
+        self.metadatautils = MetadataUtils()
+        if self.mirror:
+            try:
+                self.mirror.load(self.metadatautils)
+            except Exception as exc:
+                log_exception(__name__, exc)
+            if xbmcaddon.Addon(ADDON_ID).getSetting("approximate_similarity") == "true":
+                # the LSH buckets are maintained like the similarity tables
+                self.similarity_tables += [MinHashIndex("movies"), MinHashIndex("tvshows")]
+            for table in self.similarity_tables:
+                if not table.is_current():
+                    table.reset()
+            # the library may have changed while kodi was not running
+            self.update_similarity_tables(None)
+        if not TasteProfile.load():
+            try:
+                build_profile(self.metadatautils, self.get_tvshow)
+            except Exception as exc:
+                log_exception(__name__, exc)
+        if not CoWatchModel().is_current():
+            try:
+                build_model(self.metadatautils)
+            except Exception as exc:
+                log_exception(__name__, exc)
+        # the episodes may have been played while the service was not running
+        self.update_nextup_state(None)
+        self.update_imdb_index(None)
+        while not self.monitor.abortRequested():
+            if self.build_similarity_tables():
+                # keep building while there is nothing else to do
+                try:
+                    job = self.jobs.get(block=False)
+                except Queue.Empty:
+                    continue
+            else:
+                job = self.jobs.get()
+            if job is None:
+                break
+            if callable(job):
+                try:
+                    job()
+                except Exception as exc:
+                    log_exception(__name__, exc)
+                continue
+            change, properties = job
+            timestr = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+            try:
+                if self.mirror:
+                    # the widgets read from the mirror so it needs to be up to date first
+                    self.mirror.update(self.metadatautils, change)
+                    self.update_similarity_tables(change)
+                self.update_nextup_state(change)
+                self.update_imdb_index(change)
+                self.prewarm(change, properties, timestr)
+            except Exception as exc:
+                log_exception(__name__, exc)
+            # publish the new reload token, the skin will now find the listings in the cache
+            for prop in properties:
+                self.win.setProperty(prop, timestr)
+        # the widgets can't rely on the next up state and the imdb index anymore
+        self.win.clearProperty(STATE_PROPERTY)
+        self.win.clearProperty(INDEX_PROPERTY)
+        self.metadatautils.close()
+        del self.metadatautils
+
+    def get_tvshow(self, tvshow_id):
+        '''returns a tvshow from the library mirror or else from kodi'''
+        tvshow = self.mirror.get_item("tvshows", tvshow_id) if self.mirror else None
+        return tvshow or self.metadatautils.kodidb.tvshow(tvshow_id)
+
+    def update_watched(self, media_type, item_id, ended=False):
+        '''
+            add a movie or the show of an episode to the taste profile and the co-watch model
+            if it was watched completely
+        '''
+        item = getattr(self.metadatautils.kodidb, media_type)(item_id)
+        if not item:
+            return
+        if not ended and (not item.get("playcount") or item.get("resume", {}).get("position")):
+            # stopped before kodi considers it watched
+            return
+        profile = TasteProfile.load() or TasteProfile()
+        if media_type == "episode":
+            tvshow = self.get_tvshow(item["tvshowid"])
+            if tvshow:
+                profile.add(tvshow, "tvshows")
+        else:
+            profile.add(item, "movies")
+        profile.save()
+        model = CoWatchModel()
+        if model.is_current():
+            model.add(get_key("tvshow", item["tvshowid"]) if media_type == "episode" else get_key("movie", item_id))
+            model.save()
+
+    def build_similarity_tables(self):
+        '''compute a batch of missing similarity table rows or LSH buckets, returns True if items are still missing'''
+        if not self.mirror:
+            return False
+        missing = 0
+        for table in self.similarity_tables:
+            library_table = self.mirror.get_table(table.media_type)
+            if library_table is None:
+                continue
+            try:
+                missing += table.build(library_table, SIMILARITY_BATCH_SIZE)
+            except Exception as exc:
+                log_exception(__name__, exc)
+                return False
+            if missing:
+                break
+        return missing > 0
+
+    def update_similarity_tables(self, change):
+        '''
+            update the similarity tables with the movies and tvshows added, changed or removed by the change,
+            all items are checked if the change is None or has no details
+        '''
+        for table in self.similarity_tables:
+            library_table = self.mirror.get_table(table.media_type)
+            if library_table is None:
+                continue
+            dbtype = table.media_type[:-1]
+            if not change or change["unknown"]:
+                # the signatures of the rows tell which items changed
+                changed_ids, removed_ids = list(library_table.keys()), []
+            else:
+                changed_ids = change["items"].get(dbtype, [])
+                removed_ids = change.get("removed", {}).get(dbtype, [])
+            try:
+                table.update(library_table, changed_ids, removed_ids)
+            except Exception as exc:
+                # the outdated rows are found by their signatures after the next scan or restart
+                log_exception(__name__, exc)
+
+    def update_nextup_state(self, change):
+        '''
+            update the next up records of the shows of the episodes changed by the change, all shows are
+            reconciled at startup (change is None) and after a change of the episodes without item ids (e.g. a scan)
+        '''
+        if change and not change["widget_types"].intersection(["episodes", "tvshows"]):
+            return
+        try:
+            episode_ids = change["items"].get("episode", set()) if change else set()
+            if not change or (change["unknown"] and not episode_ids):
+                self.nextup_state.reconcile(self.metadatautils)
+            else:
+                if not episode_ids:
+                    return
+                tvshow_ids = set()
+                for episode_id in episode_ids:
+                    episode = self.mirror.get_item("episodes", episode_id) if self.mirror else None
+                    if not episode and episode_id not in change["removed"].get("episode", set()):
+                        episode = self.metadatautils.kodidb.episode(episode_id)
+                    if episode and episode.get("tvshowid"):
+                        tvshow_ids.add(episode["tvshowid"])
+                    else:
+                        # removed, the shows which refer to it need a new record
+                        tvshow_ids.update(self.nextup_state.get_shows(episode_id))
+                self.nextup_state.update_shows(self.metadatautils, tvshow_ids)
+            self.nextup_state.save(self.win)
+        except Exception as exc:
+            # the widgets compute the next up episodes themselves until the next reconciliation
+            self.win.clearProperty(STATE_PROPERTY)
+            log_exception(__name__, exc)
+
+    def update_imdb_index(self, change):
+        '''
+            update the imdb ids of the movies and tvshows added, changed or removed by the change, all items
+            are compared with the library at startup (change is None) and after a change without item ids (e.g. a scan)
+        '''
+        if change and not change["widget_types"].intersection(["movies", "tvshows"]):
+            return
+        try:
+            changed = False
+            for media_type in ["movies", "tvshows"]:
+                dbtype = media_type[:-1]
+                if change and media_type not in change["widget_types"]:
+                    continue
+                if not change or (change["unknown"] and not change["items"].get(dbtype)):
+                    changed = self.imdb_index.reconcile(self.metadatautils, media_type) or changed
+                elif change["items"].get(dbtype):
+                    removed_ids = change["removed"].get(dbtype, set())
+                    changed = self.imdb_index.update(self.metadatautils, media_type,
+                                                     change["items"][dbtype].difference(removed_ids),
+                                                     removed_ids) or changed
+            self.imdb_index.save(self.win, changed)
+        except Exception as exc:
+            # the widgets look up the imdb ids themselves until the next reconciliation
+            self.win.clearProperty(INDEX_PROPERTY)
+            log_exception(__name__, exc)
+
+    def prewarm(self, change, properties, checksum):
+        '''
+            recompute the registered widget listings affected by the change and carry over the
+            unaffected ones to the new reload token so they stay cache hits
+        '''
+        addon = xbmcaddon.Addon(ADDON_ID)
+        registry = WidgetRegistry()
+        # only listings keyed by one of the reload properties we are about to change are in scope
+        current_tokens = set(self.win.getProperty(prop) for prop in properties)
+        current_tokens.discard("")
+        episode_ids = change["items"].get("episode", [])
+        if episode_ids and len(episode_ids) <= MAX_EPISODE_LOOKUPS:
+            # episode changes also show up in the listings of their tvshow
+            for episode_id in episode_ids:
+                episode = self.mirror.get_item("episodes", episode_id) if self.mirror else None
+                if not episode:
+                    episode = self.metadatautils.kodidb.episode(episode_id)
+                if episode and episode.get("tvshowid"):
+                    change["items"].setdefault("tvshow", set()).add(episode["tvshowid"])
+        elif episode_ids:
+            change["unknown"] = True
+        refreshed = 0
+        for entry in registry.entries():
+            if self.monitor.abortRequested() or self.win.getProperty("SkinHelperShutdownRequested"):
+                break
+            # outdated listings served by the plugin are refreshed whatever reload token they have
+            requested = change["revalidate"].get(entry["cache_str"])
+            if entry["checksum"] not in current_tokens and not requested:
+                continue
+            # the listing must be stored with the reload token we are about to publish,
+            # unless the widget uses a reload parameter we don't control
+            entry_checksum = requested if requested and requested not in current_tokens else checksum
+            if is_affected(entry, change):
+                options = get_options(entry["paramstring"], addon, self.win)
+                options["reload"] = entry_checksum
+                cache_str = get_cache_str(options)
+                all_items = get_widget_items(addon, self.metadatautils, options)
+                entry["dependencies"] = get_dependencies(options, all_items)
+                refreshed += 1
+            else:
+                cache_str = entry["cache_str"]
+                all_items = self.metadatautils.cache.get(cache_str, checksum=entry["checksum"])
+                if not all_items:
+                    continue
+            self.metadatautils.cache.set(cache_str, all_items, checksum=entry_checksum)
+            entry["checksum"] = entry_checksum
+            registry.update(entry)
+        log_msg("Prewarmed %s widget listings for library change %s" % (refreshed, change))
+        del addon
@@ -57,6 +57,11 @@ class Pvr(object):
 
         return self.metadatautils.process_method_on_list(create_main_entry, all_items)
 
+    @staticmethod
+    def get_next_refresh(now):
+        '''the channel widgets show the current programme, most programmes start at the full or half hour'''
+        return (int(now) // 1800 + 1) * 1800 + 60
+
     def channels(self):
         ''' get all channels '''
         all_items = []
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    registry.py
+    keeps track of the widget listings the skin requested so the service can refresh them
+'''
+
+import os
+import time
+from hashlib import md5
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file
+
+# registered widgets which were not requested by the skin for this long are forgotten
+MAX_UNUSED_DAYS = 7
+
+# library ids we keep track of for every cached listing
+DEPENDENCY_TYPES = ["movie", "episode", "tvshow", "musicvideo", "album", "song", "artist"]
+
+# the library predicates a widget listing depends on, derived from the widget action
+PREDICATE_INPROGRESS = "inprogress"
+PREDICATE_LASTPLAYED = "lastplayed"
+PREDICATE_UNWATCHED = "unwatched"
+PREDICATE_DATEADDED = "dateadded"
+PREDICATE_AIRDATE = "airdate"
+PREDICATE_RANDOM = "random"
+PREDICATE_PVR = "pvr"
+# message the plugin sends to the service to refresh an outdated listing it served from the cache
+REVALIDATE_MESSAGE = "revalidate"
+PREDICATE_ACTIONS = {
+    PREDICATE_INPROGRESS: ["inprogress", "next", "continuewatching", "unaired", "nextaired", "airingtoday"],
+    PREDICATE_LASTPLAYED: ["inprogress", "next", "continuewatching", "recentplayed", "watchagain", "recommended",
+                           "similar", "becauseyouwatched", "cowatched", "playlist", "unaired", "nextaired",
+                           "airingtoday"],
+    PREDICATE_UNWATCHED: ["unwatched", "next", "recommended", "similar", "cowatched", "watchagain", "unaired",
+                          "nextaired", "airingtoday"],
+    PREDICATE_DATEADDED: ["recent", "newrelease"],
+    PREDICATE_AIRDATE: ["unaired", "nextaired", "airingtoday"],
+    PREDICATE_RANDOM: ["random"],
+    PREDICATE_PVR: ["channels", "recordings", "timers"]
+}
+
+
+class WidgetRegistry(object):
+    '''one small json file per cached widget listing, stored in the addon's profile folder'''
+
+    def __init__(self):
+        '''Initialization'''
+        self.folder = get_profile_path("widgets")
+
+    def get_filename(self, cache_str):
+        '''returns the registry file for the given cache_str'''
+        return os.path.join(self.folder, "%s.json" % md5(cache_str.encode("utf-8")).hexdigest())
+
+    def register(self, cache_str, paramstring, options, checksum, all_items):
+        '''store the details of a widget listing which was just written to the cache'''
+        entry = {
+            "cache_str": cache_str,
+            "paramstring": paramstring,
+            "mediatype": options["mediatype"],
+            "action": options["action"],
+            "checksum": checksum,
+            "dependencies": get_dependencies(options, all_items),
+            "updated": time.time()
+        }
+        write_json_file(self.get_filename(cache_str), entry)
+        return entry
+
+    def get(self, cache_str):
+        '''returns the registered entry for the given cache_str, None if not registered'''
+        return read_json_file(self.get_filename(cache_str))
+
+    def update(self, entry):
+        '''rewrite an existing entry (e.g. after the service refreshed it) without marking it as requested'''
+        filename = self.get_filename(entry["cache_str"])
+        try:
+            last_request = os.path.getmtime(filename)
+        except OSError:
+            last_request = time.time()
+        entry["updated"] = time.time()
+        write_json_file(filename, entry)
+        os.utime(filename, (last_request, last_request))
+
+    def touch(self, cache_str):
+        '''mark a widget listing as requested by the skin (cheap, only updates the file time)'''
+        try:
+            os.utime(self.get_filename(cache_str), None)
+        except OSError:
+            pass
+
+    def entries(self, media_types=None):
+        '''returns all registered (and still used) widget listings, optionally filtered by mediatype'''
+        result = []
+        max_age = time.time() - MAX_UNUSED_DAYS * 86400
+        for filename in os.listdir(self.folder):
+            if not filename.endswith(".json"):
+                continue
+            filename = os.path.join(self.folder, filename)
+            try:
+                if os.path.getmtime(filename) < max_age:
+                    os.remove(filename)
+                    continue
+            except OSError:
+                continue
+            entry = read_json_file(filename)
+            if entry and (not media_types or entry["mediatype"] in media_types):
+                result.append(entry)
+        return result
+
+
+def get_dependencies(options, all_items):
+    '''returns the library ids contained in a widget listing and the predicates it was selected by'''
+    ids = {}
+    for item in all_items:
+        for dbtype in DEPENDENCY_TYPES:
+            dbid = item.get("%sid" % dbtype)
+            if dbid:
+                ids.setdefault(dbtype, []).append(dbid)
+    predicates = []
+    for predicate, actions in PREDICATE_ACTIONS.items():
+        if options.get("hide_watched") and predicate == PREDICATE_UNWATCHED:
+            predicates.append(predicate)
+        elif any(action in options["action"] for action in actions):
+            predicates.append(predicate)
+    return {"ids": ids, "predicates": predicates}
+
+
+def get_change_predicates(method, data):
+    '''returns the widget predicates touched by a library notification, None if any listing may be affected'''
+    if method.endswith("OnRemove"):
+        # a removed item can only change the listings it was part of
+        return []
+    if data.get("added"):
+        # a new item may end up in any listing
+        return None
+    if "playcount" in data:
+        return [PREDICATE_UNWATCHED, PREDICATE_INPROGRESS, PREDICATE_LASTPLAYED]
+    # resume point or lastplayed update after playback
+    return [PREDICATE_INPROGRESS, PREDICATE_LASTPLAYED]
+
+
+def create_change(widget_types, media_type="", item_id=None, predicates=None, removed=False):
+    '''describes a library change: the widget mediatypes, changed (or removed) items and touched predicates'''
+    change = {"widget_types": set(widget_types), "items": {}, "removed": {}, "predicates": predicates,
+              "unknown": not item_id and predicates is None, "revalidate": {}}
+    if item_id:
+        change["items"][media_type] = set([item_id])
+        if removed:
+            change["removed"][media_type] = set([item_id])
+    return change
+
+
+def merge_changes(change, other):
+    '''merge the other library change into the first one'''
+    change["widget_types"].update(other["widget_types"])
+    for dbtype, ids in other["items"].items():
+        change["items"].setdefault(dbtype, set()).update(ids)
+    for dbtype, ids in other["removed"].items():
+        change["removed"].setdefault(dbtype, set()).update(ids)
+    change["revalidate"].update(other["revalidate"])
+    if change["predicates"] is None or other["predicates"] is None:
+        change["predicates"] = None
+    else:
+        change["predicates"] = list(set(change["predicates"] + other["predicates"]))
+    change["unknown"] = change["unknown"] or other["unknown"]
+    return change
+
+
+def is_affected(entry, change):
+    '''checks if a registered widget listing is affected by the given library change'''
+    if entry["cache_str"] in change["revalidate"]:
+        return True
+    if entry["mediatype"] not in change["widget_types"]:
+        return False
+    dependencies = entry.get("dependencies")
+    if change["unknown"] or not dependencies:
+        # no details available, assume the worst
+        return True
+    for dbtype, ids in change["items"].items():
+        if ids.intersection(dependencies["ids"].get(dbtype, [])):
+            return True
+    if change["predicates"] is None:
+        return True
+    return bool(set(change["predicates"]).intersection(dependencies["predicates"]))
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    scheduler.py
+    timed jobs for the background service
+'''
+
+import time
+import heapq
+import threading
+from resources.lib.utils import log_msg, log_exception
+
+
+class Scheduler(threading.Thread):
+    '''
+        priority queue of named, timed jobs. The thread sleeps until the next deadline and is woken
+        up whenever a job is (re)scheduled. A job returns its next deadline or None when it is done.
+    '''
+
+    def __init__(self):
+        '''Initialization'''
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.condition = threading.Condition()
+        self.queue = []
+        self.jobs = {}
+        self.counter = 0
+        self.stopped = False
+
+    def schedule(self, name, deadline, func):
+        '''(re)schedule the named job to run at the given time, replaces an earlier schedule of that job'''
+        with self.condition:
+            self.counter += 1
+            self.jobs[name] = (self.counter, func)
+            heapq.heappush(self.queue, (deadline, self.counter, name))
+            self.condition.notify()
+
+    def cancel(self, name):
+        '''remove the named job, its queue entry is skipped when it comes up'''
+        with self.condition:
+            self.jobs.pop(name, None)
+
+    def stop(self):
+        '''stop the scheduler thread'''
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def next_job(self):
+        '''wait for the next due job and return it, returns None when stopped'''
+        with self.condition:
+            while not self.stopped:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                deadline, counter, name = self.queue[0]
+                if self.jobs.get(name, (None,))[0] != counter:
+                    # job was rescheduled or cancelled
+                    heapq.heappop(self.queue)
+                    continue
+                if deadline > time.time():
+                    self.condition.wait(deadline - time.time())
+                    continue
+                heapq.heappop(self.queue)
+                return name, self.jobs.pop(name)[1]
+        return None
+
+    def run(self):
+        '''execute the jobs when they are due'''
+        while True:
+            job = self.next_job()
+            if not job:
+                break
+            name, func = job
+            try:
+                deadline = func()
+            except Exception as exc:
+                log_exception(__name__, exc)
+                deadline = None
+            if deadline:
+                with self.condition:
+                    if name not in self.jobs:
+                        # the job did not reschedule itself in the meantime
+                        self.counter += 1
+                        self.jobs[name] = (self.counter, func)
+                        heapq.heappush(self.queue, (deadline, self.counter, name))
+            else:
+                log_msg("Scheduler: job %s finished" % name)
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    similarity.py
+    batched similarity scoring of library items, computes the same scores as the
+    get_similarity_score methods of the movies and tvshows widgets
+'''
+
+from operator import itemgetter
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the features a similarity score is built of, per item type, in the order the terms are summed:
+# (feature, scoring method, weight)
+# jaccard: matching values / unique values of both, overlap: sqrt of matching values / max values,
+# closeness: 1 - difference / window, equal: 1 if the reference has a value and it is the same
+SCORE_TERMS = {
+    "movies": [("genre", "jaccard", .5), ("director", "jaccard", .15), ("writer", "jaccard", .1),
+               ("cast5", "overlap", .1), ("rating", "closeness", .05), ("year", "closeness", .075),
+               ("mpaa", "equal", .025)],
+    "tvshows": [("genre", "jaccard", .5), ("studio", "equal", .05), ("cast10", "overlap", .35),
+                ("rating", "closeness", .025), ("year", "closeness", .05), ("mpaa", "equal", .025)]
+}
+# the scoring methods of the features with multiple values, an item can only score on them if it shares
+# at least one value with the reference
+SET_METHODS = ["jaccard", "overlap"]
+# the maximum amount of cast members compared
+OVERLAP_SIZES = {"cast5": 5, "cast10": 10}
+# the difference at which the closeness score drops to 0
+CLOSENESS_WINDOWS = {"rating": 3, "year": 10}
+# items in the same movie set get the square root of their score
+SET_BOOST_TYPES = ["movies"]
+
+
+def get_feature(item, feature):
+    '''returns the value (or list of values) of a feature of a library item'''
+    if feature in OVERLAP_SIZES:
+        return [x["name"] for x in item["cast"][:OVERLAP_SIZES[feature]]]
+    if feature == "studio":
+        # compared as a whole
+        return tuple(item["studio"])
+    return item[feature]
+
+
+def get_reference_sets(ref_item, media_type):
+    '''returns the value sets of the reference item for the set based features'''
+    return dict((feature, set(get_feature(ref_item, feature)))
+                for feature, method, _ in SCORE_TERMS[media_type] if method in SET_METHODS)
+
+
+class SimilarityEngine(object):
+    '''
+        the candidate items encoded once per feature, so they can be scored against any amount of
+        references in one pass per reference. Uses numpy when available, plain python otherwise.
+    '''
+
+    def __init__(self, items, use_numpy=True):
+        '''Initialization'''
+        self.items = items
+        self.size = len(items)
+        self.use_numpy = use_numpy and numpy is not None
+        self.columns = {}
+
+    def get_column(self, feature, method):
+        '''encode the feature of all items, on first use'''
+        if feature not in self.columns:
+            if method in SET_METHODS:
+                self.columns[feature] = self.encode_sets(feature)
+            else:
+                self.columns[feature] = self.encode_values(feature, method)
+        return self.columns[feature]
+
+    def encode_sets(self, feature):
+        '''posting lists (value -> rows) and the amount of unique values per row of a set feature'''
+        postings = {}
+        sizes = []
+        for row, item in enumerate(self.items):
+            values = set(get_feature(item, feature))
+            sizes.append(len(values))
+            for value in values:
+                postings.setdefault(value, []).append(row)
+        if self.use_numpy:
+            postings = dict((value, numpy.array(rows, dtype=numpy.int64)) for value, rows in postings.items())
+            sizes = numpy.array(sizes, dtype=numpy.float64)
+        return postings, sizes
+
+    def encode_values(self, feature, method):
+        '''the values of a single valued feature, equality features are encoded as codes'''
+        values = [get_feature(item, feature) for item in self.items]
+        if self.use_numpy:
+            if method == "equal":
+                codes = {}
+                values = numpy.array([codes.setdefault(value, len(codes)) for value in values], dtype=numpy.int64)
+                return values, codes
+            # keep the python types of the values (int years, float ratings) for identical results
+            dtype = numpy.int64 if all(isinstance(value, int) for value in values) else numpy.float64
+            return numpy.array(values, dtype=dtype), None
+        return values, None
+
+    def score(self, ref_item, media_type, sets=None, rows=None):
+        '''returns the similarity scores of all items (or the given rows) with the reference, in their order'''
+        sets = sets or get_reference_sets(ref_item, media_type)
+        rows = range(self.size) if rows is None else rows
+        if self.use_numpy:
+            scores = self.score_numpy(ref_item, media_type, sets, numpy.array(rows, dtype=numpy.int64))
+        else:
+            scores = self.score_python(ref_item, media_type, sets, rows)
+        if media_type in SET_BOOST_TYPES and ref_item.get("setid"):
+            # exponentially scale score for items in the same set
+            set_rows = set(self.get_set_rows(ref_item["setid"]))
+            for index, row in enumerate(rows):
+                if row in set_rows:
+                    scores[index] **= (1./2)
+        return scores
+
+    def top(self, ref_item, media_type, limit, excluded_rows=None):
+        '''
+            returns (row, score) of the limit best scoring items, the same as sorting the scores of all items.
+            Only the items sharing a set feature value (or the movie set) with the reference are scored, unless
+            the others, which can't score more than get_score_bound, could still make it into the result.
+        '''
+        if limit <= 0:
+            return []
+        sets = get_reference_sets(ref_item, media_type)
+        candidates = set()
+        for feature, method, weight in SCORE_TERMS[media_type]:
+            if method in SET_METHODS:
+                postings = self.get_column(feature, method)[0]
+                for value in sets[feature]:
+                    candidates.update(postings.get(value, []))
+        if media_type in SET_BOOST_TYPES and ref_item.get("setid"):
+            candidates.update(self.get_set_rows(ref_item["setid"]))
+        candidates = sorted(candidates)
+        ranked = self.rank(ref_item, media_type, sets, candidates, excluded_rows)
+        if len(ranked) >= limit and ranked[limit - 1][1] > get_score_bound(media_type):
+            return ranked[:limit]
+        # not enough candidates which certainly beat the others, score the rest too
+        candidates = set(candidates)
+        others = [row for row in range(self.size) if row not in candidates]
+        ranked += self.rank(ref_item, media_type, sets, others, excluded_rows)
+        # same order as a stable sort of all items by score
+        return sorted(ranked, key=lambda x: (-x[1], x[0]))[:limit]
+
+    def rank(self, ref_item, media_type, sets, rows, excluded_rows=None):
+        '''returns (row, score) of the given rows sorted by score'''
+        scores = self.score(ref_item, media_type, sets, rows)
+        ranked = []
+        for row, score in zip(rows, scores):
+            if excluded_rows and row in excluded_rows:
+                score = 0
+            ranked.append((row, score))
+        return sorted(ranked, key=itemgetter(1), reverse=True)
+
+    def get_set_rows(self, setid):
+        '''returns the rows of the movies in the given movie set'''
+        if "setid" not in self.columns:
+            set_rows = {}
+            for row, item in enumerate(self.items):
+                if item["setid"]:
+                    set_rows.setdefault(item["setid"], []).append(row)
+            self.columns["setid"] = set_rows
+        return self.columns["setid"].get(setid, [])
+
+    def score_many(self, ref_items, media_type, weights=None):
+        '''returns the (weighted by title) sum of the similarity scores of all items with all references'''
+        total = None
+        for ref_item in ref_items:
+            scores = self.score(ref_item, media_type)
+            if weights:
+                weight = weights[ref_item["title"]]
+                scores = [weight * score for score in scores]
+            if total is None:
+                total = scores
+            else:
+                total = [value + score for value, score in zip(total, scores)]
+        return total or [0] * self.size
+
+    def count_matches(self, feature, method, ref_values):
+        '''returns the amount of reference values in every row, using the posting lists'''
+        postings, sizes = self.get_column(feature, method)
+        if self.use_numpy:
+            counts = numpy.zeros(self.size, dtype=numpy.float64)
+            for value in ref_values:
+                if value in postings:
+                    counts[postings[value]] += 1
+        else:
+            counts = [0] * self.size
+            for value in ref_values:
+                for row in postings.get(value, []):
+                    counts[row] += 1
+        return counts, sizes
+
+    def score_numpy(self, ref_item, media_type, sets, rows):
+        '''score the given rows with numpy array operations'''
+        scores = numpy.zeros(len(rows), dtype=numpy.float64)
+        for feature, method, weight in SCORE_TERMS[media_type]:
+            if method == "jaccard":
+                ref_values = sets[feature]
+                if not ref_values:
+                    term = numpy.zeros(len(rows), dtype=numpy.float64)
+                else:
+                    counts, sizes = self.count_matches(feature, method, ref_values)
+                    counts, sizes = counts[rows], sizes[rows]
+                    term = counts / (len(ref_values) + sizes - counts)
+            elif method == "overlap":
+                counts = self.count_matches(feature, method, sets[feature])[0][rows]
+                term = numpy.array(get_overlap_scores(OVERLAP_SIZES[feature]))[counts.astype(numpy.int64)]
+            elif method == "closeness":
+                values = self.get_column(feature, method)[0][rows]
+                ref_value = ref_item[feature]
+                window = CLOSENESS_WINDOWS[feature]
+                if not ref_value:
+                    term = numpy.zeros(len(rows), dtype=numpy.float64)
+                else:
+                    difference = numpy.abs(ref_value - values)
+                    term = numpy.where((values != 0) & (difference < window), 1 - difference / window, 0)
+            else:
+                values, codes = self.get_column(feature, method)
+                ref_value = get_feature(ref_item, feature)
+                if not ref_value or ref_value not in codes:
+                    term = numpy.zeros(len(rows), dtype=numpy.float64)
+                else:
+                    term = (values[rows] == codes[ref_value]).astype(numpy.float64)
+            scores = scores + weight * term
+        return scores.tolist()
+
+    def score_python(self, ref_item, media_type, sets, rows):
+        '''score the given rows in plain python, the set features are counted through the posting lists'''
+        terms = []
+        for feature, method, weight in SCORE_TERMS[media_type]:
+            if method in SET_METHODS:
+                counts, sizes = self.count_matches(feature, method, sets[feature])
+                terms.append((feature, method, weight, counts, sizes))
+            else:
+                values, _ = self.get_column(feature, method)
+                terms.append((feature, method, weight, values, None))
+        scores = []
+        for row in rows:
+            similarscore = 0
+            for feature, method, weight, values, sizes in terms:
+                if method == "jaccard":
+                    ref_size = len(sets[feature])
+                    term = 0 if not ref_size else float(values[row]) / (ref_size + sizes[row] - values[row])
+                elif method == "overlap":
+                    term = get_overlap_scores(OVERLAP_SIZES[feature])[values[row]]
+                elif method == "closeness":
+                    term = get_closeness_score(ref_item[feature], values[row], CLOSENESS_WINDOWS[feature])
+                else:
+                    ref_value = get_feature(ref_item, feature)
+                    term = 1 if ref_value and ref_value == values[row] else 0
+                similarscore += weight * term
+            scores.append(similarscore)
+        return scores
+
+
+def get_similar_rows(all_items, ref_items, media_type, limit):
+    '''
+        returns a row of (item, score) with the limit most similar items for every reference item,
+        the items are encoded once and shared by all references
+    '''
+    engine = SimilarityEngine(all_items)
+    rows = []
+    for ref_item in ref_items:
+        # don't rank the reference itself
+        ref_rows = set(row for row, item in enumerate(all_items)
+                       if item["title"] == ref_item["title"] and item["year"] == ref_item["year"])
+        # every row gets its own copies, the items get row specific properties
+        rows.append([(dict(all_items[row]), score) for row, score in engine.top(ref_item, media_type, limit, ref_rows)])
+    return rows
+
+
+def get_score_bound(media_type):
+    '''the highest score of an item sharing no set feature value (and no movie set) with the reference'''
+    # summed in the same order as the scores, so the rounding can't exceed the bound
+    bound = 0
+    for _, method, weight in SCORE_TERMS[media_type]:
+        if method not in SET_METHODS:
+            bound += weight
+    return bound
+
+
+def get_closeness_score(ref_value, value, window):
+    '''"closeness" of two values scaled to 1, 0 if they differ by the window or more'''
+    if ref_value and value and abs(ref_value - value) < window:
+        return 1 - abs(ref_value - value) / window
+    return 0
+
+
+OVERLAP_SCORES = {}
+
+
+def get_overlap_scores(max_size):
+    '''the overlap score for every amount of matching values, normalized by max_size and scaled up nonlinearly'''
+    if max_size not in OVERLAP_SCORES:
+        OVERLAP_SCORES[max_size] = [(float(count) / max_size)**(1./2) for count in range(max_size + 1)]
+    return OVERLAP_SCORES[max_size]
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    similarity_table.py
+    persisted top K most similar items of every movie and tvshow, maintained by the service
+'''
+
+import os
+import json
+from hashlib import md5
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file, log_msg
+from resources.lib.similarity import SimilarityEngine, SCORE_TERMS, OVERLAP_SIZES, CLOSENESS_WINDOWS, \
+    SET_BOOST_TYPES, get_feature
+from resources.lib.library_mirror import get_library_items_by_id
+
+# bump when the file format changes, changes of the score definitions are detected automatically
+TABLE_FORMAT = 1
+# the amount of similar items kept per item, similar widgets with a higher limit are computed live
+TOP_K = 50
+# the rows are spread over this amount of files, the plugin only reads the one it needs
+NUM_BUCKETS = 256
+# above this amount of changed items an update drops the table, the service rebuilds it row by row while idle
+MAX_UPDATE_ITEMS = 50
+ID_FIELDS = {"movies": "movieid", "tvshows": "tvshowid"}
+
+
+def get_table_version(media_type):
+    '''version of the table contents: changes with the format and with the weights and scoring of the items'''
+    definition = [TABLE_FORMAT, TOP_K, NUM_BUCKETS, SCORE_TERMS[media_type], OVERLAP_SIZES, CLOSENESS_WINDOWS,
+                  media_type in SET_BOOST_TYPES]
+    return md5(json.dumps(definition, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_signature(item, media_type):
+    '''checksum of everything the similarity of an item depends on'''
+    features = [get_feature(item, feature) for feature, _, _ in SCORE_TERMS[media_type]]
+    features += [item["title"], item["year"], item.get("setid")]
+    return md5(json.dumps(features, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class SimilarityTable(object):
+    '''the top K similar items (id, score) per item id, stored in bucket files by id'''
+
+    def __init__(self, media_type):
+        '''Initialization'''
+        self.media_type = media_type
+        self.id_field = ID_FIELDS[media_type]
+        self.version = get_table_version(media_type)
+        self.folder = get_profile_path("similar", media_type)
+        self.built = None
+        self.engine = None
+        self.engine_table = None
+
+    def get_filename(self, bucket):
+        '''returns the file of the given bucket'''
+        return os.path.join(self.folder, "%s.json" % bucket)
+
+    def read_bucket(self, bucket):
+        '''returns the rows and signatures stored in a bucket'''
+        return read_json_file(self.get_filename(bucket), {"rows": {}, "signatures": {}})
+
+    def is_current(self):
+        '''checks if the table on disk was built with the current score definitions'''
+        info = read_json_file(os.path.join(self.folder, "version.json"), {})
+        return info.get("version") == self.version
+
+    def reset(self):
+        '''drop the table, it will be rebuilt with the current score definitions'''
+        log_msg("SimilarityTable: resetting %s table" % self.media_type)
+        for bucket in range(NUM_BUCKETS):
+            if os.path.exists(self.get_filename(bucket)):
+                os.remove(self.get_filename(bucket))
+        write_json_file(os.path.join(self.folder, "version.json"), {"version": self.version})
+        self.built = {}
+
+    def lookup(self, item_id):
+        '''returns the [id, score] list of the items most similar to the given item, None if not available'''
+        if not self.is_current():
+            return None
+        return self.read_bucket(item_id % NUM_BUCKETS)["rows"].get(str(item_id))
+
+    def get_built(self):
+        '''returns the signatures of all items which have a row in the table'''
+        if self.built is None:
+            self.built = {}
+            for bucket in range(NUM_BUCKETS):
+                for key, signature in self.read_bucket(bucket)["signatures"].items():
+                    self.built[int(key)] = signature
+        return self.built
+
+    def get_engine(self, table):
+        '''returns the similarity engine for the (mirrored) library table, reused as long as it is not replaced'''
+        if self.engine_table is not table:
+            items = list(table.values())
+            self.engine = SimilarityEngine(items)
+            self.engine.positions = dict((item[self.id_field], row) for row, item in enumerate(items))
+            self.engine.duplicates = {}
+            for row, item in enumerate(items):
+                self.engine.duplicates.setdefault((item["title"], item["year"]), set()).add(row)
+            self.engine_table = table
+        return self.engine
+
+    def compute_row(self, engine, item_id):
+        '''returns the top K [id, score] list of the given item'''
+        ref_item = engine.items[engine.positions[item_id]]
+        # don't rank the item itself (or its duplicates)
+        excluded_rows = engine.duplicates[(ref_item["title"], ref_item["year"])]
+        return [[engine.items[row][self.id_field], score]
+                for row, score in engine.top(ref_item, self.media_type, TOP_K, excluded_rows)]
+
+    def build(self, table, max_rows):
+        '''compute the rows of up to max_rows items which don't have one yet, returns the amount still missing'''
+        built = self.get_built()
+        missing = [item_id for item_id in table if item_id not in built]
+        if not missing:
+            return 0
+        engine = self.get_engine(table)
+        buckets = {}
+        for item_id in missing[:max_rows]:
+            buckets.setdefault(item_id % NUM_BUCKETS, []).append(item_id)
+        for bucket, ids in buckets.items():
+            data = self.read_bucket(bucket)
+            for item_id in ids:
+                data["rows"][str(item_id)] = self.compute_row(engine, item_id)
+                data["signatures"][str(item_id)] = built[item_id] = get_signature(table[item_id], self.media_type)
+            write_json_file(self.get_filename(bucket), data)
+        return max(len(missing) - max_rows, 0)
+
+    def update(self, table, changed_ids, removed_ids):
+        '''
+            update the rows of the table after library items were added, changed or removed.
+            The rows of new items (and all rows of a table which is not built yet) are computed by build.
+        '''
+        built = self.get_built()
+        if not built:
+            return
+        changed = [item_id for item_id in changed_ids if item_id in table and
+                   built.get(item_id) != get_signature(table[item_id], self.media_type)]
+        removed = set(item_id for item_id in removed_ids if item_id in built)
+        removed.update(item_id for item_id in built if item_id not in table)
+        touched = removed.union(changed)
+        if not touched:
+            return
+        if len(touched) > MAX_UPDATE_ITEMS:
+            # e.g. after a scan, scoring all changed items against the library at once is too much work
+            self.reset()
+            return
+        engine = self.get_engine(table)
+        # the scores are symmetric: the scores of a changed item with all others
+        # are the scores of all others with the changed item
+        changed_scores = {}
+        for item_id in changed:
+            ref_item = table[item_id]
+            scores = engine.score(ref_item, self.media_type)
+            for row in engine.duplicates[(ref_item["title"], ref_item["year"])]:
+                scores[row] = 0
+            changed_scores[item_id] = scores
+        for bucket in range(NUM_BUCKETS):
+            data = self.read_bucket(bucket)
+            if not data["rows"]:
+                continue
+            for key in list(data["rows"].keys()):
+                item_id = int(key)
+                if item_id in removed:
+                    del data["rows"][key]
+                    del data["signatures"][key]
+                    built.pop(item_id, None)
+                    continue
+                row = data["rows"][key]
+                kept = [entry for entry in row if entry[0] not in touched]
+                if item_id in changed_scores or len(kept) < len(row):
+                    # the item changed or lost one of its similar items, compute the complete row
+                    data["rows"][key] = self.compute_row(engine, item_id)
+                    data["signatures"][key] = built[item_id] = get_signature(table[item_id], self.media_type)
+                    continue
+                position = engine.positions[item_id]
+                for changed_id, scores in changed_scores.items():
+                    insert_entry(kept, [changed_id, scores[position]])
+                data["rows"][key] = kept
+            write_json_file(self.get_filename(bucket), data)
+        log_msg("SimilarityTable: updated %s table for %s changed and %s removed items"
+                % (self.media_type, len(changed), len(removed)))
+
+
+def insert_entry(row, entry):
+    '''insert an [id, score] entry into a row sorted by score (after the equal scores), capped at TOP_K'''
+    if len(row) >= TOP_K and entry[1] <= row[-1][1]:
+        return
+    position = len(row)
+    while position and row[position - 1][1] < entry[1]:
+        position -= 1
+    row.insert(position, entry)
+    del row[TOP_K:]
+
+
+def get_similar_items(metadatautils, media_type, ref_item, limit, hide_watched=False):
+    '''
+        returns the items most similar to the reference from the similarity table, with their similarscore.
+        Returns None if the table can't answer (not built yet, limit too high or too many watched items).
+    '''
+    row = SimilarityTable(media_type).lookup(ref_item[ID_FIELDS[media_type]])
+    if row is None:
+        return None
+    all_items = []
+    for (item_id, score), item in zip(row, get_library_items_by_id(metadatautils, media_type,
+                                                                   [entry[0] for entry in row])):
+        if not item:
+            # the table is being updated
+            return None
+        if hide_watched and item["playcount"]:
+            continue
+        item["similarscore"] = score
+        all_items.append(item)
+        if len(all_items) == limit:
+            break
+    if len(all_items) < limit and len(row) == TOP_K:
+        # the table doesn't hold enough items for this widget
+        return None
+    return all_items
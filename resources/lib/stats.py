@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    stats.py
+    timings and json-rpc call accounting of a single plugin invocation
+'''
+
+import os
+import time
+import json
+from resources.lib.utils import log_msg, get_profile_path
+
+# the stats file is rotated when it grows beyond this size (bytes), the previous one is kept
+MAX_STATS_SIZE = 256 * 1024
+# the stats of the running plugin invocation, every json-rpc call and mirror query is accounted in them
+ACTIVE_STATS = None
+
+
+class InvocationStats(object):
+    '''collects the time spent in the phases of a widget listing and in the kodi json api'''
+
+    def __init__(self):
+        '''Initialization, the new instance accounts the json-rpc calls from now on'''
+        global ACTIVE_STATS
+        ACTIVE_STATS = self
+        self.start_time = time.time()
+        self.phases = {}
+        self.rpc_count = 0
+        self.rpc_time = 0.0
+        self.rpc_methods = {}
+
+    def add(self, phase, start_time):
+        '''add the time passed since start_time to the given phase'''
+        self.phases[phase] = self.phases.get(phase, 0.0) + time.time() - start_time
+
+    def add_rpc(self, method, start_time):
+        '''account a json-rpc call which started at start_time'''
+        self.rpc_count += 1
+        self.rpc_time += time.time() - start_time
+        self.rpc_methods[method] = self.rpc_methods.get(method, 0) + 1
+
+    def get_record(self, options, cache_state, num_items):
+        '''returns the stats of this invocation as dict, times in milliseconds'''
+        return {
+            "time": int(self.start_time),
+            "mediatype": options.get("mediatype"),
+            "action": options.get("action"),
+            "cache": cache_state,
+            "items": num_items,
+            "total": to_ms(time.time() - self.start_time),
+            "phases": dict((phase, to_ms(value)) for phase, value in self.phases.items()),
+            "rpc": {"count": self.rpc_count, "time": to_ms(self.rpc_time), "methods": self.rpc_methods}
+        }
+
+    def finish(self, options, cache_state, num_items, store=False):
+        '''log the stats of this invocation as one line and optionally add them to the stats file'''
+        record = self.get_record(options, cache_state, num_items)
+        log_msg("Widget stats: %s" % json.dumps(record))
+        if store:
+            append_record(record)
+        return record
+
+
+def to_ms(seconds):
+    '''seconds to rounded milliseconds'''
+    return int(round(seconds * 1000))
+
+
+def timed_rpc(method, func, *args, **kwargs):
+    '''
+        run a json-rpc call or mirror query: func(*args, **kwargs), accounted as method in the stats
+        of the running invocation. All json-rpc calls and mirror queries of the plugin go through here.
+    '''
+    stats = ACTIVE_STATS
+    if not stats:
+        return func(*args, **kwargs)
+    start_time = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats.add_rpc(method, start_time)
+
+
+def instrument_kodidb(kodidb):
+    '''let every json-rpc call of the kodidb instance be accounted in the stats'''
+    get_json = kodidb.get_json
+
+    def timed_get_json(jsonmethod, *args, **kwargs):
+        '''wrapper around kodidb.get_json'''
+        return timed_rpc(jsonmethod, get_json, jsonmethod, *args, **kwargs)
+    kodidb.get_json = timed_get_json
+
+
+def append_record(record):
+    '''append a record to the rolling stats file (one json object per line)'''
+    filename = get_profile_path("stats.jsonl")
+    try:
+        if os.path.exists(filename) and os.path.getsize(filename) > MAX_STATS_SIZE:
+            getattr(os, "replace", os.rename)(filename, get_profile_path("stats.1.jsonl"))
+        with open(filename, "a") as stats_file:
+            stats_file.write(json.dumps(record) + "\n")
+    except (IOError, OSError) as exc:
+        log_msg("Unable to write widget stats - %s" % exc)
+
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    taste_profile.py
+    the weighted features of the watched movies and tvshows, maintained by the service
+    and used by the recommended widgets instead of scoring against every recently watched item
+'''
+
+import time
+import json
+from metadatautils import kodi_constants
+from resources.lib.utils import get_profile_path, read_json_file, write_json_file, log_msg
+from resources.lib.similarity import SCORE_TERMS, OVERLAP_SIZES, CLOSENESS_WINDOWS, SET_BOOST_TYPES, \
+    get_feature, get_closeness_score
+
+# bump when the stored format or the features change, the profile is rebuilt from the watch history
+PROFILE_FORMAT = 2
+# the weight of a watched item halves every this amount of days
+HALF_LIFE_DAYS = 30
+# watching a title again adds this weight, a new title weighs 1
+DUPLICATE_WEIGHT = 0.5
+# feature values and titles whose weight decayed below this are dropped
+MIN_WEIGHT = 0.01
+# the amount of last watched movies and episodes the profile is built from initially
+HISTORY_SIZE = 50
+# the features of the mixed (movie vs tvshow) similarity score of the media widgets
+MIXED_SCORE_TERMS = [("genre", "jaccard", .5), ("cast5", "overlap", .05), ("rating", "closeness", .025),
+                     ("year", "closeness", .05)]
+OTHER_TYPES = {"movies": "tvshows", "tvshows": "movies"}
+
+
+def get_profile_features(media_type):
+    '''the features stored for the watched items of the given type: its own score terms and the mixed ones'''
+    features = []
+    for feature, method, _ in SCORE_TERMS[media_type] + MIXED_SCORE_TERMS:
+        if (feature, method) not in features:
+            features.append((feature, method))
+    return features
+
+
+def get_values(item, feature, method):
+    '''returns the values of a feature of an item as (string) profile keys, empty values don't count'''
+    value = get_feature(item, feature)
+    if method in ["jaccard", "overlap"]:
+        return list(set(value))
+    if not value:
+        return []
+    if isinstance(value, tuple):
+        return [json.dumps(list(value))]
+    return ["%s" % value]
+
+
+def parse_lastplayed(lastplayed):
+    '''kodi lastplayed date to timestamp, None if not played'''
+    try:
+        return time.mktime(time.strptime(lastplayed, "%Y-%m-%d %H:%M:%S"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TasteProfile(object):
+    '''
+        per item type the summed weight of all watched items and per feature value the summed weight of the
+        watched items having it. All weights decay with the same half life, so only the weights of new items
+        need to be scaled and the stored sums are only rescaled when an item is added.
+        The summed weight per watched title tells which titles are watched again, until it decayed away.
+    '''
+
+    def __init__(self, data=None):
+        '''Initialization'''
+        self.filename = get_profile_path("taste_profile.json")
+        self.data = data or {"format": PROFILE_FORMAT, "updated": 0, "titles": {}, "types": {}}
+        self.closeness_cache = {}
+        self.genre_cache = {}
+
+    @classmethod
+    def load(cls):
+        '''returns the stored profile, None if it was not built (with the current format) yet'''
+        data = read_json_file(get_profile_path("taste_profile.json"))
+        if not data or data.get("format") != PROFILE_FORMAT:
+            return None
+        return cls(data)
+
+    def save(self):
+        '''store the profile'''
+        write_json_file(self.filename, self.data)
+
+    def get_weight(self, media_type):
+        '''the summed (decayed) weight of the watched items of the given type'''
+        return self.data["types"].get(media_type, {}).get("weight", 0)
+
+    def add(self, item, media_type, timestamp=None):
+        '''add a watched movie or tvshow (the show of a watched episode) to the profile'''
+        timestamp = timestamp or time.time()
+        if timestamp > self.data["updated"]:
+            # age the stored weights to the time of the new item
+            self.scale(get_decay(timestamp - self.data["updated"]) if self.data["updated"] else 1)
+            self.data["updated"] = timestamp
+            weight = 1.0
+        else:
+            # an older item (from the watch history) is aged to the time of the profile
+            weight = get_decay(self.data["updated"] - timestamp)
+        title = item["title"]
+        if self.data["titles"].get(title):
+            weight *= DUPLICATE_WEIGHT
+        self.data["titles"][title] = self.data["titles"].get(title, 0) + weight
+        profile = self.data["types"].setdefault(media_type, {"weight": 0, "sizes": {}, "features": {}})
+        profile["weight"] += weight
+        for feature, method in get_profile_features(media_type):
+            values = get_values(item, feature, method)
+            profile["sizes"][feature] = profile["sizes"].get(feature, 0) + weight * len(values)
+            feature_weights = profile["features"].setdefault(feature, {})
+            for value in values:
+                feature_weights[value] = feature_weights.get(value, 0) + weight
+        if media_type in SET_BOOST_TYPES and item.get("setid"):
+            set_weights = profile["features"].setdefault("setid", {})
+            set_weights["%s" % item["setid"]] = set_weights.get("%s" % item["setid"], 0) + weight
+        self.closeness_cache = {}
+        self.genre_cache = {}
+
+    def scale(self, factor):
+        '''multiply all weights by factor, dropping the values and titles which became irrelevant'''
+        self.data["titles"] = dict((title, weight * factor) for title, weight in self.data["titles"].items()
+                                   if weight * factor >= MIN_WEIGHT)
+        for profile in self.data["types"].values():
+            profile["weight"] *= factor
+            for feature in profile["sizes"]:
+                profile["sizes"][feature] *= factor
+            for feature, feature_weights in profile["features"].items():
+                profile["features"][feature] = dict((value, weight * factor)
+                                                    for value, weight in feature_weights.items()
+                                                    if weight * factor >= MIN_WEIGHT)
+
+    def score(self, item, media_type, mixed=False, convert_genres=None):
+        '''
+            the expected similarity score of the item with the watched items of its type, averaged by weight.
+            With mixed the watched items of the other type are included with the mixed similarity score,
+            for which the tvshow genres are converted to their movie equivalents with convert_genres.
+        '''
+        total_weight = self.get_weight(media_type)
+        similarscore = total_weight * self.score_terms(item, media_type, media_type, SCORE_TERMS[media_type])
+        if mixed:
+            other_type = OTHER_TYPES[media_type]
+            other_weight = self.get_weight(other_type)
+            if other_weight:
+                similarscore += other_weight * self.score_terms(item, other_type, media_type, MIXED_SCORE_TERMS,
+                                                                convert_genres)
+                total_weight += other_weight
+        return similarscore / total_weight if total_weight else 0
+
+    def score_terms(self, item, profile_type, media_type, terms, convert_genres=None):
+        '''
+            the expected score of the item with a watched item of profile_type, for the given score terms.
+            With convert_genres the genres of the tvshow side are converted (the item or the watched items).
+        '''
+        profile = self.data["types"].get(profile_type)
+        if not profile or not profile["weight"]:
+            return 0
+        total_weight = profile["weight"]
+        similarscore = 0
+        for feature, method, weight in terms:
+            feature_weights = profile["features"].get(feature, {})
+            if method in ["jaccard", "overlap"]:
+                values = set(get_feature(item, feature))
+                if convert_genres and feature == "genre":
+                    if media_type == "tvshows":
+                        values = convert_genres(values)
+                    else:
+                        feature_weights = self.get_converted_genres(profile_type, convert_genres)
+                # the expected amount of matching values
+                matches = sum(feature_weights.get(value, 0) for value in values) / total_weight
+                if method == "jaccard":
+                    ref_size = profile["sizes"].get(feature, 0) / total_weight
+                    union = ref_size + len(values) - matches
+                    term = matches / union if union > 0 else 0
+                else:
+                    term = (min(matches, OVERLAP_SIZES[feature]) / OVERLAP_SIZES[feature])**(1./2)
+            elif method == "closeness":
+                term = self.get_closeness(profile_type, feature, item[feature]) / total_weight
+            else:
+                values = get_values(item, feature, method)
+                term = feature_weights.get(values[0], 0) / total_weight if values else 0
+            similarscore += weight * term
+        if media_type in SET_BOOST_TYPES and profile_type == media_type and item.get("setid"):
+            # the watched items in the same set get the square root of their score
+            in_set = profile["features"].get("setid", {}).get("%s" % item["setid"], 0) / total_weight
+            similarscore = (1 - in_set) * similarscore + in_set * similarscore**(1./2)
+        return similarscore
+
+    def get_converted_genres(self, profile_type, convert_genres):
+        '''the genre weights of the watched items of profile_type with the genres converted'''
+        if profile_type not in self.genre_cache:
+            profile = self.data["types"][profile_type]
+            converted = {}
+            for genre, weight in profile["features"].get("genre", {}).items():
+                for value in convert_genres([genre]):
+                    converted[value] = min(converted.get(value, 0) + weight, profile["weight"])
+            self.genre_cache[profile_type] = converted
+        return self.genre_cache[profile_type]
+
+    def get_closeness(self, profile_type, feature, value):
+        '''the weighted sum of the closeness of the watched values of a feature to the value'''
+        key = (profile_type, feature, value)
+        if key not in self.closeness_cache:
+            closeness = 0
+            for ref_value, weight in self.data["types"][profile_type]["features"].get(feature, {}).items():
+                closeness += weight * get_closeness_score(float(ref_value), value, CLOSENESS_WINDOWS[feature])
+            self.closeness_cache[key] = closeness
+        return self.closeness_cache[key]
+
+
+def get_decay(seconds):
+    '''the factor a weight decays by in the given amount of seconds'''
+    return 0.5 ** (seconds / (HALF_LIFE_DAYS * 86400.0))
+
+
+def build_profile(metadatautils, get_tvshow):
+    '''build the profile from the last watched movies and the shows of the last watched episodes'''
+    profile = TasteProfile()
+    events = []
+    for item in metadatautils.kodidb.movies(sort=kodi_constants.SORT_LASTPLAYED,
+                                            filters=[kodi_constants.FILTER_WATCHED], limits=(0, HISTORY_SIZE)):
+        events.append((parse_lastplayed(item.get("lastplayed")), "movies", item))
+    for episode in metadatautils.kodidb.episodes(sort=kodi_constants.SORT_LASTPLAYED,
+                                                 filters=[kodi_constants.FILTER_WATCHED], limits=(0, HISTORY_SIZE)):
+        tvshow = get_tvshow(episode["tvshowid"])
+        if tvshow:
+            events.append((parse_lastplayed(episode.get("lastplayed")), "tvshows", tvshow))
+    # the oldest first, so the duplicate rule applies to the repeated watches
+    for timestamp, media_type, item in sorted((event for event in events if event[0]), key=lambda x: x[0]):
+        profile.add(item, media_type, timestamp)
+    profile.save()
+    log_msg("TasteProfile: built from %s watched items" % len(events))
+    return profile
@@ -11,7 +11,7 @@ from operator import itemgetter
 import random
 import xbmc
 from metadatautils import kodi_constants
-from resources.lib.utils import create_main_entry, KODI_VERSION, log_msg
+from resources.lib.utils import create_main_entry, log_msg
 
 class Tvshows(object):
     '''all tvshow widgets provided by the script'''
@@ -21,6 +21,8 @@ class Tvshows(object):
         self.metadatautils = metadatautils
         self.addon = addon
         self.options = options
+        # tvshows looked up by id during this invocation
+        self.tvshows_by_id = {}
 
     def listing(self):
         '''main listing with all our tvshow nodes'''
@@ -46,6 +48,7 @@ class Tvshows(object):
         if not tag:
             all_items += [
                 (self.addon.getLocalizedString(32014), "similar&mediatype=tvshows", icon),
+                (self.addon.getLocalizedString(32125), "cowatched&mediatype=tvshows", icon),
                 (self.addon.getLocalizedString(32077), "forgenre&mediatype=tvshows", icon),
                 (xbmc.getLocalizedString(10134), "favourites&mediatype=tvshows", icon),
                 (self.addon.getLocalizedString(32078), "playlistslisting&mediatype=tvshows", icon),
@@ -145,26 +148,27 @@ class Tvshows(object):
 
     def toprated(self):
         """ get recommended tvshows - library tvshows with score higher than 7"""
+        from resources.lib.library_mirror import get_library_items
         filters = [kodi_constants.FILTER_RATING]
         if self.options["hide_watched"]:
             filters.append(kodi_constants.FILTER_UNWATCHED)
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        tvshows = self.metadatautils.kodidb.tvshows(
-            sort=kodi_constants.SORT_RATING, filters=filters, limits=(
-                0, self.options["limit"]))
+        tvshows = get_library_items(self.metadatautils, "tvshows", kodi_constants.SORT_RATING, filters,
+                                    (0, self.options["limit"]))
         return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
 
     def recommended(self):
         ''' get recommended tvshows - library tvshows with score higher than 7
         or if using experimental settings - similar with all recently watched '''
+        from resources.lib.library_mirror import get_library_items
         if self.options["exp_recommended"]:
             # get list of all unwatched movies (optionally filtered by tag)
             filters = [kodi_constants.FILTER_UNWATCHED]
             if self.options.get("tag"):
                 filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
             all_items = self.metadatautils.kodidb.tvshows(filters=filters, filtertype='and')
-            all_items = self.sort_by_recommended(all_items)
+            all_items = self.sort_by_recommended(all_items, use_profile=True)
             # return processed show
             return self.metadatautils.process_method_on_list(self.process_tvshow, all_items)
         else:
@@ -173,21 +177,20 @@ class Tvshows(object):
                 filters.append(kodi_constants.FILTER_UNWATCHED)
             if self.options.get("tag"):
                 filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-            tvshows = self.metadatautils.kodidb.tvshows(
-                sort=kodi_constants.SORT_RATING, filters=filters, limits=(
-                    0, self.options["limit"]))
+            tvshows = get_library_items(self.metadatautils, "tvshows", kodi_constants.SORT_RATING, filters,
+                                        (0, self.options["limit"]))
             return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
 
     def recent(self):
         ''' get recently added tvshows '''
+        from resources.lib.library_mirror import get_library_items
         filters = []
         if self.options["hide_watched"]:
             filters.append(kodi_constants.FILTER_UNWATCHED)
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        tvshows = self.metadatautils.kodidb.tvshows(
-            sort=kodi_constants.SORT_DATEADDED, filters=filters, limits=(
-                0, self.options["limit"]))
+        tvshows = get_library_items(self.metadatautils, "tvshows", kodi_constants.SORT_DATEADDED, filters,
+                                    (0, self.options["limit"]))
         return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
 
     def random(self):
@@ -202,16 +205,17 @@ class Tvshows(object):
 
     def inprogress(self):
         ''' get in progress tvshows '''
+        from resources.lib.library_mirror import get_library_items
         filters = [kodi_constants.FILTER_INPROGRESS]
         if self.options.get("tag"):
             filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        tvshows = self.metadatautils.kodidb.tvshows(
-            sort=kodi_constants.SORT_LASTPLAYED, filters=filters, limits=(
-                0, self.options["limit"]))
+        tvshows = get_library_items(self.metadatautils, "tvshows", kodi_constants.SORT_LASTPLAYED, filters,
+                                    (0, self.options["limit"]))
         return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
 
     def similar(self):
         ''' get similar shows for given imdbid, or from a recently watched title if no imdbid'''
+        from resources.lib.similarity_table import get_similar_items
         imdb_id = self.options.get("imdbid", "")
         ref_show = None
         if imdb_id:
@@ -227,32 +231,103 @@ class Tvshows(object):
             hide_watched = False
         if not ref_show:
             return None
-        # define ref_show sets for speed
-        set_genres = set(ref_show["genre"])
-        set_cast = set([x["name"] for x in ref_show["cast"][:10]])
-        sets = (set_genres, set_cast)
+        # use the similarity table maintained by the service if it can answer
+        tvshows = get_similar_items(self.metadatautils, "tvshows", ref_show, self.options["limit"], hide_watched)
+        if tvshows is None:
+            tvshows = self.get_similar_tvshows(ref_show, hide_watched)
+        for item in tvshows:
+            item["extraproperties"] = {"similartitle": ref_show["title"], "originalpath": item["file"]}
+        # return processed show
+        return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
+
+    def cowatched(self):
+        '''get the shows most watched together with the show of the given imdbid, or with a recently watched one'''
+        from resources.lib.cowatch import get_cowatched_items, get_key
+        imdb_id = self.options.get("imdbid", "")
+        ref_show = None
+        if imdb_id:
+            ref_show = self.metadatautils.kodidb.tvshow_by_imdbid(imdb_id)
+        if not ref_show:
+            # pick the show of a random recently watched episode (for homescreen widget)
+            ref_show = self.get_recently_watched_tvshow()
+        if not ref_show:
+            return None
+        tvshows = get_cowatched_items(self.metadatautils, get_key("tvshow", ref_show["tvshowid"]), ["tvshow"],
+                                      self.options["limit"])
+        for item in tvshows:
+            item["extraproperties"] = {"similartitle": ref_show["title"], "originalpath": item["file"]}
+        return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
+
+    def becauseyouwatched(self):
+        '''
+            the reference shows of several "because you watched" rows: the shows of the imdbids param or else
+            the last watched shows. The similar shows of all references are computed in one pass and cached for
+            the similar widget of every row (action=similar&imdbid=[IMDBID], with limit=rowlimit and the same reload)
+        '''
+        from resources.lib.similarity import get_similar_rows
+        from resources.lib.main import cache_listing
+        if self.options.get("imdbids"):
+            ref_shows = [self.metadatautils.kodidb.tvshow_by_imdbid(imdb_id)
+                         for imdb_id in self.options["imdbids"].split(",")[:self.options["limit"]]]
+            ref_shows = [item for item in ref_shows if item]
+        else:
+            ref_shows = self.metadatautils.kodidb.tvshows(sort=kodi_constants.SORT_LASTPLAYED,
+                                                          limits=(0, self.options["limit"]))
+            ref_shows = [item for item in ref_shows if item.get("lastplayed")]
+        ref_shows = [item for item in ref_shows if item.get("imdbnumber")]
+        if not ref_shows:
+            return []
+        row_limit = int(self.options.get("rowlimit") or self.addon.getSetting("default_limit"))
+        all_items = self.metadatautils.kodidb.tvshows()
+        for ref_show, row in zip(ref_shows, get_similar_rows(all_items, ref_shows, "tvshows", row_limit)):
+            tvshows = []
+            for item, similarscore in row:
+                item["similarscore"] = similarscore
+                item["extraproperties"] = {"similartitle": ref_show["title"], "originalpath": item["file"]}
+                tvshows.append(item)
+            tvshows = self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
+            paramstring = "?action=similar&mediatype=tvshows&imdbid=%s&limit=%s&reload=%s" % \
+                (ref_show["imdbnumber"], row_limit, self.options.get("reload", ""))
+            cache_listing(self.addon, self.metadatautils, paramstring, tvshows)
+        return self.metadatautils.process_method_on_list(self.process_tvshow, ref_shows)
+
+    def get_similar_tvshows(self, ref_show, hide_watched):
+        '''score all shows against the reference show, returns the best scoring shows capped by limit'''
+        from resources.lib.similarity import SimilarityEngine
+        from resources.lib.minhash_index import get_approximate_similar
         # create list of all items
         if hide_watched:
             filters = [kodi_constants.FILTER_UNWATCHED]
             all_items = self.metadatautils.kodidb.tvshows(filters=filters)
         else:
             all_items = self.metadatautils.kodidb.tvshows()
-        # get similarity score for all shows
-        for item in all_items:
-            if item["title"] == ref_show["title"] and item["year"] == ref_show["year"]:
-                # don't rank the reference show
-                similarscore = 0
-            else:
-                similarscore = self.get_similarity_score(ref_show, item, sets=sets)
+        # don't rank the reference show
+        ref_rows = set(row for row, item in enumerate(all_items)
+                       if item["title"] == ref_show["title"] and item["year"] == ref_show["year"])
+        # get the shows with the highest similarity score, capped by limit
+        tvshows = []
+        ranked = None
+        if self.options.get("approximate_similarity"):
+            # very large libraries: only score the items sharing an LSH bucket with the reference
+            ranked = get_approximate_similar(all_items, ref_show, "tvshows", self.options["limit"], ref_rows)
+        if ranked is None:
+            ranked = SimilarityEngine(all_items).top(ref_show, "tvshows", self.options["limit"], ref_rows)
+        for row, similarscore in ranked:
+            item = all_items[row]
             item["similarscore"] = similarscore
-            item["extraproperties"] = {"similartitle": ref_show["title"], "originalpath": item["file"]}
-        # sort list by score and cap by limit
-        tvshows = sorted(all_items, key=itemgetter("similarscore"), reverse=True)[:self.options["limit"]]
-        # return processed show
-        return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
+            tvshows.append(item)
+        return tvshows
 
     def nextshows(self):
         """ get next episodes """
+        from resources.lib.nextup import NextUpState
+        state = NextUpState.load()
+        if state and not self.options.get("tag") and not self.options.get("path"):
+            # the last played shows with a next episode, from the records the service keeps
+            tvshow_ids = state.get_show_ids(self.options["limit"], self.options["next_inprogress_only"])
+            tvshows_by_id = self.get_tvshows_by_id(tvshow_ids)
+            tvshows = [tvshows_by_id[tvshow_id] for tvshow_id in tvshow_ids]
+            return self.metadatautils.process_method_on_list(self.process_tvshow, [x for x in tvshows if x])
         filters = [kodi_constants.FILTER_UNWATCHED]
         if self.options["next_inprogress_only"]:
             filters = [kodi_constants.FILTER_INPROGRESS]
@@ -288,36 +363,21 @@ class Tvshows(object):
 
     def top250(self):
         ''' get imdb top250 tvshows in library '''
-        all_items = []
-        filters = []
+        from resources.lib.library_mirror import get_library_items_by_id
+        from resources.lib.imdb_index import get_top250_matches, get_raw_ids
+        matches = get_top250_matches(self.metadatautils, "tvshows")
         if self.options.get("tag"):
-            filters.append({"operator": "contains", "field": "tag", "value": self.options["tag"]})
-        fields = ["imdbnumber"]
-        if KODI_VERSION > 16:
-            fields.append("uniqueid")
-        all_tvshows = self.metadatautils.kodidb.get_json(
-            'VideoLibrary.GetTvShows', fields=fields, returntype="tvshows", filters=filters)
-        top_250 = self.metadatautils.imdb.get_top250_db()
-        for tvshow in all_tvshows:
-            # grab imdbid
-            imdbnumber = tvshow["imdbnumber"]
-            if not imdbnumber and "uniqueid" in tvshow:
-                for value in tvshow["uniqueid"]:
-                    if value.startswith("tt"):
-                        imdbnumber = value
-            if imdbnumber and not imdbnumber.startswith("tt"):
-                # we have a tvdb id
-                tvdb_info = self.metadatautils.thetvdb.get_series(imdbnumber)
-                if tvdb_info:
-                    imdbnumber = tvdb_info["imdbnumber"]
-                else:
-                    imdbnumber = None
-            if imdbnumber and imdbnumber in top_250:
-                tvshow_full = self.metadatautils.kodidb.tvshow(tvshow["tvshowid"])
-                tvshow_full["top250_rank"] = int(top_250[imdbnumber])
-                all_items.append(tvshow_full)
-        tvshows = sorted(all_items, key=itemgetter("top250_rank"))[:self.options["limit"]]
-        return self.metadatautils.process_method_on_list(self.process_tvshow, tvshows)
+            filters = [{"operator": "contains", "field": "tag", "value": self.options["tag"]}]
+            tag_ids = get_raw_ids(self.metadatautils, "tvshows", filters)
+            matches = [match for match in matches if match[0] in tag_ids]
+        matches = matches[:self.options["limit"]]
+        all_items = []
+        for (_, rank), tvshow in zip(matches, get_library_items_by_id(self.metadatautils, "tvshows",
+                                                                     [match[0] for match in matches])):
+            if tvshow:
+                tvshow["top250_rank"] = rank
+                all_items.append(tvshow)
+        return self.metadatautils.process_method_on_list(self.process_tvshow, all_items)
 
     def browsegenres(self):
         '''
@@ -390,12 +450,15 @@ class Tvshows(object):
     def get_extended_matches(self, extended_items):
         """gets tv shows that are in the given extended info list of items"""
         all_items = []
+        positions = {}
+        for position, titleandyear in enumerate(extended_items):
+            positions.setdefault(titleandyear, position)
         all_tvshows = self.metadatautils.kodidb.tvshows()
         for tvshow in all_tvshows:
             # extendedinfo does not supply imdb id for tvshow, try match on title and year basis
             tvshow_titleandyear = (tvshow['title'], tvshow['year'])
-            if tvshow_titleandyear in extended_items:
-                tvshow["extendedindex"] = extended_items.index(tvshow_titleandyear)
+            if tvshow_titleandyear in positions:
+                tvshow["extendedindex"] = positions[tvshow_titleandyear]
                 all_items.append(tvshow)
         return sorted(all_items, key=itemgetter("extendedindex"))
 
@@ -427,11 +490,9 @@ class Tvshows(object):
         episodes = self.metadatautils.kodidb.episodes(sort=kodi_constants.SORT_LASTPLAYED,
                                                       filters=[kodi_constants.FILTER_WATCHED],
                                                       limits=(0, num_recent_similar))
-        if episodes:
-            show_title = random.choice(episodes)['showtitle']
-            title_filter = [{"field": "title", "operator": "is", "value": "%s" % show_title}]
-            tvshow = self.metadatautils.kodidb.tvshows(filters=title_filter, limits=(0, 1))
-            return tvshow[0]
+        tvshows = self.get_tvshows_from_episodes(episodes)
+        if tvshows:
+            return random.choice(tvshows)
         return None
 
     def get_genre_tvshows(self, genre, hide_watched=False, limit=100, sort=kodi_constants.SORT_RANDOM):
@@ -462,16 +523,38 @@ class Tvshows(object):
 
     def get_tvshows_from_episodes(self, episodes):
         ''' gets associated tvshows from episodes (includes duplicates) '''
-        tvshows = []
-        for episode in episodes:
-            show_title = episode['showtitle']
-            title_filter = [{"field": "title", "operator": "is", "value": show_title}]
-            tvshow = self.metadatautils.kodidb.tvshows(filters=title_filter, limits=(0, 1))[0]
-            tvshows.append(tvshow)
-        return tvshows
+        tvshows = self.get_tvshows_by_id(set(episode["tvshowid"] for episode in episodes))
+        return [dict(tvshows[episode["tvshowid"]]) for episode in episodes if tvshows.get(episode["tvshowid"])]
 
-    def sort_by_recommended(self, all_items, ref_shows=None):
+    def get_tvshows_by_id(self, tvshow_ids):
+        '''
+            returns the tvshows with the given ids (None if not found) by tvshowid, memoized for this invocation.
+            The shows are looked up in the service's library mirror or else with one fetch of all shows.
+        '''
+        from resources.lib.library_mirror import query_mirror
+        missing = [tvshow_id for tvshow_id in tvshow_ids if tvshow_id not in self.tvshows_by_id]
+        if missing:
+            all_items = query_mirror("tvshows", ids=missing)
+            if all_items is None:
+                all_items = self.metadatautils.kodidb.tvshows()
+            for item in all_items:
+                if item:
+                    self.tvshows_by_id[item["tvshowid"]] = item
+            for tvshow_id in missing:
+                self.tvshows_by_id.setdefault(tvshow_id, None)
+        return self.tvshows_by_id
+
+    def sort_by_recommended(self, all_items, ref_shows=None, use_profile=False):
         ''' sort list of tvshows by recommended score'''
+        from resources.lib.similarity import SimilarityEngine
+        from resources.lib.taste_profile import TasteProfile
+        if not ref_shows and use_profile:
+            # score against the taste profile the service keeps of the watched items, if available
+            profile = TasteProfile.load()
+            if profile and profile.get_weight("tvshows"):
+                for item in all_items:
+                    item["recommendedscore"] = profile.score(item, "tvshows") / (1+item["playcount"])
+                return sorted(all_items, key=itemgetter("recommendedscore"), reverse=True)[:self.options["limit"]]
         # use recent items if ref_items not given
         if not ref_shows:
             # get recently watched episodes
@@ -506,20 +589,9 @@ class Tvshows(object):
             weights = dict()
             for item in ref_shows:
                 weights[item['title']] = 1
-        # predefine feature sets
-        ref_sets = dict()
-        for ref_show in ref_shows:
-            title = ref_show['title']
-            set_genres = set(ref_show["genre"])
-            set_cast = set([x["name"] for x in ref_show["cast"][:10]])
-            ref_sets[title] = (set_genres, set_cast)
         # average scores together for every item
-        for item in all_items:
-            similarscore = 0
-            for ref_show in ref_shows:
-                title = ref_show['title']
-                similarscore += weights[title] * self.get_similarity_score(
-                    ref_show, item, sets=ref_sets[title])
+        scores = SimilarityEngine(all_items).score_many(ref_shows, "tvshows", weights)
+        for item, similarscore in zip(all_items, scores):
             item["recommendedscore"] = similarscore / (1+item["playcount"]) / len(ref_shows)
         # return sorted list capped by limit
         return sorted(all_items, key=itemgetter("recommendedscore"), reverse=True)[:self.options["limit"]]
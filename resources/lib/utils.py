@@ -12,23 +12,31 @@ if sys.version_info.major == 3:
     import urllib.parse as urlparse
 else:
     import urlparse
+import traceback
 from traceback import format_exc
+import json
+import threading
 import xbmc
 import xbmcaddon
+import xbmcvfs
 
 ADDON_ID = "script.skin.helper.widgets"
 KODI_VERSION = int(xbmc.getInfoLabel("System.BuildVersion").split(".")[0])
+# addon name and version for the log lines, looked up on first use
+ADDON_LOG_PREFIX = ""
 
 
 def log_msg(msg, loglevel=xbmc.LOGDEBUG):
     ''' log message with addon name and version to kodi log '''
+    global ADDON_LOG_PREFIX
     if sys.version_info.major < 3:
         if isinstance(msg, unicode):
            msg = msg.encode('utf-8')
-    addon = xbmcaddon.Addon(id=ADDON_ID)
-    addon_name = addon.getAddonInfo('name')
-    addon_ver = addon.getAddonInfo('version')
-    xbmc.log("{0} v{1} --> {2}".format(addon_name, addon_ver, msg), level=loglevel)
+    if not ADDON_LOG_PREFIX:
+        addon = xbmcaddon.Addon(id=ADDON_ID)
+        ADDON_LOG_PREFIX = "{0} v{1}".format(addon.getAddonInfo('name'), addon.getAddonInfo('version'))
+        del addon
+    xbmc.log("{0} --> {1}".format(ADDON_LOG_PREFIX, msg), level=loglevel)
 
 
 def log_exception(modulename, exceptiondetails):
@@ -59,6 +67,46 @@ def create_main_entry(item):
     }
 
 
+def get_profile_path(*subpaths):
+    '''helper to get (and create) a folder or file path inside the addon's profile folder'''
+    profile = "special://profile/addon_data/%s/" % ADDON_ID
+    if hasattr(xbmcvfs, "translatePath"):
+        profile = xbmcvfs.translatePath(profile)
+    else:
+        profile = xbmc.translatePath(profile).decode("utf-8")
+    filepath = os.path.join(profile, *subpaths)
+    folder = filepath if not os.path.splitext(filepath)[1] else os.path.dirname(filepath)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # another process may have created it in the meantime
+            pass
+    return filepath
+
+
+def read_json_file(filepath, default=None):
+    '''helper to read a json file from disk, returns default if missing or unreadable'''
+    try:
+        with open(filepath) as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json_file(filepath, data):
+    '''helper to (atomically) write a json file to disk, the temporary file is unique per process and thread'''
+    tmp_file = "%s.%s.%s.tmp" % (filepath, os.getpid(), threading.current_thread().ident)
+    with open(tmp_file, "w") as json_file:
+        json.dump(data, json_file)
+    if hasattr(os, "replace"):
+        os.replace(tmp_file, filepath)
+    else:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        os.rename(tmp_file, filepath)
+
+
 def urlencode(text):
     '''helper to urlencode a (unicode) string'''
     if sys.version_info.major < 3:
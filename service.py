@@ -6,32 +6,62 @@
     Main service entry point
 '''
 
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "resources", "lib"))
 from resources.lib.utils import log_msg, ADDON_ID
 from resources.lib.kodi_monitor import KodiMonitor
+from resources.lib.prewarm import WidgetPrewarmer
+from resources.lib.scheduler import Scheduler
+from resources.lib.library_mirror import LibraryMirror, MirrorServer
+from resources.lib.registry import PREDICATE_AIRDATE, PREDICATE_PVR
+from resources.lib.pvr import Pvr
+from resources.lib.episodes import Episodes
+from resources.lib.airing_schedule import ScheduleRefresher
 import xbmc
 import xbmcgui
 import xbmcaddon
 import time
 
-TASK_INTERVAL = 520
 WIN = xbmcgui.Window(10000)
 ADDON = xbmcaddon.Addon(ADDON_ID)
-MONITOR = KodiMonitor(win=WIN, addon=ADDON)
-log_msg('Backgroundservice started', xbmc.LOGINFO)
-
-# keep the kodi monitor alive which processes database updates to refresh widgets
-while not MONITOR.abortRequested():
+# set generic widget reload, from now on the widgets use the reload tokens for the cache
+WIN.setProperty("widgetreload2", time.strftime("%Y%m%d%H%M%S", time.gmtime()))
+MIRROR = LibraryMirror()
+MIRROR_SERVER = MirrorServer(MIRROR)
+MIRROR_SERVER.start()
+PREWARMER = WidgetPrewarmer(WIN, xbmc.Monitor(), MIRROR)
+PREWARMER.start()
+SCHEDULER = Scheduler()
+SCHEDULER.start()
+# the airing widgets read the schedule this worker keeps, they are refreshed when it changed
+AIRING_REFRESHER = ScheduleRefresher(lambda: MONITOR.refresh_widget_types(["episodes", "tvshows"],
+                                                                          [PREDICATE_AIRDATE]))
+MONITOR = KodiMonitor(win=WIN, addon=ADDON, prewarmer=PREWARMER, scheduler=SCHEDULER,
+                      airing_refresher=AIRING_REFRESHER)
+AIRING_REFRESHER.start()
 
-    # set generic widget reload
-    if TASK_INTERVAL >= 300:
-        WIN.setProperty("widgetreload2", time.strftime("%Y%m%d%H%M%S", time.gmtime()))
-        TASK_INTERVAL = 0
-    else:
-        TASK_INTERVAL += 10
+# the widget types which change over time register their own refresh deadlines
+MONITOR.schedule_refresh("pvr", Pvr.get_next_refresh, ["pvr"], [PREDICATE_PVR])
+MONITOR.schedule_refresh("airing", Episodes.get_next_refresh, ["episodes", "tvshows"], [PREDICATE_AIRDATE])
+MONITOR.schedule_random_rotation()
+log_msg('Backgroundservice started', xbmc.LOGINFO)
 
-    # sleep for 10 seconds
-    MONITOR.waitForAbort(10)
+# the kodi monitor and the scheduler process all events, just wait for kodi to exit
+MONITOR.waitForAbort()
 
+AIRING_REFRESHER.stop()
+AIRING_REFRESHER.join(1)
+SCHEDULER.stop()
+SCHEDULER.join(1)
+PREWARMER.stop()
+PREWARMER.join(5)
+MIRROR_SERVER.stop()
+del MIRROR_SERVER
+del MIRROR
+del PREWARMER
+del SCHEDULER
+del AIRING_REFRESHER
 del MONITOR
 del WIN
 del ADDON
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/conftest.py
+    minimal stand-ins for the kodi modules and metadatautils, so the pure logic of the addon can be tested
+    outside kodi: python -m pytest tests
+'''
+
+import os
+import sys
+import time
+import types
+import random
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the window properties of Window(10000) and the addon settings, shared by all instances
+PROPERTIES = {}
+SETTINGS = {}
+PROFILE = {"path": ""}
+# the values of the generated library items, few enough to share some
+GENRES = ["Action", "Comedy", "Drama", "Horror", "Thriller", "Romance", "Sci-Fi", "Documentary"]
+PEOPLE = ["person%s" % count for count in range(60)]
+STUDIOS = ["studio%s" % count for count in range(6)]
+
+
+class Monitor(object):
+    '''xbmc.Monitor'''
+
+    def __init__(self):
+        pass
+
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=None):
+        time.sleep(timeout or 0)
+        return False
+
+
+class Window(object):
+    '''xbmcgui.Window'''
+
+    def __init__(self, window_id=0):
+        pass
+
+    def getProperty(self, key):
+        return PROPERTIES.get(key, "")
+
+    def setProperty(self, key, value):
+        PROPERTIES[key] = value
+
+    def clearProperty(self, key):
+        PROPERTIES.pop(key, None)
+
+
+class ListItem(object):
+    '''xbmcgui.ListItem, keeps what is set on it'''
+
+    def __init__(self, label="", label2="", path="", offscreen=False):
+        self.label = label
+        self.path = path
+        self.properties = {}
+        self.info = {}
+        self.art = {}
+        self.contextmenu = []
+        self.streams = []
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def setInfo(self, type=None, infoLabels=None):
+        self.info = infoLabels
+
+    def setArt(self, art):
+        self.art.update(art)
+
+    def addStreamInfo(self, stream_type, values):
+        self.streams.append((stream_type, values))
+
+    def addContextMenuItems(self, items):
+        self.contextmenu += items
+
+
+class Addon(object):
+    '''xbmcaddon.Addon, the settings come from SETTINGS'''
+
+    def __init__(self, id=None):
+        pass
+
+    def getAddonInfo(self, key):
+        return key
+
+    def getSetting(self, key):
+        return SETTINGS.get(key, "")
+
+
+class SimpleCache(object):
+    '''simplecache.SimpleCache in memory'''
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, checksum=None):
+        value = self.data.get(key)
+        if value and (checksum is None or value[1] == checksum):
+            return value[0]
+        return None
+
+    def set(self, key, value, checksum="", expiration=None):
+        self.data[key] = (value, checksum)
+
+    def close(self):
+        pass
+
+
+class KodiConstants(object):
+    '''metadatautils.kodi_constants, every constant is a distinct placeholder'''
+
+    def __getattr__(self, name):
+        return {"constant": name}
+
+
+class MetadataUtils(object):
+    '''metadatautils.MetadataUtils, the tests pass their own kodidb'''
+
+    def close(self):
+        pass
+
+
+def install_module(name, **attributes):
+    '''add a stand-in module to sys.modules'''
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+install_module("xbmc", LOGDEBUG=0, LOGINFO=1, LOGWARNING=2, LOGERROR=3, Monitor=Monitor,
+               getInfoLabel=lambda label: "19.0", log=lambda msg, level=0: None,
+               getCondVisibility=lambda condition: False, getLocalizedString=lambda string_id: "%s" % string_id,
+               skinHasImage=lambda image: False, executeJSONRPC=lambda request: "{}",
+               translatePath=lambda path: PROFILE["path"])
+install_module("xbmcgui", Window=Window, ListItem=ListItem)
+install_module("xbmcaddon", Addon=Addon)
+install_module("xbmcvfs", translatePath=lambda path: PROFILE["path"], exists=os.path.exists)
+install_module("xbmcplugin", SORT_METHOD_UNSORTED=0, setContent=lambda *args: None,
+               addSortMethod=lambda *args: None, addDirectoryItems=lambda *args: None,
+               endOfDirectory=lambda *args, **kwargs: None)
+install_module("simplecache", SimpleCache=SimpleCache)
+install_module("metadatautils", MetadataUtils=MetadataUtils, kodi_constants=KodiConstants())
+
+
+def generate_items(media_type, size, seed=1):
+    '''a reproducible random library of movies or tvshows with the fields the scoring uses'''
+    rand = random.Random(seed)
+    id_field = "movieid" if media_type == "movies" else "tvshowid"
+    items = []
+    for count in range(1, size + 1):
+        item = {
+            id_field: count,
+            "title": "title%s" % count,
+            "year": rand.randint(1990, 2020),
+            "rating": round(rand.uniform(1, 10), 1),
+            "mpaa": rand.choice(["", "PG", "R"]),
+            "genre": rand.sample(GENRES, rand.randint(0, 3)),
+            "director": rand.sample(PEOPLE, rand.randint(0, 2)),
+            "writer": rand.sample(PEOPLE, rand.randint(0, 2)),
+            "cast": [{"name": name} for name in rand.sample(PEOPLE, rand.randint(0, 12))],
+            "studio": rand.sample(STUDIOS, rand.randint(0, 1)),
+            "setid": rand.choice([0] * 8 + [1, 2]),
+            "playcount": rand.randint(0, 1),
+            "lastplayed": "",
+            "dateadded": "2020-01-01 00:00:00"
+        }
+        if media_type == "movies":
+            item["uniqueid"] = {"imdb": "tt%07d" % count}
+        items.append(item)
+    return items
+
+
+@pytest.fixture(autouse=True)
+def kodi(tmp_path):
+    '''every test gets an empty profile folder, no window properties and the default settings'''
+    PROFILE["path"] = str(tmp_path) + os.sep
+    PROPERTIES.clear()
+    SETTINGS.clear()
+    yield
+    PROPERTIES.clear()
+    SETTINGS.clear()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_airing_schedule.py
+    the airing schedule of the library shows the service keeps for the unaired, nextaired and airingtoday widgets
+'''
+
+import threading
+from resources.lib import airing_schedule
+from resources.lib.airing_schedule import AiringSchedule, ScheduleRefresher, refresh_schedule, get_today, \
+    get_date, RETRY_INTERVAL, TTL_RETURNING, TTL_UNKNOWN, TTL_ENDED
+
+
+class FakeProvider(object):
+    '''the upcoming episodes of the tests, remembers the lookups'''
+
+    def __init__(self, schedules):
+        self.schedules = schedules
+        self.lookups = []
+        self.thread = threading.current_thread()
+        self.closed = False
+
+    def get_episodes(self, tvshow_id):
+        assert threading.current_thread() is self.thread
+        self.lookups.append(tvshow_id)
+        if self.schedules.get(tvshow_id) == "error":
+            raise ValueError("lookup failed")
+        return self.schedules.get(tvshow_id)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProviders(object):
+    '''creates the providers of the lookup workers, remembers them'''
+
+    def __init__(self, schedules):
+        self.schedules = schedules
+        self.providers = []
+
+    def __call__(self):
+        provider = FakeProvider(self.schedules)
+        self.providers.append(provider)
+        return provider
+
+    @property
+    def lookups(self):
+        return [tvshow_id for provider in self.providers for tvshow_id in provider.lookups]
+
+
+class FakeKodiDb(object):
+    '''the library shows'''
+
+    def __init__(self, tvshows):
+        self.items = tvshows
+
+    def tvshows(self):
+        return self.items
+
+
+class FakeMetadataUtils(object):
+    '''just a kodidb'''
+
+    def __init__(self, tvshows=None):
+        self.kodidb = FakeKodiDb(tvshows or get_tvshows())
+
+    def close(self):
+        pass
+
+
+def get_episode(tvshow_id, days_ahead, airtime="20:00"):
+    '''an upcoming episode'''
+    return {"tvshowid": tvshow_id, "airdate": get_date(days_ahead), "airtime": airtime,
+            "title": "%s-%s" % (tvshow_id, days_ahead)}
+
+
+def get_tvshows():
+    '''a returning show, a show without upcoming episodes, an ended show and a show whose lookup fails'''
+    return [{"tvshowid": 1, "status": "Continuing"}, {"tvshowid": 2, "status": ""},
+            {"tvshowid": 3, "status": "Ended"}, {"tvshowid": 4, "status": ""}]
+
+
+def get_providers():
+    '''the schedules of the shows of get_tvshows'''
+    return FakeProviders({1: [get_episode(1, 30), get_episode(1, 0, "21:00"), get_episode(1, -1)],
+                         2: [], 3: None, 4: "error"})
+
+
+def test_refresh_schedule(monkeypatch):
+    monkeypatch.setattr(airing_schedule.time, "time", lambda: 1000)
+    providers = get_providers()
+    schedule, fetched = refresh_schedule(FakeMetadataUtils(), providers)
+    assert fetched == 4
+    assert sorted(providers.lookups) == [1, 2, 3, 4]
+    assert dict((key, show["expires"]) for key, show in schedule.data["shows"].items()) == {
+        "1": 1000 + TTL_RETURNING, "2": 1000 + TTL_UNKNOWN, "3": 1000 + TTL_ENDED, "4": 1000 + RETRY_INTERVAL}
+    assert schedule.get_next_expiry() == 1000 + RETRY_INTERVAL
+    # only the due shows are fetched again, the removed shows are dropped
+    monkeypatch.setattr(airing_schedule.time, "time", lambda: 1000 + RETRY_INTERVAL)
+    providers = get_providers()
+    schedule, fetched = refresh_schedule(FakeMetadataUtils(get_tvshows()[:2] + get_tvshows()[3:]), providers)
+    assert providers.lookups == [4]
+    assert sorted(schedule.data["shows"]) == ["1", "2", "4"]
+
+
+def test_episodes_by_airdate():
+    refresh_schedule(FakeMetadataUtils(), get_providers())
+    schedule = AiringSchedule.load()
+    assert [item["title"] for item in schedule.get_episodes([1, 2, 9], 60)] == ["1-0", "1-30"]
+    assert [item["title"] for item in schedule.get_episodes([1], 10)] == ["1-0"]
+    assert [item["title"] for item in schedule.get_episodes([1], 60, single_episode_per_show=True)] == ["1-0"]
+    assert [item["title"] for item in schedule.get_airing_today([1, 2])] == ["1-0"]
+    assert schedule.data["dates"][get_today()] == [["1", 1]]
+
+
+def test_refresher_uses_the_given_provider(monkeypatch):
+    monkeypatch.setattr(airing_schedule, "MetadataUtils", FakeMetadataUtils)
+    updated = threading.Event()
+    refresher = ScheduleRefresher(updated.set, get_providers())
+    refresher.start()
+    try:
+        assert updated.wait(5)
+    finally:
+        refresher.stop()
+        refresher.join(5)
+    assert not refresher.is_alive()
+    assert sorted(refresher.get_provider.lookups) == [1, 2, 3, 4]
+    assert AiringSchedule.load().get_episodes([1], 60)
+
+
+def test_every_worker_has_its_own_provider():
+    providers = get_providers()
+    results = airing_schedule.fetch_schedules(providers, [1, 2, 3, 4, 5, 6])
+    assert sorted(results) == [1, 2, 3, 5, 6]
+    assert len(providers.providers) == airing_schedule.MAX_WORKERS
+    assert len(set(provider.thread for provider in providers.providers)) == airing_schedule.MAX_WORKERS
+    assert all(provider.closed for provider in providers.providers)
+    assert len(airing_schedule.fetch_schedules(get_providers(), [1])) == 1
+
+
+def test_schedule_is_only_saved_if_shows_were_due(monkeypatch):
+    monkeypatch.setattr(airing_schedule.time, "time", lambda: 1000)
+    refresh_schedule(FakeMetadataUtils(), get_providers())
+    saved = []
+    monkeypatch.setattr(AiringSchedule, "save", lambda self: saved.append(self))
+    providers = get_providers()
+    schedule, fetched = refresh_schedule(FakeMetadataUtils(), providers)
+    assert (fetched, providers.lookups, saved) == (0, [], [])
+    assert not providers.providers
+    monkeypatch.setattr(airing_schedule.time, "time", lambda: 1000 + RETRY_INTERVAL)
+    schedule, fetched = refresh_schedule(FakeMetadataUtils(), get_providers())
+    assert fetched == 1 and saved == [schedule]
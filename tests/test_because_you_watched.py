@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_because_you_watched.py
+    the rows of the because you watched action are the listings of the similar widgets
+'''
+
+import xbmcaddon
+import xbmcgui
+from simplecache import SimpleCache
+from conftest import SETTINGS, generate_items
+from resources.lib import main
+from resources.lib.movies import Movies
+from resources.lib.registry import WidgetRegistry
+from resources.lib.similarity import SimilarityEngine, get_similar_rows
+
+
+class FakeKodiDb(object):
+    '''the movies of the library, the first three are the last watched'''
+
+    def __init__(self, items):
+        self.items = items
+
+    def movies(self, sort=None, filters=None, limits=None):
+        items = [dict(item) for item in self.items]
+        if limits:
+            items = items[limits[0]:limits[1]]
+        return items
+
+    def movie_by_imdbid(self, imdb_id):
+        return next((dict(item) for item in self.items if item["imdbnumber"] == imdb_id), None)
+
+    @staticmethod
+    def prepare_listitem(item):
+        return dict(item)
+
+
+class FakeMetadataUtils(object):
+    '''a kodidb and a cache'''
+
+    def __init__(self, items):
+        self.kodidb = FakeKodiDb(items)
+        self.cache = SimpleCache()
+
+    @staticmethod
+    def process_method_on_list(method, items):
+        return [method(item) for item in items]
+
+
+def get_library():
+    '''movies with the fields of the listings'''
+    items = generate_items("movies", 150, seed=5)
+    for item in items:
+        item["imdbnumber"] = item["uniqueid"]["imdb"]
+        item["file"] = "videodb://movies/titles/%s" % item["movieid"]
+    return items
+
+
+def test_similar_rows_exclude_the_reference():
+    items = get_library()
+    items.append(dict(items[0], movieid=999))
+    rows = get_similar_rows(items, items[:3], "movies", 10)
+    assert len(rows) == 3
+    engine = SimilarityEngine(items)
+    for ref_item, row in zip(items[:3], rows):
+        assert len(row) == 10
+        assert ref_item["title"] not in [item["title"] for item, _ in row]
+        scores = engine.score(ref_item, "movies")
+        for item, score in row:
+            assert score == scores[items.index(item)]
+
+
+def test_rows_are_cached_for_the_similar_widgets():
+    SETTINGS.update({"num_recent_similar": "1", "default_limit": "10"})
+    addon = xbmcaddon.Addon()
+    win = xbmcgui.Window(10000)
+    metadatautils = FakeMetadataUtils(get_library())
+    options = main.get_options("?action=becauseyouwatched&mediatype=movies&limit=3&rowlimit=8&reload=token",
+                               addon, win)
+    ref_movies = Movies(addon, metadatautils, options).becauseyouwatched()
+    assert [item["movieid"] for item in ref_movies] == [1, 2, 3]
+    for ref_movie in ref_movies:
+        paramstring = "?action=similar&mediatype=movies&imdbid=%s&limit=8&reload=token" % ref_movie["imdbnumber"]
+        options = main.get_options(paramstring, addon, win)
+        cache_str = main.get_cache_str(options)
+        cached = metadatautils.cache.get(cache_str, checksum="token")
+        expected = Movies(addon, metadatautils, options).similar()
+        assert [item["movieid"] for item in cached] == [item["movieid"] for item in expected]
+        assert cached[0]["extraproperties"]["similartitle"] == ref_movie["title"]
+        assert WidgetRegistry().get(cache_str)["checksum"] == "token"
+
+
+def test_imdbids_param():
+    SETTINGS.update({"num_recent_similar": "1", "default_limit": "10"})
+    metadatautils = FakeMetadataUtils(get_library())
+    options = main.get_options("?action=becauseyouwatched&mediatype=movies&limit=2&imdbids=tt0000007,tt9999999",
+                               xbmcaddon.Addon(), xbmcgui.Window(10000))
+    ref_movies = Movies(xbmcaddon.Addon(), metadatautils, options).becauseyouwatched()
+    assert [item["movieid"] for item in ref_movies] == [7]
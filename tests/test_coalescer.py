@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_coalescer.py
+    bursts of library notifications are published as one refresh
+'''
+
+import json
+from resources.lib import kodi_monitor
+from resources.lib.kodi_monitor import KodiMonitor, NotificationCoalescer, SETTLE_TIME, MAX_LATENCY
+from resources.lib.registry import create_change
+
+
+class FakeClock(object):
+    '''replaces time.time of the kodi_monitor module'''
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeScheduler(object):
+    '''remembers the last deadline of every job'''
+
+    def __init__(self):
+        self.jobs = {}
+
+    def schedule(self, name, deadline, func):
+        self.jobs[name] = (deadline, func)
+
+    def cancel(self, name):
+        self.jobs.pop(name, None)
+
+
+def get_coalescer(monkeypatch):
+    '''a coalescer on a fake clock and scheduler, returns it with its clock and published refreshes'''
+    clock = FakeClock()
+    monkeypatch.setattr(kodi_monitor.time, "time", clock.time)
+    published = []
+    coalescer = NotificationCoalescer(lambda change, properties: published.append((change, properties)),
+                                      FakeScheduler())
+    return coalescer, clock, published
+
+
+def test_burst_is_published_once(monkeypatch):
+    coalescer, clock, published = get_coalescer(monkeypatch)
+    coalescer.add(create_change(["movies"], "movie", 1, []), ["widgetreload-movies"])
+    clock.now += 1
+    coalescer.add(create_change(["episodes"], "episode", 2, []), ["widgetreload-episodes"])
+    deadline, flush = coalescer.scheduler.jobs["coalescer"]
+    assert deadline == clock.now + SETTLE_TIME
+    # not settled yet: the job asks to run again at the due time
+    assert flush() == deadline
+    assert not published
+    clock.now = deadline
+    assert flush() is None
+    assert len(published) == 1
+    change, properties = published[0]
+    assert change["items"] == {"movie": set([1]), "episode": set([2])}
+    assert set(properties) == set(["widgetreload-movies", "widgetreload-episodes"])
+    # nothing pending anymore
+    assert flush() is None
+    assert len(published) == 1
+
+
+def test_long_burst_is_published_after_max_latency(monkeypatch):
+    coalescer, clock, published = get_coalescer(monkeypatch)
+    first = clock.now
+    for item_id in range(20):
+        coalescer.add(create_change(["movies"], "movie", item_id + 1, []), ["widgetreload"])
+        clock.now += 1
+    deadline, flush = coalescer.scheduler.jobs["coalescer"]
+    assert deadline == first + MAX_LATENCY
+    flush()
+    assert len(published) == 1
+    assert len(published[0][0]["items"]["movie"]) == 20
+
+
+def test_notifications_are_coalesced(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(kodi_monitor.time, "time", clock.time)
+    published = []
+    monitor = KodiMonitor(scheduler=FakeScheduler())
+    monitor.publish_changes = lambda change, properties: published.append((change, properties))
+    monitor.coalescer.callback = monitor.publish_changes
+    for item_id in [1, 2]:
+        monitor.onNotification("xbmc", "VideoLibrary.OnUpdate",
+                               json.dumps({"item": {"type": "movie", "id": item_id}, "playcount": 1}))
+    # not a library notification
+    monitor.onNotification("xbmc", "Player.OnPlay", "{}")
+    clock.now += SETTLE_TIME
+    monitor.scheduler.jobs["coalescer"][1]()
+    assert len(published) == 1
+    change, properties = published[0]
+    assert change["items"] == {"movie": set([1, 2])}
+    assert change["widget_types"] == set(["movies", "media"])
+    assert "widgetreload-movies" in properties
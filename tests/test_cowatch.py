@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_cowatch.py
+    the co-watch model of the cowatched widgets
+'''
+
+import pytest
+import xbmcaddon
+import xbmcgui
+from conftest import SETTINGS
+from resources.lib import cowatch
+from resources.lib import main
+from resources.lib.movies import Movies
+from resources.lib.cowatch import CoWatchModel, build_model, get_cowatched_items, get_key, WINDOW_SIZE
+
+DAY = 86400
+
+
+def get_model(*keys):
+    '''a model of the given keys, watched a minute apart'''
+    model = CoWatchModel()
+    model.reset()
+    for count, key in enumerate(keys):
+        model.add(key, 1000 + 60 * count)
+    return model
+
+
+def test_pairs_are_weighted_by_distance():
+    model = get_model("movie:1", "movie:2", "tvshow:3")
+    assert model.lookup("tvshow:3") == [("movie:2", 1.0), ("movie:1", .5)]
+    assert model.lookup("movie:1") == [("movie:2", 1.0), ("tvshow:3", .5)]
+    assert model.lookup("movie:9") == []
+
+
+def test_episodes_of_the_same_show_count_once():
+    model = get_model("tvshow:1", "tvshow:1", "tvshow:1", "movie:2")
+    assert model.lookup("movie:2") == [("tvshow:1", 1.0)]
+    # watching an item again moves it to the end of the window
+    model = get_model("movie:1", "movie:2", "movie:1", "movie:3")
+    assert model.lookup("movie:3") == [("movie:1", 1.0), ("movie:2", .5)]
+
+
+def test_window_and_gap():
+    model = get_model(*["movie:%s" % count for count in range(WINDOW_SIZE + 2)])
+    row = model.lookup("movie:%s" % (WINDOW_SIZE + 1))
+    # only the items in the window before it
+    assert [key for key, _ in row] == ["movie:%s" % count for count in range(WINDOW_SIZE, 0, -1)]
+    assert [weight for _, weight in row] == pytest.approx([1.0 / distance for distance in range(1, WINDOW_SIZE + 1)])
+    model.add("movie:99", 1000 + 8 * DAY)
+    assert model.lookup("movie:99") == []
+
+
+def test_rows_are_capped(monkeypatch):
+    monkeypatch.setattr(cowatch, "MAX_NEIGHBORS", 2)
+    model = get_model("movie:1", "movie:2", "movie:3", "movie:4")
+    assert model.lookup("movie:4") == [("movie:3", 1.0), ("movie:2", .5)]
+
+
+def test_model_is_stored():
+    model = get_model("movie:1", "movie:2")
+    model.save()
+    assert CoWatchModel().is_current()
+    assert CoWatchModel().lookup("movie:2") == [("movie:1", 1.0)]
+    assert CoWatchModel().get_info()["recent"] == [[1000, "movie:1"], [1060, "movie:2"]]
+
+
+def test_build_from_the_watch_history():
+    class FakeKodiDb(object):
+        '''two watched movies and an episode watched in between'''
+
+        def movies(self, **kwargs):
+            return [{"movieid": 1, "lastplayed": "2020-01-01 12:00:00"},
+                    {"movieid": 2, "lastplayed": "2020-01-01 10:00:00"}, {"movieid": 3, "lastplayed": ""}]
+
+        def episodes(self, **kwargs):
+            return [{"tvshowid": 7, "lastplayed": "2020-01-01 11:00:00"}]
+
+    class FakeMetadataUtils(object):
+        '''just a kodidb'''
+        kodidb = FakeKodiDb()
+    build_model(FakeMetadataUtils())
+    assert CoWatchModel().lookup(get_key("movie", 1)) == [("tvshow:7", 1.0), ("movie:2", .5)]
+
+
+def test_cowatched_items(monkeypatch):
+    library = {"movies": {1: {"movieid": 1, "playcount": 0}, 2: {"movieid": 2, "playcount": 1}},
+               "tvshows": {3: {"tvshowid": 3, "playcount": 0}}}
+    monkeypatch.setattr(cowatch, "get_library_items_by_id",
+                        lambda metadatautils, media_type, ids: [library[media_type].get(item_id) for item_id in ids])
+    assert get_cowatched_items(None, "movie:9", ["movie"], 5) == []
+    get_model("movie:1", "movie:2", "tvshow:3", "movie:4", "movie:9").save()
+    items = get_cowatched_items(None, "movie:9", ["movie", "tvshow"], 5)
+    # movie 4 was removed from the library
+    assert [(item.get("movieid"), item.get("tvshowid")) for item in items] == [(None, 3), (2, None), (1, None)]
+    assert items[0]["cowatchscore"] == pytest.approx(.5)
+    assert len(get_cowatched_items(None, "movie:9", ["movie", "tvshow"], 1)) == 1
+
+
+def test_widget_with_the_default_settings(monkeypatch):
+    SETTINGS.update({"hide_watched_similar": "true", "num_recent_similar": "8"})
+    library = dict((movieid, {"movieid": movieid, "title": "movie %s" % movieid, "playcount": 1,
+                              "file": "videodb://movies/titles/%s" % movieid}) for movieid in range(1, 4))
+
+    class FakeKodiDb(object):
+        '''the last watched movie'''
+
+        def movies(self, **kwargs):
+            return [dict(library[3])]
+
+    class FakeMetadataUtils(object):
+        '''just a kodidb'''
+        kodidb = FakeKodiDb()
+    monkeypatch.setattr(cowatch, "get_library_items_by_id",
+                        lambda metadatautils, media_type, ids: [dict(library[item_id]) for item_id in ids])
+    get_model("movie:1", "movie:2", "movie:3").save()
+    options = main.get_options("?action=cowatched&mediatype=movies&limit=5", xbmcaddon.Addon(),
+                               xbmcgui.Window(10000))
+    all_items = Movies(xbmcaddon.Addon(), FakeMetadataUtils(), options).cowatched()
+    # all co-watched movies are watched
+    assert [item["movieid"] for item in all_items] == [2, 1]
+    assert all_items[0]["extraproperties"]["similartitle"] == "movie 3"
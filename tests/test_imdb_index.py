@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_imdb_index.py
+    the imdb id index of the library and the top250 matches computed from it
+'''
+
+import xbmcgui
+from resources.lib import imdb_index
+from resources.lib.imdb_index import ImdbIndex, get_raw_id, get_imdb_lookup, get_matches, get_top250_matches
+
+
+class FakeKodiDb(object):
+    '''the movies and tvshows with their ids, counts the queries'''
+
+    def __init__(self):
+        self.items = {"movies": [{"movieid": 1, "imdbnumber": "tt0000001"},
+                                 {"movieid": 2, "imdbnumber": "", "uniqueid": {"tmdb": "99", "imdb": "tt0000002"}},
+                                 {"movieid": 3, "imdbnumber": ""}],
+                      "tvshows": [{"tvshowid": 1, "imdbnumber": "70001"}]}
+        self.queries = 0
+
+    def get_json(self, method, fields=None, returntype=None, filters=None):
+        self.queries += 1
+        return [dict(item) for item in self.items[returntype]]
+
+
+class FakeTvdb(object):
+    '''resolves the tvdb ids, counts the lookups'''
+
+    def __init__(self):
+        self.lookups = 0
+
+    def get_series(self, tvdb_id):
+        self.lookups += 1
+        return {"imdbnumber": "tt7%s" % tvdb_id}
+
+
+class FakeImdb(object):
+    '''the imdb top250: imdb id -> rank'''
+
+    def __init__(self):
+        self.top250 = {"tt0000002": 3, "tt0000001": 10, "tt0000404": 1}
+
+    def get_top250_db(self):
+        return self.top250
+
+
+class FakeMetadataUtils(object):
+    '''the kodidb, thetvdb and imdb modules'''
+
+    def __init__(self):
+        self.kodidb = FakeKodiDb()
+        self.thetvdb = FakeTvdb()
+        self.imdb = FakeImdb()
+
+
+def test_raw_id():
+    assert get_raw_id({"imdbnumber": "tt1"}) == "tt1"
+    assert get_raw_id({"imdbnumber": "123", "uniqueid": {"tvdb": "123", "imdb": "tt2"}}) == "tt2"
+    assert get_raw_id({"imdbnumber": "123", "uniqueid": {"tvdb": "123"}}) == "123"
+    assert get_raw_id({}) == ""
+
+
+def test_reconcile():
+    metadatautils = FakeMetadataUtils()
+    index = ImdbIndex()
+    assert index.reconcile(metadatautils, "movies")
+    assert index.reconcile(metadatautils, "tvshows")
+    assert index.get_lookup("movies") == {"tt0000001": 1, "tt0000002": 2}
+    assert index.get_lookup("tvshows") == {"tt770001": 1}
+    # nothing changed, the tvdb ids are not looked up again
+    assert not index.reconcile(metadatautils, "tvshows")
+    assert metadatautils.thetvdb.lookups == 1
+    del metadatautils.kodidb.items["movies"][0]
+    assert index.reconcile(metadatautils, "movies")
+    assert index.get_lookup("movies") == {"tt0000002": 2}
+
+
+def test_update(monkeypatch):
+    monkeypatch.setattr(imdb_index, "get_item_details", lambda media_type, ids: [
+        {"movieid": 1, "imdbnumber": "tt0000011"} if item_id == 1 else None for item_id in ids])
+    metadatautils = FakeMetadataUtils()
+    index = ImdbIndex()
+    index.reconcile(metadatautils, "movies")
+    assert index.update(metadatautils, "movies", [1, 2], [])
+    assert index.get_lookup("movies") == {"tt0000011": 1}
+    assert not index.update(metadatautils, "movies", [1], [5])
+
+
+def test_index_is_only_used_while_the_service_keeps_it():
+    win = xbmcgui.Window(10000)
+    assert ImdbIndex.load() is None
+    index = ImdbIndex()
+    index.reconcile(FakeMetadataUtils(), "movies")
+    index.save(win, True)
+    version = index.data["version"]
+    assert ImdbIndex.load().get_lookup("movies") == {"tt0000001": 1, "tt0000002": 2}
+    # the service continues from the stored index, the version only changes with the imdb ids
+    index = ImdbIndex()
+    index.save(win, False)
+    assert index.data["version"] == version
+    win.clearProperty(imdb_index.INDEX_PROPERTY)
+    assert ImdbIndex.load() is None
+
+
+def test_lookup_without_index():
+    metadatautils = FakeMetadataUtils()
+    assert get_imdb_lookup(metadatautils, "movies") == ({"tt0000001": 1, "tt0000002": 2}, None)
+
+
+def test_matches():
+    assert get_matches({"tt1": 5, "tt2": 6}, ["tt3", "tt2", "tt1", "tt2"]) == [[6, 1], [5, 2]]
+
+
+def test_top250_matches_are_stored_with_the_versions(monkeypatch):
+    win = xbmcgui.Window(10000)
+    metadatautils = FakeMetadataUtils()
+    # without an index they are computed every time
+    assert get_top250_matches(metadatautils, "movies") == [[2, 3], [1, 10]]
+    assert get_top250_matches(metadatautils, "movies") == [[2, 3], [1, 10]]
+    assert metadatautils.kodidb.queries == 2
+    index = ImdbIndex()
+    index.reconcile(metadatautils, "movies")
+    index.save(win, True)
+    assert get_top250_matches(metadatautils, "movies") == [[2, 3], [1, 10]]
+    # neither the index nor the top250 changed: the stored matches
+    monkeypatch.setattr(imdb_index, "get_imdb_lookup", lambda metadatautils, media_type: ({}, index.data["version"]))
+    assert get_top250_matches(metadatautils, "movies") == [[2, 3], [1, 10]]
+    # the top250 changed
+    metadatautils.imdb.top250 = {"tt0000001": 1}
+    assert get_top250_matches(metadatautils, "movies") == []
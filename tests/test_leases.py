@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_leases.py
+    the locks which let only one plugin process compute a listing
+'''
+
+import os
+import time
+import threading
+from resources.lib.leases import Lease, acquire_slot
+
+
+def test_only_one_holder():
+    first, second = Lease("listing"), Lease("listing")
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
+    assert not os.path.exists(first.filename)
+
+
+def test_expired_leases_are_taken_over():
+    crashed = Lease("listing")
+    assert crashed.acquire()
+    expired = time.time() - 120
+    os.utime(crashed.filename, (expired, expired))
+    other = Lease("listing")
+    assert other.acquire()
+    # the crashed process doesn't remove the new lease
+    other.release()
+    assert Lease("listing").acquire()
+
+
+def test_wait_for_the_release():
+    holder = Lease("listing")
+    assert holder.acquire()
+    timer = threading.Timer(0.2, holder.release)
+    timer.start()
+    assert Lease("listing").wait(timeout=5)
+    timer.join()
+
+
+def test_wait_times_out():
+    holder = Lease("listing")
+    assert holder.acquire()
+    assert not Lease("listing").wait(timeout=0.2)
+    holder.release()
+
+
+def test_slots_cap_the_holders():
+    first = acquire_slot("expensive", 2)
+    second = acquire_slot("expensive", 2)
+    assert first and second
+    assert acquire_slot("expensive", 2, timeout=0.2) is None
+    first.release()
+    third = acquire_slot("expensive", 2, timeout=0.2)
+    assert third
+    second.release()
+    third.release()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_library_mirror.py
+    the queries the library mirror answers for the plugin and its updates from library changes
+'''
+
+import os
+import pytest
+from resources.lib import library_mirror
+from resources.lib.library_mirror import LibraryMirror, MirrorServer, UnsupportedQuery, match_rule, \
+    is_inprogress, query_mirror, MAX_DELTA_ROWS
+from resources.lib.registry import create_change
+
+
+def get_movie(movieid, **fields):
+    '''a mirrored movie'''
+    movie = {"movieid": movieid, "title": "movie %s" % movieid, "playcount": 0, "rating": 5.0, "year": 2000,
+             "genre": ["Drama"], "tag": [], "dateadded": "2020-01-%02d" % movieid, "lastplayed": "",
+             "resume": {"position": 0, "total": 0}}
+    movie.update(fields)
+    return movie
+
+
+def get_tvshow(tvshowid, watchedepisodes, episode):
+    '''a mirrored tvshow'''
+    return {"tvshowid": tvshowid, "title": "show %s" % tvshowid, "watchedepisodes": watchedepisodes,
+            "episode": episode, "playcount": 0, "genre": [], "tag": [], "dateadded": "", "lastplayed": ""}
+
+
+class FakeKodiDb(object):
+    '''the library of the tests, counts the calls for a single item'''
+
+    def __init__(self, movies=(), tvshows=(), episodes=()):
+        self.items = {"movies": list(movies), "tvshows": list(tvshows), "episodes": list(episodes)}
+        self.item_calls = 0
+
+    def get_item(self, media_type, item_id):
+        self.item_calls += 1
+        id_field = library_mirror.MIRROR_TYPES[media_type]
+        return next((item for item in self.items[media_type] if item[id_field] == item_id), None)
+
+    def movies(self):
+        return self.items["movies"]
+
+    def tvshows(self):
+        return self.items["tvshows"]
+
+    def episodes(self):
+        return self.items["episodes"]
+
+    def movie(self, movieid):
+        return self.get_item("movies", movieid)
+
+    def tvshow(self, tvshowid):
+        return self.get_item("tvshows", tvshowid)
+
+    def episode(self, episodeid):
+        return self.get_item("episodes", episodeid)
+
+    def get_json(self, method, fields=None, returntype=None):
+        return [dict(item) for item in self.items[returntype]]
+
+
+class FakeMetadataUtils(object):
+    '''just a kodidb'''
+
+    def __init__(self, **items):
+        self.kodidb = FakeKodiDb(**items)
+
+
+def get_mirror(**items):
+    '''a mirror loaded with the given movies and tvshows'''
+    mirror = LibraryMirror()
+    mirror.load(FakeMetadataUtils(**items), ["movies", "tvshows"])
+    return mirror
+
+
+def test_sort_and_limits():
+    mirror = get_mirror(movies=[get_movie(movieid) for movieid in range(1, 6)])
+    result = mirror.query("movies", {"method": "dateadded", "order": "descending"}, limits=(1, 3))
+    assert [item["movieid"] for item in result] == [4, 3]
+    result = mirror.query("movies", {"method": "dateadded", "order": "ascending"}, limits=(0, 2))
+    assert [item["movieid"] for item in result] == [1, 2]
+
+
+def test_filters():
+    mirror = get_mirror(movies=[get_movie(1, genre=["Drama", "Comedy"], playcount=1),
+                                get_movie(2, genre=["Comedy"], rating=8.0),
+                                get_movie(3, genre=["Horror"], resume={"position": 10, "total": 100})])
+    assert [item["movieid"] for item in mirror.query("movies", filters=[
+        {"operator": "is", "field": "genre", "value": "comedy"}])] in ([1, 2], [2, 1])
+    assert [item["movieid"] for item in mirror.query("movies", filters=[
+        {"operator": "is", "field": "genre", "value": "Comedy"},
+        {"operator": "is", "field": "playcount", "value": "0"}])] == [2]
+    assert [item["movieid"] for item in mirror.query("movies", filters=[
+        {"operator": "greaterthan", "field": "rating", "value": "7"}])] == [2]
+    assert [item["movieid"] for item in mirror.query("movies", filters=[
+        {"operator": "true", "field": "inprogress", "value": ""}])] == [3]
+
+
+def test_unsupported_queries():
+    mirror = get_mirror(movies=[get_movie(1)])
+    with pytest.raises(UnsupportedQuery):
+        mirror.query("movies", filters=[{"operator": "startswith", "field": "title", "value": "m"}])
+    with pytest.raises(UnsupportedQuery):
+        mirror.query("movies", {"method": "random"})
+    with pytest.raises(UnsupportedQuery):
+        mirror.query("albums")
+
+
+def test_inprogress_of_tvshows():
+    assert is_inprogress(get_tvshow(1, 2, 10))
+    assert not is_inprogress(get_tvshow(2, 0, 10))
+    assert not is_inprogress(get_tvshow(3, 10, 10))
+    assert is_inprogress({"title": "no progress fields"}) is None
+    mirror = get_mirror(tvshows=[get_tvshow(1, 2, 10), get_tvshow(2, 0, 10), get_tvshow(3, 10, 10)])
+    assert [item["tvshowid"] for item in mirror.query("tvshows", filters=[
+        {"operator": "true", "field": "inprogress", "value": ""}])] == [1]
+    assert sorted(item["tvshowid"] for item in mirror.query("tvshows", filters=[
+        {"operator": "false", "field": "inprogress", "value": ""}])) == [2, 3]
+
+
+def test_match_rule_needs_the_field():
+    with pytest.raises(UnsupportedQuery):
+        match_rule({"title": "x"}, {"operator": "true", "field": "inprogress", "value": ""})
+    with pytest.raises(UnsupportedQuery):
+        match_rule({"title": "x"}, {"operator": "is", "field": "tag", "value": "x"})
+    assert match_rule({"tag": ["Favorite Films"]}, {"operator": "contains", "field": "tag", "value": "fav"})
+    assert match_rule({"year": 1999}, {"operator": "lessthan", "field": "year", "value": "2000"})
+
+
+def test_get_items_by_id():
+    mirror = get_mirror(movies=[get_movie(1), get_movie(2)])
+    assert [item and item["movieid"] for item in mirror.get_items("movies", [2, 9, 1])] == [2, None, 1]
+
+
+def test_query_over_the_socket(monkeypatch, tmp_path):
+    socket_path = str(tmp_path / "mirror.sock")
+    monkeypatch.setattr(library_mirror, "get_socket_path", lambda: socket_path)
+    server = MirrorServer(get_mirror(movies=[get_movie(1), get_movie(2)]))
+    server.start()
+    try:
+        for _ in range(100):
+            if server.server:
+                break
+            server.join(0.01)
+        result = query_mirror("movies", {"method": "dateadded", "order": "descending"})
+        assert [item["movieid"] for item in result] == [2, 1]
+        assert [item["movieid"] for item in query_mirror("movies", ids=[1])] == [1]
+        # the plugin falls back to kodi when the mirror can't answer
+        assert query_mirror("movies", filters=[{"operator": "is", "field": "title", "value": "x"}]) is None
+    finally:
+        server.stop()
+    assert not os.path.exists(socket_path)
+    assert query_mirror("movies") is None
+
+
+def get_episode(episodeid, tvshowid, **fields):
+    '''a mirrored episode'''
+    episode = {"episodeid": episodeid, "tvshowid": tvshowid, "title": "episode %s" % episodeid, "playcount": 0,
+               "dateadded": "", "lastplayed": "", "resume": {"position": 0, "total": 0}}
+    episode.update(fields)
+    return episode
+
+
+def get_synced_mirror(**items):
+    '''a mirror of all types in the library, returns it with the library'''
+    metadatautils = FakeMetadataUtils(**items)
+    mirror = LibraryMirror()
+    mirror.load(metadatautils, ["movies", "tvshows", "episodes"])
+    return mirror, metadatautils
+
+
+def test_changed_rows_are_patched():
+    mirror, metadatautils = get_synced_mirror(movies=[get_movie(1), get_movie(2)])
+    metadatautils.kodidb.items["movies"][0] = get_movie(1, playcount=1)
+    mirror.update(metadatautils, create_change(["movies"], "movie", 1, []))
+    assert mirror.get_item("movies", 1)["playcount"] == 1
+    assert metadatautils.kodidb.item_calls == 1
+    assert [item["movieid"] for item in mirror.query("movies", filters=[
+        {"operator": "is", "field": "playcount", "value": "0"}])] == [2]
+
+
+def test_removed_rows_are_dropped():
+    mirror, metadatautils = get_synced_mirror(movies=[get_movie(1), get_movie(2)])
+    del metadatautils.kodidb.items["movies"][0]
+    mirror.update(metadatautils, create_change(["movies"], "movie", 1, [], removed=True))
+    assert mirror.get_item("movies", 1) is None
+    assert metadatautils.kodidb.item_calls == 0
+
+
+def test_episode_changes_patch_their_tvshow():
+    mirror, metadatautils = get_synced_mirror(tvshows=[get_tvshow(1, 0, 2)],
+                                              episodes=[get_episode(10, 1), get_episode(11, 1)])
+    metadatautils.kodidb.items["episodes"][0] = get_episode(10, 1, playcount=1)
+    metadatautils.kodidb.items["tvshows"][0] = get_tvshow(1, 1, 2)
+    mirror.update(metadatautils, create_change(["episodes", "tvshows"], "episode", 10, []))
+    assert mirror.get_item("episodes", 10)["playcount"] == 1
+    assert mirror.get_item("tvshows", 1)["watchedepisodes"] == 1
+
+
+def test_changes_without_ids_only_fetch_the_differing_rows():
+    mirror, metadatautils = get_synced_mirror(movies=[get_movie(movieid) for movieid in range(1, 11)])
+    mirror.update(metadatautils, create_change(["movies"]))
+    assert metadatautils.kodidb.item_calls == 0
+    metadatautils.kodidb.items["movies"][2] = get_movie(3, playcount=2)
+    metadatautils.kodidb.items["movies"].append(get_movie(11))
+    del metadatautils.kodidb.items["movies"][0]
+    mirror.update(metadatautils, create_change(["movies"]))
+    assert metadatautils.kodidb.item_calls == 2
+    assert sorted(mirror.get_table("movies").keys()) == list(range(2, 12))
+    assert mirror.get_item("movies", 3)["playcount"] == 2
+
+
+def test_many_differing_rows_reload_the_table():
+    mirror, metadatautils = get_synced_mirror(movies=[get_movie(1)])
+    metadatautils.kodidb.items["movies"] = [get_movie(movieid, playcount=1)
+                                            for movieid in range(1, MAX_DELTA_ROWS + 3)]
+    mirror.update(metadatautils, create_change(["movies"]))
+    assert metadatautils.kodidb.item_calls == 0
+    assert len(mirror.get_table("movies")) == MAX_DELTA_ROWS + 2
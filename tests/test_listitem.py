@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_listitem.py
+    the listitems are the ones kodidb.create_listitem of the mirrored metadatautils version creates
+'''
+
+import os
+import xml.etree.ElementTree as ElementTree
+from resources.lib.listitem import create_listitem, METADATAUTILS_VERSION, VIDEO_INFOLABELS
+
+
+def get_prepared_movie():
+    '''a movie like kodidb.prepare_listitem returns it, with all fields set'''
+    movie = dict((field, "%s value" % field) for field in VIDEO_INFOLABELS.values())
+    movie.update({
+        "label": "The Movie", "label2": "2001", "file": "videodb://movies/titles/7", "type": "movie",
+        "isFolder": False, "dateadded": "2020-01-01 10:00:00", "lastplayed": "2020-02-01 10:00:00",
+        "art": {"poster": "poster.jpg", "fanart": "fanart.jpg"}, "icon": "icon.png", "thumbnail": "thumb.jpg",
+        "extraproperties": {"DBID": "7", "similartitle": "Other Movie"},
+        "streamdetails": {"video": {"codec": "h264"}, "audio": {"channels": 6}},
+        "contextmenu": [("Play trailer", "PlayMedia(trailer)")]})
+    return movie
+
+
+def test_mirrored_metadatautils_version():
+    '''bumping the metadatautils import needs a review of create_listitem'''
+    addon_xml = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "addon.xml")
+    imports = dict((node.get("addon"), node.get("version"))
+                   for node in ElementTree.parse(addon_xml).getroot().iter("import"))
+    assert imports["script.module.metadatautils"] == METADATAUTILS_VERSION
+
+
+def test_movie_listitem():
+    path, listitem, isfolder = create_listitem(get_prepared_movie())
+    assert (path, isfolder) == ("videodb://movies/titles/7", False)
+    assert (listitem.label, listitem.path) == ("The Movie", "videodb://movies/titles/7")
+    assert listitem.properties == {"IsPlayable": "true", "DBID": "7", "similartitle": "Other Movie"}
+    for label, field in VIDEO_INFOLABELS.items():
+        assert listitem.info[label] == "%s value" % field
+    assert listitem.info["dateadded"] == "2020-01-01 10:00:00"
+    assert listitem.info["lastplayed"] == "2020-02-01 10:00:00"
+    assert listitem.info["mediatype"] == "movie"
+    assert listitem.info["dbid"] == "7"
+    assert "season" not in listitem.info
+    assert listitem.art == {"poster": "poster.jpg", "fanart": "fanart.jpg", "icon": "icon.png", "thumb": "thumb.jpg"}
+    assert listitem.streams == [("video", {"codec": "h264"}), ("audio", {"channels": 6}), ("subtitle", {})]
+    assert listitem.contextmenu == [("Play trailer", "PlayMedia(trailer)")]
+
+
+def test_folder_and_plugin_listitems():
+    folder = dict(get_prepared_movie(), isFolder=True, type="favourite", extraproperties={})
+    path, listitem, isfolder = create_listitem(folder)
+    assert isfolder
+    assert listitem.properties == {"IsPlayable": "false"}
+    assert "mediatype" not in listitem.info
+    plugin_item = dict(get_prepared_movie(), file="plugin://script.skin.helper.widgets/?action=x",
+                       extraproperties={})
+    assert create_listitem(plugin_item)[1].properties == {}
+
+
+def test_song_listitem():
+    song = {"label": "Song", "file": "musicdb://songs/3", "type": "song", "title": "Song", "size": 1,
+            "genre": "Rock", "year": 1999, "track": 4, "album": "Album", "artist": ["A", "B"], "rating": 8,
+            "lyrics": "", "playcount": 2, "duration": 180, "extraproperties": {}}
+    listitem = create_listitem(song)[1]
+    assert listitem.info == {"title": "Song", "size": 1, "genre": "Rock", "year": 1999, "tracknumber": 4,
+                             "album": "Album", "artist": "A / B", "rating": "8", "lyrics": "", "playcount": 2,
+                             "duration": 180, "mediatype": "song"}
+    assert listitem.streams == []
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_media_scoring.py
+    the mixed movies and tvshows scoring with the reference sets computed once
+'''
+
+import pytest
+from conftest import generate_items
+from resources.lib.media import Media
+from resources.lib.movies import Movies
+from resources.lib.tvshows import Tvshows
+
+
+def get_library():
+    '''movies and tvshows, the tvshows have tvshow genres'''
+    movies = generate_items("movies", 40, seed=6)
+    tvshows = generate_items("tvshows", 40, seed=7)
+    for tvshow in tvshows[::2]:
+        tvshow["genre"] = tvshow["genre"] + ["TV Comedies"]
+    return movies, tvshows
+
+
+def get_expected_score(ref_item, item):
+    '''the score of the scoring methods without precomputed sets'''
+    if "uniqueid" in ref_item and "uniqueid" in item:
+        return Movies.get_similarity_score(ref_item, item)
+    if "uniqueid" in ref_item or "uniqueid" in item:
+        return Media(None, None, {}).get_similarity_score(ref_item, item)
+    return Tvshows.get_similarity_score(ref_item, item)
+
+
+def test_reference_sets_are_computed_once():
+    movies, tvshows = get_library()
+    widgets = Media(None, None, {})
+    sets = widgets.get_reference_sets(movies[0], "movies")
+    assert widgets.get_reference_sets(dict(movies[0]), "movies") is sets
+    assert sets[0] == set(movies[0]["genre"])
+    assert widgets.get_reference_sets(movies[0], "media") is not sets
+    # the mixed method compares the tvshow genres by their movie genre
+    mixed_sets = widgets.get_reference_sets(tvshows[0], "media")
+    assert "Comedy" in mixed_sets[0]
+    assert "TV Comedies" not in mixed_sets[0]
+
+
+def test_mixed_score_with_sets():
+    movies, tvshows = get_library()
+    widgets = Media(None, None, {})
+    for ref_item in tvshows[:4] + movies[:4]:
+        sets = widgets.get_reference_sets(ref_item, "media")
+        for item in movies + tvshows:
+            assert widgets.get_similarity_score(ref_item, item, sets=sets) == \
+                widgets.get_similarity_score(ref_item, item)
+
+
+def test_sort_by_recommended():
+    movies, tvshows = get_library()
+    ref_items = [movies[0], tvshows[0], movies[1]]
+    all_items = [dict(item) for item in movies + tvshows]
+    result = Media(None, None, {"limit": 20}).sort_by_recommended(all_items, ref_items)
+    assert len(result) == 20
+    for item in all_items:
+        expected = sum(get_expected_score(ref_item, item) for ref_item in ref_items)
+        expected = expected / (1+item["playcount"]) / len(ref_items)
+        assert item["recommendedscore"] == pytest.approx(expected)
+    assert [item["recommendedscore"] for item in result] == \
+        sorted([item["recommendedscore"] for item in all_items], reverse=True)[:20]
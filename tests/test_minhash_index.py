@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_minhash_index.py
+    the LSH buckets of very large libraries, built in steps and kept up to date by the service
+'''
+
+import os
+import pytest
+from conftest import generate_items
+from resources.lib import minhash, minhash_index
+from resources.lib.minhash import LSH_PARAMS, get_item_band_keys, get_candidates, get_shard
+from resources.lib.minhash_index import MinHashIndex, get_approximate_similar
+from resources.lib.similarity import SimilarityEngine
+
+
+@pytest.fixture(autouse=True)
+def small_threshold(monkeypatch):
+    '''the tests use small libraries'''
+    monkeypatch.setattr(minhash_index, "APPROXIMATE_THRESHOLD", 20)
+    monkeypatch.setattr(minhash_index, "ITEMS_PER_ROW", 10)
+
+
+def get_table(items):
+    '''the library table of the mirror: the items by id'''
+    return dict((item["movieid"], item) for item in items)
+
+
+def get_buckets(items):
+    '''the buckets of all items, in memory'''
+    buckets = {}
+    for item in items:
+        for band_key in get_item_band_keys(item, "movies"):
+            buckets.setdefault(band_key, []).append(item["movieid"])
+    return buckets
+
+
+def build_index(table):
+    '''a complete index of the table'''
+    index = MinHashIndex("movies")
+    index.reset()
+    while index.build(table, 10):
+        pass
+    return index
+
+
+def test_build_in_steps():
+    items = generate_items("movies", 250, seed=21)
+    index = MinHashIndex("movies")
+    index.reset()
+    assert not index.is_complete()
+    assert index.build(get_table(items), 10) == 150
+    assert index.build(get_table(items), 10) == 50
+    assert index.build(get_table(items), 10) == 0
+    assert index.is_complete()
+    # the buckets are spread over the shard files by band key, a new instance reads them
+    buckets = get_buckets(items)
+    assert sorted(os.listdir(index.folder)) == sorted(["index.json", "digests.json"] + list(set(
+        "%s.json" % get_shard(band_key) for band_key in buckets)))
+    for ref_item in items[:10]:
+        assert MinHashIndex("movies").get_candidates(ref_item) == get_candidates(buckets, ref_item, "movies")
+        assert ref_item["movieid"] in MinHashIndex("movies").get_candidates(ref_item)
+
+
+def test_small_libraries_are_not_indexed():
+    index = MinHashIndex("movies")
+    index.reset()
+    assert index.build(get_table(generate_items("movies", 10)), 10) == 0
+    assert not index.is_complete()
+
+
+def test_changed_and_removed_items_are_indexed_again():
+    items = generate_items("movies", 100, seed=22)
+    build_index(get_table(items))
+    items[3] = dict(items[3], genre=["Western"], cast=[{"name": "nobody"}])
+    del items[5]
+    table = get_table(items)
+    index = MinHashIndex("movies")
+    index.update(table, [4, 7])
+    assert sorted(int(key) for key in MinHashIndex("movies").get_digests()) == sorted(set(table) - set([4]))
+    assert index.get_info()["stale"] == 2 * LSH_PARAMS["movies"][0]
+    assert index.build(table, 10) == 0
+    assert 4 in MinHashIndex("movies").get_candidates(items[3])
+
+
+def test_many_outdated_items_reset_the_index():
+    items = generate_items("movies", 50, seed=23)
+    build_index(get_table(items))
+    index = MinHashIndex("movies")
+    index.update(get_table(items[:30]), [])
+    assert index.get_digests() == {}
+    assert not index.is_complete()
+
+
+def test_approximate_similar_items():
+    items = generate_items("movies", 200, seed=24)
+    assert get_approximate_similar(items, items[0], "movies", 5) is None
+    build_index(get_table(items))
+    ranked = get_approximate_similar(items, items[0], "movies", 5, set([0]))
+    assert len(ranked) == 5
+    scores = SimilarityEngine(items).score(items[0], "movies")
+    candidates = MinHashIndex("movies").get_candidates(items[0])
+    for row, score in ranked:
+        assert row != 0
+        assert items[row]["movieid"] in candidates
+        assert score == pytest.approx(scores[row])
+    # too few candidates
+    assert get_approximate_similar(items, items[0], "movies", len(items)) is None
+
+
+def test_lookup_only_reads_the_shards_of_the_reference(monkeypatch):
+    items = generate_items("movies", 100, seed=25)
+    build_index(get_table(items))
+    read = []
+    read_shard = minhash.read_shard
+    monkeypatch.setattr(minhash, "read_shard", lambda folder, shard: read.append(shard) or read_shard(folder, shard))
+    candidates = MinHashIndex("movies").get_candidates(items[0])
+    assert sorted(read) == sorted(set(get_shard(band_key) for band_key in get_item_band_keys(items[0], "movies")))
+    assert candidates == get_candidates(get_buckets(items), items[0], "movies")
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_nextup.py
+    the next up and continue watching episodes of all shows from one query for their episodes
+'''
+
+from resources.lib import nextup
+from resources.lib.nextup import get_show_episodes, get_next_episode, get_continue_episode, get_nextup_episodes
+
+
+def get_episode(episodeid, tvshowid, season, episode, playcount=0, lastplayed="", position=0):
+    '''an episode with the next up fields'''
+    return {"episodeid": episodeid, "tvshowid": tvshowid, "season": season, "episode": episode,
+            "playcount": playcount, "lastplayed": lastplayed, "resume": {"position": position, "total": 100}}
+
+
+class FakeKodiDb(object):
+    '''the episodes of the library, remembers the queries'''
+
+    def __init__(self, episodes):
+        self.items = episodes
+        self.queries = []
+
+    def get_json(self, method, fields=None, returntype=None, filters=None):
+        self.queries.append((method, filters))
+        episodes = self.items
+        if filters:
+            episodes = [episode for episode in episodes if episode["season"] > 0]
+        return [dict(episode) for episode in episodes]
+
+
+class FakeMetadataUtils(object):
+    '''just a kodidb'''
+
+    def __init__(self, episodes):
+        self.kodidb = FakeKodiDb(episodes)
+
+
+def test_next_episode():
+    # the first unwatched episode after the last watched one
+    assert get_next_episode([get_episode(1, 1, 1, 1, 1, "2020-01-01"), get_episode(2, 1, 1, 2),
+                             get_episode(3, 1, 1, 3, 1, "2020-01-03"), get_episode(4, 1, 1, 4)])["episodeid"] == 4
+    # the first unwatched one if there is none after it
+    assert get_next_episode([get_episode(1, 1, 1, 1), get_episode(2, 1, 1, 2, 1, "2020-01-01")])["episodeid"] == 1
+    assert get_next_episode([get_episode(1, 1, 1, 1), get_episode(2, 1, 1, 2)])["episodeid"] == 1
+    assert get_next_episode([get_episode(1, 1, 1, 1, 1, "2020-01-01")]) is None
+
+
+def test_continue_episode():
+    # the last played episode if it's in progress
+    episodes = [get_episode(1, 1, 1, 1, 1, "2020-01-01"), get_episode(2, 1, 1, 2, 0, "2020-01-02", 50),
+                get_episode(3, 1, 1, 3)]
+    assert get_continue_episode(episodes)["episodeid"] == 2
+    # else the episode after it
+    assert get_continue_episode([get_episode(1, 1, 1, 1, 1, "2020-01-01"), get_episode(2, 1, 1, 2, 1),
+                                 get_episode(3, 1, 1, 3)])["episodeid"] == 2
+    assert get_continue_episode([get_episode(1, 1, 1, 1, 1, "2020-01-01")]) is None
+    assert get_continue_episode([get_episode(1, 1, 1, 1)]) is None
+
+
+def test_show_episodes_in_one_query():
+    metadatautils = FakeMetadataUtils([get_episode(3, 1, 2, 1), get_episode(1, 1, 1, 1), get_episode(2, 1, 0, 1),
+                                       get_episode(4, 2, 1, 1), get_episode(5, 3, 1, 1)])
+    show_episodes = get_show_episodes(metadatautils, [1, 2, 9])
+    assert dict((tvshow_id, [episode["episodeid"] for episode in episodes])
+                for tvshow_id, episodes in show_episodes.items()) == {1: [1, 3], 2: [4], 9: []}
+    assert [episode["episodeid"] for episode in get_show_episodes(metadatautils, [1], True)[1]] == [2, 1, 3]
+    assert len(metadatautils.kodidb.queries) == 2
+
+
+def test_nextup_episodes_are_fetched_at_once(monkeypatch):
+    requests = []
+    monkeypatch.setattr(nextup, "get_episode_details",
+                        lambda episode_ids: requests.append(episode_ids) or [{"episodeid": x} for x in episode_ids])
+    metadatautils = FakeMetadataUtils([get_episode(1, 1, 1, 1, 1, "2020-01-01"), get_episode(2, 1, 1, 2),
+                                       get_episode(3, 2, 1, 1, 1, "2020-01-02"), get_episode(4, 2, 1, 2, 0, "", 10),
+                                       get_episode(5, 3, 1, 1, 1, "2020-01-03")])
+    assert [episode["episodeid"] for episode in get_nextup_episodes(metadatautils, [2, 1, 3])] == [4, 2]
+    assert [episode["episodeid"] for episode in get_nextup_episodes(metadatautils, [2, 1, 3],
+                                                                    continue_watching=True)] == [4, 2]
+    assert requests == [[4, 2], [4, 2]]
+    assert len(metadatautils.kodidb.queries) == 2
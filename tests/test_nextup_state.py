@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_nextup_state.py
+    the next up records of all shows the service keeps for the next up and continue watching widgets
+'''
+
+import xbmcgui
+from resources.lib import nextup
+from resources.lib.nextup import NextUpState, get_show_record, get_nextup_episodes, STATE_PROPERTY
+
+
+def get_episode(episodeid, tvshowid, season, episode, playcount=0, lastplayed="", position=0):
+    '''an episode with the next up fields'''
+    return {"episodeid": episodeid, "tvshowid": tvshowid, "season": season, "episode": episode,
+            "playcount": playcount, "lastplayed": lastplayed, "resume": {"position": position, "total": 100}}
+
+
+class FakeKodiDb(object):
+    '''the episodes of the library, counts the queries'''
+
+    def __init__(self, episodes):
+        self.items = episodes
+        self.queries = 0
+
+    def get_json(self, method, fields=None, returntype=None, filters=None):
+        self.queries += 1
+        return [dict(episode) for episode in self.items]
+
+    def episodes(self, sort=None, tvshowid=None, fields=None):
+        self.queries += 1
+        return [dict(episode) for episode in self.items if episode["tvshowid"] == tvshowid]
+
+
+class FakeMetadataUtils(object):
+    '''just a kodidb'''
+
+    def __init__(self, episodes):
+        self.kodidb = FakeKodiDb(episodes)
+
+
+def get_library():
+    '''show 1 is watched up to episode 2 with a special, show 2 has an episode in progress, show 3 is watched'''
+    return [get_episode(1, 1, 1, 1, 1, "2020-01-01"), get_episode(2, 1, 1, 2, 1, "2020-01-02"),
+            get_episode(3, 1, 1, 3), get_episode(4, 1, 0, 1),
+            get_episode(5, 2, 1, 1, 0, "2020-01-05", 30), get_episode(6, 2, 1, 2),
+            get_episode(7, 3, 1, 1, 1, "2020-01-03")]
+
+
+def test_show_record():
+    episodes = sorted(get_library()[:4], key=lambda x: (x["season"], x["episode"]))
+    assert get_show_record(episodes) == {"lastplayed": "2020-01-02", "last": 2, "resume": 0, "next": [3, 3],
+                                         "continue": [3, 3], "watched": 2, "episodes": 4}
+    # with the specials the unwatched special is next up once all regular episodes are watched
+    episodes[3]["playcount"] = 1
+    assert get_show_record(episodes)["next"] == [None, 4]
+    assert get_show_record([get_episode(1, 1, 1, 1)])["last"] is None
+
+
+def test_reconcile_and_lookup():
+    metadatautils = FakeMetadataUtils(get_library())
+    state = NextUpState()
+    state.reconcile(metadatautils)
+    assert metadatautils.kodidb.queries == 1
+    assert sorted(state.data["shows"]) == ["1", "2", "3"]
+    assert state.data["shows"]["2"]["resume"] == 30
+    # the shows with unwatched episodes, last played first
+    assert state.get_show_ids(10) == [2, 1]
+    assert state.get_show_ids(1) == [2]
+    assert state.get_show_ids(10, unwatched_only=False) == [2, 3, 1]
+    assert state.get_episode_ids([1, 2, 9]) == [3, 5, None]
+    assert state.get_episode_ids([1, 2], continue_watching=True) == [3, 5]
+    assert sorted(state.get_shows(3)) == [1]
+    assert sorted(state.get_shows(5)) == [2]
+
+
+def test_update_shows():
+    library = get_library()
+    metadatautils = FakeMetadataUtils(library)
+    state = NextUpState()
+    state.reconcile(metadatautils)
+    library[2]["playcount"] = 1
+    library[2]["lastplayed"] = "2020-01-06"
+    del library[4:6]
+    state.update_shows(metadatautils, [1, 2])
+    assert state.data["shows"]["1"]["next"] == [None, 4]
+    assert state.data["shows"]["1"]["lastplayed"] == "2020-01-06"
+    assert "2" not in state.data["shows"]
+
+
+def test_state_is_only_used_while_the_service_keeps_it(monkeypatch):
+    win = xbmcgui.Window(10000)
+    assert NextUpState.load() is None
+    state = NextUpState()
+    state.reconcile(FakeMetadataUtils(get_library()))
+    state.save(win)
+    assert NextUpState.load().data == state.data
+    monkeypatch.setattr(nextup, "get_episode_details", lambda episode_ids: [{"episodeid": x} for x in episode_ids])
+    # the widgets look the episodes up in the records, without any query
+    metadatautils = FakeMetadataUtils([])
+    assert [episode["episodeid"] for episode in get_nextup_episodes(metadatautils, [2, 1])] == [5, 3]
+    assert [episode["episodeid"] for episode in NextUpState.load().get_episodes(10, continue_watching=True)] == [5, 3]
+    assert metadatautils.kodidb.queries == 0
+    # the service stopped
+    win.clearProperty(STATE_PROPERTY)
+    assert NextUpState.load() is None
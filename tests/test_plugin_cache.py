@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_plugin_cache.py
+    the plugin serves a cached listing without loading metadatautils
+'''
+
+import sys
+from simplecache import SimpleCache
+import xbmcgui
+from resources.lib import main
+from resources.lib.listitem import create_listitem, create_listitems
+
+PARAMSTRING = "?mediatype=movies&action=recent&limit=5&reload=token"
+
+
+def get_prepared_movie(movieid):
+    '''a movie like kodidb.prepare_listitem returns it'''
+    return {"label": "movie %s" % movieid, "file": "videodb://movies/titles/%s" % movieid, "type": "movie",
+            "title": "movie %s" % movieid, "year": 2000, "genre": "Drama", "playcount": 0,
+            "art": {"poster": "poster.jpg"}, "extraproperties": {"DBID": "%s" % movieid}, "isFolder": False}
+
+
+def test_parse_options():
+    options = main.parse_options(PARAMSTRING, None, xbmcgui.Window(10000))
+    assert options == {"mediatype": "movies", "action": "recent", "limit": 5, "reload": "token"}
+    xbmcgui.Window(10000).setProperty("widgetreload-movies", "service")
+    assert main.parse_options(PARAMSTRING, None, xbmcgui.Window(10000))["reload"] == "service"
+    options = main.parse_options("?action=recentmovies&limit=5", None, xbmcgui.Window(10000))
+    assert (options["mediatype"], options["action"]) == ("movies", "recent")
+
+
+def test_create_listitem():
+    path, listitem, isfolder = create_listitem(get_prepared_movie(1))
+    assert path == "videodb://movies/titles/1"
+    assert not isfolder
+    assert listitem.properties == {"IsPlayable": "true", "DBID": "1"}
+    assert listitem.info["title"] == "movie 1"
+    assert listitem.info["mediatype"] == "movie"
+    assert listitem.info["dbid"] == "1"
+    assert listitem.art == {"poster": "poster.jpg"}
+
+
+def test_create_listitem_of_an_episode_adds_the_show_to_the_contextmenu():
+    episode = dict(get_prepared_movie(1), type="episode", season=2, episode=3, tvshowid=7)
+    listitem = create_listitem(episode)[1]
+    assert (listitem.info["season"], listitem.info["episode"]) == (2, 3)
+    assert [entry[1] for entry in listitem.contextmenu] == [
+        "ActivateWindow(Video,videodb://tvshows/titles/7/,return)",
+        "ActivateWindow(Video,videodb://tvshows/titles/7/2/,return)"]
+
+
+def test_invalid_items_are_skipped():
+    assert len(create_listitems([get_prepared_movie(1), {"label": "no file"}])) == 1
+
+
+def test_cache_hit_does_not_load_metadatautils(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["plugin://script.skin.helper.widgets/", "1", PARAMSTRING])
+    xbmcgui.Window(10000).setProperty("widgetreload2", "token")
+    cache = SimpleCache()
+    options = main.parse_options(PARAMSTRING, None, xbmcgui.Window(10000))
+    cache.set(main.get_cache_str(options), [get_prepared_movie(1), get_prepared_movie(2)], checksum="token")
+    monkeypatch.setattr(main, "SimpleCache", lambda: cache)
+    listed = []
+    monkeypatch.setattr(main.xbmcplugin, "addDirectoryItems", lambda handle, items, count: listed.extend(items))
+    # importing metadatautils fails from here on
+    monkeypatch.setitem(sys.modules, "metadatautils", None)
+    plugin = main.Main()
+    assert plugin._metadatautils is None
+    assert [item[0] for item in listed] == ["videodb://movies/titles/1", "videodb://movies/titles/2"]
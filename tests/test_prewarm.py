@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_prewarm.py
+    the widget registry and the prewarming of the registered listings after a library change
+'''
+
+import os
+import time
+import xbmcgui
+import xbmc
+from simplecache import SimpleCache
+from resources.lib import prewarm
+from resources.lib.registry import WidgetRegistry, create_change
+
+
+class FakeMetadataUtils(object):
+    '''just the cache the prewarmer reads and writes'''
+
+    def __init__(self):
+        self.cache = SimpleCache()
+
+
+def register(registry, cache_str, mediatype="movies", action="recent", checksum="old", items=None):
+    '''register a listing like the plugin does after a cache miss'''
+    options = {"mediatype": mediatype, "action": action}
+    return registry.register(cache_str, "mediatype=%s&action=%s" % (mediatype, action), options, checksum,
+                             items or [])
+
+
+def test_register_and_get():
+    registry = WidgetRegistry()
+    register(registry, "widget.a", items=[{"movieid": 1}, {"movieid": 2}])
+    entry = registry.get("widget.a")
+    assert entry["mediatype"] == "movies"
+    assert entry["checksum"] == "old"
+    assert entry["dependencies"]["ids"] == {"movie": [1, 2]}
+    assert registry.get("widget.b") is None
+
+
+def test_entries_are_filtered_by_mediatype():
+    registry = WidgetRegistry()
+    register(registry, "widget.a", "movies")
+    register(registry, "widget.b", "episodes")
+    assert set(entry["cache_str"] for entry in registry.entries()) == set(["widget.a", "widget.b"])
+    assert [entry["cache_str"] for entry in registry.entries(["episodes"])] == ["widget.b"]
+
+
+def test_unused_entries_are_forgotten():
+    registry = WidgetRegistry()
+    register(registry, "widget.a")
+    unused = time.time() - 8 * 86400
+    os.utime(registry.get_filename("widget.a"), (unused, unused))
+    assert registry.entries() == []
+    assert not os.path.exists(registry.get_filename("widget.a"))
+
+
+def test_update_keeps_the_last_request_time():
+    registry = WidgetRegistry()
+    entry = register(registry, "widget.a")
+    requested = time.time() - 86400
+    os.utime(registry.get_filename("widget.a"), (requested, requested))
+    entry["checksum"] = "new"
+    registry.update(entry)
+    assert registry.get("widget.a")["checksum"] == "new"
+    assert abs(os.path.getmtime(registry.get_filename("widget.a")) - requested) < 1
+    registry.touch("widget.a")
+    assert os.path.getmtime(registry.get_filename("widget.a")) > requested + 3600
+
+
+def test_prewarm_recomputes_and_carries_over(monkeypatch):
+    registry = WidgetRegistry()
+    register(registry, "widget.movies", "movies", checksum="old")
+    register(registry, "widget.albums", "albums", checksum="old")
+    register(registry, "widget.other", "movies", checksum="custom")
+    win = xbmcgui.Window(10000)
+    win.setProperty("widgetreload", "old")
+    computed = []
+
+    def get_widget_items(addon, metadatautils, options):
+        computed.append(options["mediatype"])
+        return [{"movieid": 5}]
+    monkeypatch.setattr(prewarm, "get_options", lambda paramstring, addon, win: {
+        "mediatype": paramstring.split("&")[0].split("=")[1], "action": "recent", "limit": 25})
+    monkeypatch.setattr(prewarm, "get_cache_str", lambda options: "widget.%s" % options["mediatype"])
+    monkeypatch.setattr(prewarm, "get_widget_items", get_widget_items)
+    prewarmer = prewarm.WidgetPrewarmer(win, xbmc.Monitor())
+    prewarmer.metadatautils = FakeMetadataUtils()
+    prewarmer.metadatautils.cache.set("widget.albums", [{"albumid": 1}], checksum="old")
+    prewarmer.prewarm(create_change(["movies"]), ["widgetreload"], "new")
+    # the affected movies listing is recomputed, the albums listing is carried over to the new token
+    assert computed == ["movies"]
+    assert prewarmer.metadatautils.cache.get("widget.movies", checksum="new") == [{"movieid": 5}]
+    assert prewarmer.metadatautils.cache.get("widget.albums", checksum="new") == [{"albumid": 1}]
+    assert registry.get("widget.movies")["checksum"] == "new"
+    # a listing keyed by a reload parameter we don't publish is left alone
+    assert registry.get("widget.other")["checksum"] == "custom"
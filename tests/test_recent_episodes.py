@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_recent_episodes.py
+    the recently added episodes grouped per show, season and date from pages of minimal episodes
+'''
+
+import xbmcaddon
+from conftest import SETTINGS
+from resources.lib import nextup
+from resources.lib.episodes import Episodes, RECENT_FIELDS
+
+
+class FakeKodiDb(object):
+    '''the episodes newest first, remembers the requested pages'''
+
+    def __init__(self, episodes):
+        self.items = episodes
+        self.pages = []
+
+    def episodes(self, sort=None, filters=None, limits=None, fields=None):
+        self.pages.append((limits, fields))
+        return [dict(episode) for episode in self.items[limits[0]:limits[1]]]
+
+
+class FakeMetadataUtils(object):
+    '''just a kodidb'''
+
+    def __init__(self, episodes):
+        self.kodidb = FakeKodiDb(episodes)
+
+
+def get_library():
+    '''show 1 got three episodes of season 1 on one day, show 2 two episodes, then older single episodes'''
+    episodes = []
+    for count in range(3):
+        episodes.append({"episodeid": 100 + count, "tvshowid": 1, "season": 1, "dateadded": "2020-02-10 10:00:00"})
+    for count in range(2):
+        episodes.append({"episodeid": 200 + count, "tvshowid": 2, "season": 3, "dateadded": "2020-02-09 10:00:00"})
+    episodes.append({"episodeid": 103, "tvshowid": 1, "season": 2, "dateadded": "2020-02-09 09:00:00"})
+    for count in range(20):
+        episodes.append({"episodeid": 300 + count, "tvshowid": 3 + count, "season": 1,
+                         "dateadded": "2020-01-%02d 10:00:00" % (28 - count)})
+    return episodes
+
+
+def get_widget(metadatautils, limit):
+    '''the episodes widgets with grouping enabled'''
+    SETTINGS["episodes_grouping"] = "true"
+    return Episodes(xbmcaddon.Addon(), metadatautils, {"limit": limit, "hide_watched": False})
+
+
+def get_details(episode_ids):
+    '''the details of the newest episode of every group'''
+    return [{"episodeid": episode_id, "season": 1, "dateadded": "2020-02-10 10:00:00"} for episode_id in episode_ids]
+
+
+def test_grouping(monkeypatch):
+    requests = []
+    monkeypatch.setattr(nextup, "get_episode_details", lambda episode_ids: requests.append(episode_ids) or
+                        get_details(episode_ids))
+    metadatautils = FakeMetadataUtils(get_library())
+    all_items = get_widget(metadatautils, 4).recent()
+    assert [item["episodeid"] for item in all_items] == [100, 200, 103, 300]
+    # three episodes of the same season and date become a season entry
+    assert all_items[0]["type"] == "season"
+    assert all_items[0]["extraproperties"] == {"UnWatchedEpisodes": "3"}
+    assert "type" not in all_items[1]
+    # one request for the details, the first page holds enough episodes
+    assert requests == [[100, 200, 103, 300]]
+    assert metadatautils.kodidb.pages == [((0, 16), RECENT_FIELDS)]
+
+
+def test_pages_grow_until_the_groups_are_complete(monkeypatch):
+    monkeypatch.setattr(nextup, "get_episode_details", get_details)
+    episodes = [{"episodeid": count, "tvshowid": 1, "season": 1, "dateadded": "2020-02-10 10:00:00"}
+                for count in range(10)]
+    episodes.append({"episodeid": 99, "tvshowid": 2, "season": 1, "dateadded": "2020-02-01 10:00:00"})
+    metadatautils = FakeMetadataUtils(episodes)
+    all_items = get_widget(metadatautils, 1).recent()
+    # the group is only complete once an older episode was seen
+    assert [item["episodeid"] for item in all_items] == [0]
+    assert all_items[0]["extraproperties"] == {"UnWatchedEpisodes": "10"}
+    assert [limits for limits, _ in metadatautils.kodidb.pages] == [(0, 4), (4, 12)]
+
+
+def test_without_grouping():
+    metadatautils = FakeMetadataUtils(get_library())
+    SETTINGS["episodes_grouping"] = "false"
+    widget = Episodes(xbmcaddon.Addon(), metadatautils, {"limit": 4, "hide_watched": False})
+    assert [item["episodeid"] for item in widget.recent()] == [100, 101, 102, 200]
+    assert metadatautils.kodidb.pages == [((0, 4), None)]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_registry.py
+    the dependencies of the widget listings and which listings a library change affects
+'''
+
+from resources.lib.registry import get_dependencies, get_change_predicates, create_change, merge_changes, \
+    is_affected, PREDICATE_INPROGRESS, PREDICATE_LASTPLAYED, PREDICATE_UNWATCHED, PREDICATE_DATEADDED, \
+    PREDICATE_RANDOM
+
+
+def get_entry(mediatype, action, all_items=(), **options):
+    '''a registry entry of a listing with the given items'''
+    options.update({"mediatype": mediatype, "action": action})
+    return {"cache_str": "%s.%s" % (mediatype, action), "mediatype": mediatype,
+            "dependencies": get_dependencies(options, all_items)}
+
+
+def test_dependencies_collect_the_library_ids():
+    items = [{"movieid": 1}, {"episodeid": 7, "tvshowid": 3}, {"title": "no id"}]
+    dependencies = get_dependencies({"action": "recent"}, items)
+    assert dependencies["ids"] == {"movie": [1], "episode": [7], "tvshow": [3]}
+    assert dependencies["predicates"] == [PREDICATE_DATEADDED]
+
+
+def test_dependencies_derive_the_predicates_from_the_action():
+    predicates = get_dependencies({"action": "inprogress"}, [])["predicates"]
+    assert set(predicates) == set([PREDICATE_INPROGRESS, PREDICATE_LASTPLAYED])
+    assert get_dependencies({"action": "random"}, [])["predicates"] == [PREDICATE_RANDOM]
+    assert PREDICATE_UNWATCHED in get_dependencies({"action": "recent", "hide_watched": True}, [])["predicates"]
+
+
+def test_change_predicates():
+    assert get_change_predicates("VideoLibrary.OnRemove", {}) == []
+    assert get_change_predicates("VideoLibrary.OnUpdate", {"added": True}) is None
+    assert PREDICATE_UNWATCHED in get_change_predicates("VideoLibrary.OnUpdate", {"playcount": 1})
+    assert PREDICATE_UNWATCHED not in get_change_predicates("VideoLibrary.OnUpdate", {})
+
+
+def test_create_change():
+    change = create_change(["movies"], "movie", 5, [PREDICATE_INPROGRESS], removed=True)
+    assert change["items"] == {"movie": set([5])}
+    assert change["removed"] == {"movie": set([5])}
+    assert not change["unknown"]
+    assert create_change(["movies"])["unknown"]
+    assert not create_change(["movies"], predicates=[PREDICATE_RANDOM])["unknown"]
+
+
+def test_merge_changes():
+    change = create_change(["movies"], "movie", 1, [PREDICATE_INPROGRESS])
+    merge_changes(change, create_change(["episodes"], "episode", 2, [PREDICATE_UNWATCHED], removed=True))
+    assert change["widget_types"] == set(["movies", "episodes"])
+    assert change["items"] == {"movie": set([1]), "episode": set([2])}
+    assert change["removed"] == {"episode": set([2])}
+    assert set(change["predicates"]) == set([PREDICATE_INPROGRESS, PREDICATE_UNWATCHED])
+    assert not change["unknown"]
+    merge_changes(change, create_change(["movies"]))
+    assert change["predicates"] is None
+    assert change["unknown"]
+
+
+def test_other_widget_types_are_not_affected():
+    entry = get_entry("albums", "recent", [{"albumid": 1}])
+    assert not is_affected(entry, create_change(["movies"]))
+
+
+def test_unknown_changes_affect_everything():
+    entry = get_entry("movies", "recent", [{"movieid": 1}])
+    assert is_affected(entry, create_change(["movies"]))
+    assert is_affected({"cache_str": "movies.old", "mediatype": "movies"},
+                       create_change(["movies"], "movie", 9, []))
+
+
+def test_contained_items_are_affected():
+    entry = get_entry("movies", "recent", [{"movieid": 1}])
+    assert is_affected(entry, create_change(["movies"], "movie", 1, []))
+    assert not is_affected(entry, create_change(["movies"], "movie", 2, []))
+
+
+def test_touched_predicates_are_affected():
+    inprogress = get_entry("movies", "inprogress", [{"movieid": 1}])
+    recent = get_entry("movies", "recent", [{"movieid": 1}])
+    change = create_change(["movies"], "movie", 2, [PREDICATE_INPROGRESS, PREDICATE_LASTPLAYED])
+    assert is_affected(inprogress, change)
+    assert not is_affected(recent, change)
+    # a new item may end up in any listing
+    assert is_affected(recent, create_change(["movies"], "movie", 2, None))
+
+
+def test_revalidated_listings_are_affected():
+    entry = get_entry("albums", "recent")
+    change = create_change([], predicates=[])
+    change["revalidate"][entry["cache_str"]] = "token"
+    assert is_affected(entry, change)
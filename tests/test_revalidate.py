@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_revalidate.py
+    outdated listings are served while the service refreshes them
+'''
+
+import json
+import xbmc
+import xbmcaddon
+import xbmcgui
+from simplecache import SimpleCache
+from conftest import SETTINGS
+from resources.lib import main
+from resources.lib import kodi_monitor
+from resources.lib.kodi_monitor import KodiMonitor, REVALIDATE_INTERVAL
+from resources.lib.registry import WidgetRegistry
+
+
+class FakePlugin(object):
+    '''the state of Main that get_stale_listing uses'''
+
+    def __init__(self, options):
+        self.options = options
+        self.addon = xbmcaddon.Addon()
+        self.cache = SimpleCache()
+
+    get_stale_listing = main.Main.__dict__["get_stale_listing"]
+
+
+def test_max_staleness():
+    addon = xbmcaddon.Addon()
+    assert main.get_max_staleness({"action": "recent"}, addon) == 0
+    SETTINGS["max_staleness"] = "5"
+    assert main.get_max_staleness({"action": "recent"}, addon) == 300
+    assert main.get_max_staleness({"action": "recent", "maxstale": "1"}, addon) == 60
+    # the in progress widgets must reflect what was just watched
+    assert main.get_max_staleness({"action": "inprogress"}, addon) == 0
+
+
+def test_stale_listing_is_served_and_revalidated(monkeypatch):
+    requests = []
+    monkeypatch.setattr(xbmc, "executeJSONRPC", lambda request: requests.append(json.loads(request)) or "{}")
+    SETTINGS["max_staleness"] = "5"
+    plugin = FakePlugin({"mediatype": "movies", "action": "recent"})
+    WidgetRegistry().register("widget.a", "", plugin.options, "old", [])
+    plugin.cache.set("widget.a", [{"movieid": 1}], checksum="old")
+    assert plugin.get_stale_listing("widget.a", "new") == [{"movieid": 1}]
+    assert requests[0]["method"] == "JSONRPC.NotifyAll"
+    assert requests[0]["params"]["data"] == {"cache_str": "widget.a", "checksum": "new"}
+
+
+def test_too_old_listings_are_not_served(monkeypatch):
+    monkeypatch.setattr(xbmc, "executeJSONRPC", lambda request: "{}")
+    SETTINGS["max_staleness"] = "5"
+    plugin = FakePlugin({"mediatype": "movies", "action": "recent"})
+    entry = WidgetRegistry().register("widget.a", "", plugin.options, "old", [])
+    plugin.cache.set("widget.a", [{"movieid": 1}], checksum="old")
+    monkeypatch.setattr(main.time, "time", lambda: entry["updated"] + 301)
+    assert plugin.get_stale_listing("widget.a", "new") == []
+
+
+class FakeCoalescer(object):
+    '''remembers the changes'''
+
+    def __init__(self):
+        self.changes = []
+
+    def add(self, change, properties):
+        self.changes.append((change, properties))
+
+
+def test_revalidation_is_rate_limited():
+    win = xbmcgui.Window(10000)
+    win.setProperty("widgetreload-movies", "new")
+    win.setProperty("widgetreload", "other")
+    monitor = KodiMonitor(win=win, scheduler=None)
+    monitor.coalescer = FakeCoalescer()
+    monitor.revalidate_widget("widget.a", "new")
+    monitor.revalidate_widget("widget.a", "new")
+    assert len(monitor.coalescer.changes) == 1
+    change, properties = monitor.coalescer.changes[0]
+    assert change["revalidate"] == {"widget.a": "new"}
+    assert not change["unknown"]
+    assert properties == ["widgetreload-movies"]
+
+
+def test_revalidated_listings_are_forgotten(monkeypatch):
+    monitor = KodiMonitor(win=xbmcgui.Window(10000), scheduler=None)
+    monitor.coalescer = FakeCoalescer()
+    monkeypatch.setattr(kodi_monitor.time, "time", lambda: 1000)
+    monitor.revalidate_widget("widget.a", "new")
+    monkeypatch.setattr(kodi_monitor.time, "time", lambda: 1010)
+    monitor.revalidate_widget("widget.b", "new")
+    assert sorted(monitor.revalidated) == ["widget.a", "widget.b"]
+    monkeypatch.setattr(kodi_monitor.time, "time", lambda: 1000 + REVALIDATE_INTERVAL)
+    monitor.revalidate_widget("widget.c", "new")
+    assert monitor.revalidated == {"widget.b": 1010, "widget.c": 1000 + REVALIDATE_INTERVAL}
+    assert len(monitor.coalescer.changes) == 3
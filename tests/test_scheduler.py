@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_scheduler.py
+    the timed jobs of the service and the scheduled widget refreshes
+'''
+
+import time
+import threading
+import xbmcgui
+from resources.lib.scheduler import Scheduler
+from resources.lib.kodi_monitor import KodiMonitor, get_reload_properties
+from resources.lib.registry import PREDICATE_PVR
+
+
+def run_scheduler():
+    '''a started scheduler thread'''
+    scheduler = Scheduler()
+    scheduler.start()
+    return scheduler
+
+
+def test_jobs_run_in_deadline_order():
+    scheduler = run_scheduler()
+    done = threading.Event()
+    order = []
+    now = time.time()
+    scheduler.schedule("second", now + 0.1, lambda: order.append("second") or done.set())
+    scheduler.schedule("first", now + 0.05, lambda: order.append("first"))
+    assert done.wait(2)
+    scheduler.stop()
+    assert order == ["first", "second"]
+
+
+def test_rescheduling_replaces_the_deadline():
+    scheduler = run_scheduler()
+    done = threading.Event()
+    runs = []
+    scheduler.schedule("job", time.time() + 30, lambda: runs.append("late"))
+    scheduler.schedule("job", time.time(), lambda: runs.append("now") or done.set())
+    assert done.wait(2)
+    scheduler.stop()
+    assert runs == ["now"]
+
+
+def test_cancelled_jobs_do_not_run():
+    scheduler = run_scheduler()
+    done = threading.Event()
+    runs = []
+    scheduler.schedule("cancelled", time.time() + 0.05, lambda: runs.append("cancelled"))
+    scheduler.cancel("cancelled")
+    scheduler.schedule("other", time.time() + 0.1, done.set)
+    assert done.wait(2)
+    scheduler.stop()
+    assert runs == []
+
+
+def test_jobs_run_again_at_the_deadline_they_return():
+    scheduler = run_scheduler()
+    done = threading.Event()
+    runs = []
+
+    def job():
+        runs.append(time.time())
+        if len(runs) == 3:
+            done.set()
+            return None
+        return time.time() + 0.01
+    scheduler.schedule("repeat", time.time(), job)
+    assert done.wait(2)
+    scheduler.stop()
+    assert len(runs) == 3
+
+
+def test_failing_jobs_do_not_stop_the_scheduler():
+    scheduler = run_scheduler()
+    done = threading.Event()
+    scheduler.schedule("failing", time.time(), lambda: 1 / 0)
+    scheduler.schedule("next", time.time() + 0.05, done.set)
+    assert done.wait(2)
+    scheduler.stop()
+
+
+def test_reload_properties_of_widget_types():
+    assert get_reload_properties(["pvr"]) == ["widgetreload2", "widgetreload-pvr"]
+
+
+def test_scheduled_refresh_only_reloads_its_widget_types():
+    class FakeScheduler(object):
+        '''runs nothing, remembers the jobs'''
+
+        def __init__(self):
+            self.jobs = {}
+
+        def schedule(self, name, deadline, func):
+            self.jobs[name] = (deadline, func)
+
+        def cancel(self, name):
+            self.jobs.pop(name, None)
+    win = xbmcgui.Window(10000)
+    monitor = KodiMonitor(win=win, scheduler=FakeScheduler())
+    published = []
+    monitor.publish_changes = lambda change, properties: published.append((change, properties))
+    monitor.schedule_refresh("pvr", lambda now: now + 60, ["pvr"], [PREDICATE_PVR])
+    deadline, job = monitor.scheduler.jobs["pvr"]
+    assert deadline > time.time()
+    assert job() > time.time()
+    change, properties = published[0]
+    assert change["widget_types"] == set(["pvr"])
+    assert change["predicates"] == [PREDICATE_PVR]
+    assert not change["unknown"]
+    assert properties == ["widgetreload2", "widgetreload-pvr"]
+    # no next deadline: the refresh is cancelled
+    monitor.schedule_refresh("pvr", lambda now: None, ["pvr"], [PREDICATE_PVR])
+    assert "pvr" not in monitor.scheduler.jobs
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_scoring_pool.py
+    the scoring spread over a pool of processes gives the in-process results
+'''
+
+import pytest
+from conftest import generate_items
+from tools import scoring_pool
+from tools.scoring_pool import get_partitions, get_record, top_partition, top_similar, score_similar
+from resources.lib.similarity import SimilarityEngine
+
+
+def test_partitions():
+    assert get_partitions(list(range(7)), 3) == [(0, [0, 1, 2]), (3, [3, 4, 5]), (6, [6])]
+    assert get_partitions(list(range(2)), 4) == [(0, [0]), (1, [1])]
+
+
+def test_records_score_like_the_items():
+    items = generate_items("movies", 60, seed=16)
+    records = [get_record(item, "movies") for item in items]
+    assert SimilarityEngine(records).score(records[0], "movies") == \
+        pytest.approx(SimilarityEngine(items).score(items[0], "movies"))
+
+
+def test_merged_partitions_give_the_top():
+    items = generate_items("tvshows", 90, seed=17)
+    excluded_rows = set([0, 45])
+    results = [top_partition((offset, part, items[0], "tvshows", 10, excluded_rows))
+               for offset, part in get_partitions(items, 4)]
+    merged = sorted([result for part in results for result in part], key=lambda x: (-x[1], x[0]))[:10]
+    assert merged == SimilarityEngine(items).top(items[0], "tvshows", 10, excluded_rows)
+
+
+def test_small_libraries_are_scored_in_process(monkeypatch):
+    monkeypatch.setattr(scoring_pool, "run_partitions", None)
+    items = generate_items("movies", 50, seed=18)
+    assert top_similar(items, items[0], "movies", 5, parallel=True) == \
+        SimilarityEngine(items).top(items[0], "movies", 5)
+    assert score_similar(items, items[:2], "movies", parallel=True) == \
+        SimilarityEngine(items).score_many(items[:2], "movies")
+
+
+@pytest.mark.skipif(not scoring_pool.get_pool_size(), reason="no forked processes on this platform")
+def test_pool(monkeypatch):
+    monkeypatch.setattr(scoring_pool, "POOL_THRESHOLD", 10)
+    monkeypatch.setattr(scoring_pool, "get_pool_size", lambda: 2)
+    items = generate_items("movies", 100, seed=19)
+    top = top_similar(items, items[0], "movies", 10, set([0]), parallel=True)
+    expected = SimilarityEngine(items).top(items[0], "movies", 10, set([0]))
+    assert [row for row, _ in top] == [row for row, _ in expected]
+    assert [score for _, score in top] == pytest.approx([score for _, score in expected])
+    weights = dict((item["title"], 1) for item in items[:3])
+    assert score_similar(items, items[:3], "movies", weights, parallel=True) == \
+        pytest.approx(SimilarityEngine(items).score_many(items[:3], "movies", weights))
+
+
+def test_failed_pool_falls_back(monkeypatch):
+    monkeypatch.setattr(scoring_pool, "POOL_THRESHOLD", 10)
+    monkeypatch.setattr(scoring_pool, "get_pool_size", lambda: 2)
+    monkeypatch.setattr(scoring_pool, "run_partitions", lambda job, partitions, pool_size: None)
+    items = generate_items("movies", 30, seed=20)
+    assert top_similar(items, items[0], "movies", 5, parallel=True) == \
+        SimilarityEngine(items).top(items[0], "movies", 5)
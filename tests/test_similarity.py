@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_similarity.py
+    the batched similarity scores are the scores of the similarity methods of the widgets
+'''
+
+import pytest
+from conftest import generate_items
+from resources.lib import similarity
+from resources.lib.similarity import SimilarityEngine
+from resources.lib.movies import Movies
+from resources.lib.tvshows import Tvshows
+
+SCORE_METHODS = {"movies": Movies.get_similarity_score, "tvshows": Tvshows.get_similarity_score}
+ENGINE_MODES = [False, pytest.param(True, marks=pytest.mark.skipif(similarity.numpy is None,
+                                                                   reason="numpy not installed"))]
+
+
+@pytest.mark.parametrize("use_numpy", ENGINE_MODES)
+@pytest.mark.parametrize("media_type", ["movies", "tvshows"])
+def test_scores_match_the_widget_scores(media_type, use_numpy):
+    items = generate_items(media_type, 200)
+    engine = SimilarityEngine(items, use_numpy)
+    for ref_item in items[:10]:
+        scores = engine.score(ref_item, media_type)
+        assert scores == pytest.approx([SCORE_METHODS[media_type](ref_item, item) for item in items])
+
+
+@pytest.mark.parametrize("use_numpy", ENGINE_MODES)
+def test_score_many_sums_the_weighted_scores(use_numpy):
+    items = generate_items("tvshows", 100)
+    references = items[:3]
+    weights = {"title1": 1, "title2": 0.5, "title3": 1.5}
+    scores = SimilarityEngine(items, use_numpy).score_many(references, "tvshows", weights)
+    expected = [sum(weights[ref_item["title"]] * Tvshows.get_similarity_score(ref_item, item)
+                    for ref_item in references) for item in items]
+    assert scores == pytest.approx(expected)
+    assert SimilarityEngine(items, use_numpy).score_many([], "tvshows") == [0] * len(items)
+
+
+def test_empty_reference_values():
+    items = generate_items("movies", 50)
+    ref_item = dict(items[0], genre=[], director=[], writer=[], cast=[], rating=0, year=0, mpaa="", setid=0)
+    assert SimilarityEngine(items, False).score(ref_item, "movies") == [0] * len(items)
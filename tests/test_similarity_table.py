@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_similarity_table.py
+    the persisted similarity rows are built while idle and kept up to date with the library changes
+'''
+
+import pytest
+from conftest import generate_items
+from resources.lib import similarity_table
+from resources.lib.similarity_table import SimilarityTable, TOP_K, insert_entry
+
+
+def get_table(items):
+    '''the library table of the mirror: the items by id'''
+    return dict((item["movieid"], item) for item in items)
+
+
+def get_expected_row(table, item_id):
+    '''the row computed from scratch'''
+    return SimilarityTable("movies").compute_row(SimilarityTable("movies").get_engine(table), item_id)
+
+
+def assert_rows_are_current(table):
+    '''every item in the table has the row a full build gives, up to the order of equal scores'''
+    similar = SimilarityTable("movies")
+    for item_id in table:
+        row = similar.lookup(item_id)
+        expected = get_expected_row(table, item_id)
+        assert [score for _, score in row] == pytest.approx([score for _, score in expected])
+        engine = similar.get_engine(table)
+        scores = engine.score(table[item_id], "movies")
+        for similar_id, score in row:
+            assert similar_id != item_id
+            assert score == pytest.approx(scores[engine.positions[similar_id]])
+
+
+def test_build_in_steps():
+    table = get_table(generate_items("movies", 120))
+    similar = SimilarityTable("movies")
+    similar.reset()
+    assert similar.lookup(1) is None
+    assert similar.build(table, 50) == 70
+    assert similar.build(table, 50) == 20
+    assert similar.build(table, 50) == 0
+    assert len(similar.lookup(1)) == TOP_K
+    assert_rows_are_current(table)
+    # a new instance reads the table from disk
+    assert len(SimilarityTable("movies").get_built()) == 120
+
+
+def test_outdated_table_is_not_used(monkeypatch):
+    table = get_table(generate_items("movies", 60))
+    similar = SimilarityTable("movies")
+    similar.reset()
+    similar.build(table, 100)
+    monkeypatch.setattr(similarity_table, "get_table_version", lambda media_type: "other")
+    assert SimilarityTable("movies").lookup(1) is None
+
+
+def test_update_changed_and_removed_items():
+    items = generate_items("movies", 120)
+    similar = SimilarityTable("movies")
+    similar.reset()
+    similar.build(get_table(items), 200)
+    items[4] = dict(items[4], genre=["Western", "Drama"], cast=[{"name": "person1"}])
+    items[7] = dict(items[7], rating=9.9)
+    del items[10]
+    table = get_table(items)
+    similar.update(table, [5, 8], [11])
+    assert 11 not in similar.get_built()
+    assert similar.lookup(11) is None
+    assert similar.build(table, 200) == 0
+    assert_rows_are_current(table)
+
+
+def test_many_changes_drop_the_table(monkeypatch):
+    monkeypatch.setattr(similarity_table, "MAX_UPDATE_ITEMS", 2)
+    items = generate_items("movies", 60)
+    similar = SimilarityTable("movies")
+    similar.reset()
+    similar.build(get_table(items), 100)
+    items = [dict(item, year=item["year"] + 1) for item in items]
+    similar.update(get_table(items), [1, 2, 3], [])
+    assert similar.get_built() == {}
+    assert similar.lookup(1) is None
+    # the service builds it again while idle
+    assert similar.build(get_table(items), 100) == 0
+    assert_rows_are_current(get_table(items))
+
+
+def test_insert_entry():
+    row = [[1, .9], [2, .5], [3, .5]]
+    insert_entry(row, [4, .5])
+    insert_entry(row, [5, .7])
+    assert row == [[1, .9], [5, .7], [2, .5], [3, .5], [4, .5]]
+    row = [[item_id, 1] for item_id in range(TOP_K)]
+    insert_entry(row, [99, 1])
+    assert len(row) == TOP_K
+    assert [99, 1] not in row
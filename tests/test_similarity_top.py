@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_similarity_top.py
+    the candidate pruning of the similar widgets gives the same result as scoring and sorting all items
+'''
+
+import pytest
+from conftest import generate_items
+from resources.lib.similarity import SimilarityEngine, get_score_bound
+
+
+def get_sorted_scores(engine, ref_item, media_type, limit, excluded_rows=()):
+    '''scores all items and sorts them like the widgets did before the pruning'''
+    scores = engine.score(ref_item, media_type)
+    ranked = [(row, 0 if row in excluded_rows else score) for row, score in enumerate(scores)]
+    return sorted(ranked, key=lambda x: (-x[1], x[0]))[:limit]
+
+
+@pytest.mark.parametrize("limit", [1, 5, 25, 300])
+@pytest.mark.parametrize("media_type", ["movies", "tvshows"])
+def test_top_matches_sorting_all_scores(media_type, limit):
+    items = generate_items(media_type, 250, seed=2)
+    engine = SimilarityEngine(items, False)
+    for ref_item in items[:10]:
+        top = engine.top(ref_item, media_type, limit)
+        expected = get_sorted_scores(engine, ref_item, media_type, limit)
+        assert [row for row, _ in top] == [row for row, _ in expected]
+        assert [score for _, score in top] == pytest.approx([score for _, score in expected])
+
+
+def test_excluded_rows_are_ranked_last():
+    items = generate_items("movies", 100, seed=3)
+    engine = SimilarityEngine(items, False)
+    ref_item = items[0]
+    top = engine.top(ref_item, "movies", len(items), excluded_rows=set([0]))
+    assert (0, 0) in top
+    assert top == get_sorted_scores(engine, ref_item, "movies", len(items), excluded_rows=set([0]))
+    assert top[0][0] != 0
+
+
+def test_items_sharing_no_set_value_score_below_the_bound():
+    items = generate_items("tvshows", 200, seed=4)
+    ref_item = dict(items[0], genre=["Western"], cast=[{"name": "nobody"}])
+    scores = SimilarityEngine(items, False).score(ref_item, "tvshows")
+    assert max(scores) <= get_score_bound("tvshows")
+    assert get_score_bound("tvshows") == pytest.approx(.15)
+
+
+def test_no_limit():
+    items = generate_items("movies", 10)
+    assert SimilarityEngine(items, False).top(items[0], "movies", 0) == []
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_stats.py
+    the phase timings and json-rpc accounting of a plugin invocation
+'''
+
+import os
+import json
+import xbmc
+from resources.lib import stats as stats_module
+from resources.lib import library_mirror
+from resources.lib.stats import InvocationStats, instrument_kodidb, timed_rpc, append_record
+from resources.lib.utils import get_profile_path
+
+
+class FakeKodiDb(object):
+    '''returns nothing'''
+
+    def get_json(self, method, **kwargs):
+        return []
+
+
+def test_phases_and_record():
+    stats = InvocationStats()
+    stats.add("cache", stats.start_time)
+    record = stats.get_record({"mediatype": "movies", "action": "recent"}, "hit", 3)
+    assert record["mediatype"] == "movies"
+    assert record["cache"] == "hit"
+    assert record["items"] == 3
+    assert "cache" in record["phases"]
+    assert record["rpc"]["count"] == 0
+
+
+def test_every_rpc_path_is_accounted(monkeypatch, tmp_path):
+    monkeypatch.setattr(xbmc, "executeJSONRPC", lambda request: json.dumps(
+        [{"id": call["id"], "result": {"moviedetails": {"movieid": call["id"]}}} for call in json.loads(request)]))
+    stats = InvocationStats()
+    kodidb = FakeKodiDb()
+    instrument_kodidb(kodidb)
+    kodidb.get_json("VideoLibrary.GetMovies")
+    assert library_mirror.get_item_details("movies", [1, 2]) == [{"movieid": 1}, {"movieid": 2}]
+    # the mirror is not running: the failed query is accounted too
+    socket_path = str(tmp_path / "mirror.sock")
+    open(socket_path, "w").close()
+    monkeypatch.setattr(library_mirror, "get_socket_path", lambda: socket_path)
+    assert library_mirror.query_mirror("movies") is None
+    assert stats.rpc_count == 3
+    assert stats.rpc_methods == {"VideoLibrary.GetMovies": 1, "VideoLibrary.GetMovieDetails": 1,
+                                 "LibraryMirror.movies": 1}
+
+
+def test_rpc_without_stats(monkeypatch):
+    monkeypatch.setattr(stats_module, "ACTIVE_STATS", None)
+    assert timed_rpc("method", lambda value: value * 2, 21) == 42
+
+
+def test_failed_rpc_is_accounted():
+    stats = InvocationStats()
+
+    def failing():
+        raise ValueError("failed")
+    try:
+        timed_rpc("failing", failing)
+    except ValueError:
+        pass
+    assert stats.rpc_methods == {"failing": 1}
+
+
+def test_stats_file_is_rotated(monkeypatch):
+    monkeypatch.setattr(stats_module, "MAX_STATS_SIZE", 100)
+    for count in range(5):
+        append_record({"count": count, "padding": "x" * 40})
+    assert os.path.exists(get_profile_path("stats.1.jsonl"))
+    with open(get_profile_path("stats.jsonl")) as stats_file:
+        records = [json.loads(line) for line in stats_file]
+    assert records[-1]["count"] == 4
+    assert len(records) < 5
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_taste_profile.py
+    the taste profile of the recommended widgets and the scores of the watched items it replaces
+'''
+
+import pytest
+from conftest import generate_items
+from resources.lib import taste_profile
+from resources.lib.taste_profile import TasteProfile, build_profile, get_decay, HALF_LIFE_DAYS, PROFILE_FORMAT, \
+    DUPLICATE_WEIGHT
+from resources.lib.media import Media
+from resources.lib.movies import Movies
+from resources.lib.tvshows import Tvshows
+
+DAY = 86400
+
+
+def test_single_item_profile_scores_like_the_item():
+    movies = generate_items("movies", 80, seed=8)
+    tvshows = generate_items("tvshows", 80, seed=9)
+    for ref_item in movies[:5]:
+        profile = TasteProfile()
+        profile.add(ref_item, "movies", 1000)
+        for item in movies:
+            assert profile.score(item, "movies") == pytest.approx(Movies.get_similarity_score(ref_item, item))
+    for ref_item in tvshows[:5]:
+        profile = TasteProfile()
+        profile.add(ref_item, "tvshows", 1000)
+        for item in tvshows:
+            assert profile.score(item, "tvshows") == pytest.approx(Tvshows.get_similarity_score(ref_item, item))
+
+
+def test_mixed_score_converts_the_tvshow_genres():
+    movie = dict(generate_items("movies", 1, seed=10)[0], genre=["Comedy", "Drama"])
+    tvshow = dict(generate_items("tvshows", 1, seed=11)[0], genre=["TV Comedies", "Horror"])
+    widgets = Media(None, None, {})
+    convert_genres = widgets.convert_tvshow_genres
+    # a watched movie and a tvshow to score
+    profile = TasteProfile()
+    profile.add(movie, "movies", 1000)
+    converted_show = dict(tvshow, genre=list(convert_genres(tvshow["genre"])))
+    assert profile.score(tvshow, "tvshows", mixed=True, convert_genres=convert_genres) == \
+        pytest.approx(widgets.get_similarity_score(movie, converted_show))
+    # a watched tvshow and a movie to score
+    profile = TasteProfile()
+    profile.add(tvshow, "tvshows", 1000)
+    assert profile.score(movie, "movies", mixed=True, convert_genres=convert_genres) == \
+        pytest.approx(widgets.get_similarity_score(tvshow, movie))
+    assert profile.score(movie, "movies") == 0
+
+
+def test_weights_decay_and_duplicates():
+    movies = generate_items("movies", 3, seed=12)
+    profile = TasteProfile()
+    profile.add(movies[0], "movies", 1000)
+    profile.add(movies[1], "movies", 1000 + HALF_LIFE_DAYS * DAY)
+    assert profile.get_weight("movies") == pytest.approx(1.5)
+    # an older item from the history is aged to the time of the profile
+    profile.add(movies[2], "movies", 1000)
+    assert profile.get_weight("movies") == pytest.approx(2)
+    # watching a title again weighs half
+    profile.add(movies[1], "movies", 1000 + HALF_LIFE_DAYS * DAY)
+    assert profile.get_weight("movies") == pytest.approx(2.5)
+    assert get_decay(2 * HALF_LIFE_DAYS * DAY) == pytest.approx(.25)
+
+
+def test_decayed_values_are_dropped():
+    movies = generate_items("movies", 2, seed=13)
+    movies[0]["genre"] = ["Western"]
+    profile = TasteProfile()
+    profile.add(movies[0], "movies", 1000)
+    profile.add(movies[1], "movies", 1000 + 10 * HALF_LIFE_DAYS * DAY)
+    assert "Western" not in profile.data["types"]["movies"]["features"]["genre"]
+
+
+def test_decayed_titles_are_dropped():
+    movies = generate_items("movies", 2, seed=13)
+    profile = TasteProfile()
+    profile.add(movies[0], "movies", 1000)
+    profile.add(movies[0], "movies", 1000 + HALF_LIFE_DAYS * DAY)
+    assert profile.data["titles"] == {movies[0]["title"]: pytest.approx(.5 + DUPLICATE_WEIGHT)}
+    profile.add(movies[1], "movies", 1000 + 10 * HALF_LIFE_DAYS * DAY)
+    assert profile.data["titles"] == {movies[1]["title"]: 1}
+    # a title watched again after it decayed away counts as a new one
+    profile.add(movies[0], "movies", 1000 + 10 * HALF_LIFE_DAYS * DAY)
+    assert profile.data["titles"][movies[0]["title"]] == 1
+
+
+def test_profile_is_stored(monkeypatch):
+    assert TasteProfile.load() is None
+    profile = TasteProfile()
+    profile.add(generate_items("movies", 1)[0], "movies", 1000)
+    profile.save()
+    assert TasteProfile.load().data == profile.data
+    monkeypatch.setattr(taste_profile, "PROFILE_FORMAT", PROFILE_FORMAT + 1)
+    assert TasteProfile.load() is None
+
+
+def test_build_from_the_watch_history():
+    movies = generate_items("movies", 2, seed=14)
+    tvshows = [dict(generate_items("tvshows", 1, seed=15)[0], title="show")]
+    movies[0]["lastplayed"] = "2020-01-01 10:00:00"
+    movies[1]["lastplayed"] = ""
+
+    class FakeKodiDb(object):
+        '''the watched movies and episodes'''
+
+        def movies(self, **kwargs):
+            return movies
+
+        def episodes(self, **kwargs):
+            return [{"tvshowid": 1, "lastplayed": "2020-01-02 10:00:00"},
+                    {"tvshowid": 2, "lastplayed": "2020-01-03 10:00:00"}]
+
+    class FakeMetadataUtils(object):
+        '''just a kodidb'''
+        kodidb = FakeKodiDb()
+    profile = build_profile(FakeMetadataUtils(), lambda tvshow_id: tvshows[0] if tvshow_id == 1 else None)
+    assert profile.get_weight("movies") == pytest.approx(get_decay(DAY))
+    assert profile.get_weight("tvshows") == pytest.approx(1)
+    assert TasteProfile.load().data == profile.data
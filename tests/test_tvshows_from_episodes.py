@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_tvshows_from_episodes.py
+    the tvshows of the recently watched episodes are looked up at once
+'''
+
+from resources.lib import library_mirror
+from resources.lib.tvshows import Tvshows
+
+
+class FakeKodiDb(object):
+    '''two tvshows, counts the fetches of all shows'''
+
+    def __init__(self):
+        self.calls = 0
+
+    def tvshows(self, sort=None, filters=None, limits=None):
+        self.calls += 1
+        return [{"tvshowid": 1, "title": "show 1"}, {"tvshowid": 2, "title": "show 2"}]
+
+
+class FakeMetadataUtils(object):
+    '''just a kodidb'''
+
+    def __init__(self):
+        self.kodidb = FakeKodiDb()
+
+
+def get_episodes(*tvshow_ids):
+    '''episodes of the given tvshows'''
+    return [{"episodeid": count, "tvshowid": tvshow_id, "showtitle": "show %s" % tvshow_id}
+            for count, tvshow_id in enumerate(tvshow_ids)]
+
+
+def test_one_fetch_for_all_episodes():
+    metadatautils = FakeMetadataUtils()
+    widgets = Tvshows(None, metadatautils, {})
+    tvshows = widgets.get_tvshows_from_episodes(get_episodes(2, 1, 2, 3))
+    # duplicates are kept, unknown shows are skipped
+    assert [item["tvshowid"] for item in tvshows] == [2, 1, 2]
+    assert metadatautils.kodidb.calls == 1
+    # the shows are memoized for the invocation, also the unknown one
+    assert [item["tvshowid"] for item in widgets.get_tvshows_from_episodes(get_episodes(1, 3))] == [1]
+    assert metadatautils.kodidb.calls == 1
+    # every episode gets its own copy
+    tvshows[0]["similarscore"] = 1
+    assert "similarscore" not in tvshows[2]
+
+
+def test_shows_from_the_mirror(monkeypatch):
+    queries = []
+
+    def query_mirror(media_type, ids=None):
+        queries.append((media_type, sorted(ids)))
+        return [{"tvshowid": tvshow_id, "title": "mirrored"} if tvshow_id < 3 else None for tvshow_id in ids]
+    monkeypatch.setattr(library_mirror, "query_mirror", query_mirror)
+    metadatautils = FakeMetadataUtils()
+    tvshows = Tvshows(None, metadatautils, {}).get_tvshows_from_episodes(get_episodes(1, 2, 3))
+    assert [(item["tvshowid"], item["title"]) for item in tvshows] == [(1, "mirrored"), (2, "mirrored")]
+    assert queries == [("tvshows", [1, 2, 3])]
+    assert metadatautils.kodidb.calls == 0
+
+
+def test_recently_watched_tvshow():
+    class RecentKodiDb(FakeKodiDb):
+        '''with watched episodes'''
+
+        def episodes(self, sort=None, filters=None, limits=None):
+            return get_episodes(2, 2)
+    metadatautils = FakeMetadataUtils()
+    metadatautils.kodidb = RecentKodiDb()
+    widgets = Tvshows(None, metadatautils, {"num_recent_similar": 2})
+    assert widgets.get_recently_watched_tvshow()["tvshowid"] == 2
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tests/test_utils.py
+    the helpers of the widgets
+'''
+
+import json
+import os
+import threading
+from resources.lib.utils import write_json_file
+
+
+def test_write_json_file_from_several_threads(tmp_path):
+    filepath = str(tmp_path / "data.json")
+    errors = []
+    start = threading.Event()
+
+    def writer(value):
+        start.wait()
+        try:
+            for _ in range(50):
+                write_json_file(filepath, {"value": value, "items": list(range(1000))})
+        except Exception as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=writer, args=(value,)) for value in range(4)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    with open(filepath) as json_file:
+        assert json.load(json_file)["value"] in range(4)
+    assert os.listdir(str(tmp_path)) == ["data.json"]
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tools/benchmark_scoring.py
+    compare in-process and pooled similarity scoring on generated libraries and check the recall
+    of the approximate (MinHash/LSH) similar items, runs outside kodi:
+    python tools/benchmark_scoring.py [sizes...]
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import scoring_pool
+from tools.scoring_pool import top_similar, score_similar, get_pool_size
+from resources.lib.minhash import RECALL_TARGET, get_item_band_keys, get_shard, get_shard_file, read_candidates, \
+    get_approximate_top, get_recall
+
+SIZES = [1000, 10000, 50000]
+NUM_REFERENCES = 8
+LIMIT = 25
+GENRES = ["genre%s" % count for count in range(25)]
+PEOPLE = ["person%s" % count for count in range(20000)]
+STUDIOS = ["studio%s" % count for count in range(200)]
+
+
+def generate_item(count):
+    '''a random movie-like library item'''
+    return {
+        "movieid": count,
+        "title": "title%s" % count,
+        "year": random.randint(1950, 2020),
+        "rating": round(random.uniform(1, 10), 1),
+        "mpaa": random.choice(["", "G", "PG", "PG-13", "R"]),
+        "genre": random.sample(GENRES, random.randint(1, 4)),
+        "director": random.sample(PEOPLE, random.randint(0, 2)),
+        "writer": random.sample(PEOPLE, random.randint(0, 3)),
+        "cast": [{"name": name} for name in random.sample(PEOPLE, random.randint(0, 20))],
+        "studio": random.sample(STUDIOS, random.randint(0, 2)),
+        "setid": random.choice([0] * 20 + list(range(1, 50))),
+        "playcount": random.randint(0, 1)
+    }
+
+
+def measure(function, *args, **kwargs):
+    '''returns the result and the seconds a call took'''
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start_time
+
+
+def write_index(items, media_type, folder):
+    '''store the LSH buckets of the items in shard files, like the index the service maintains'''
+    shards = {}
+    for item in items:
+        for band_key in get_item_band_keys(item, media_type):
+            shards.setdefault(get_shard(band_key), {}).setdefault(band_key, []).append(item["movieid"])
+    for shard, buckets in shards.items():
+        with open(get_shard_file(folder, shard), "w") as shard_file:
+            json.dump(buckets, shard_file)
+
+
+def measure_approximate(items, references, media_type, exact_tops):
+    '''
+        returns the seconds of the approximate similar items of all references and their average recall,
+        the candidates are read from the index on disk like the plugin does
+    '''
+    folder = tempfile.mkdtemp()
+    try:
+        write_index(items, media_type, folder)
+        start_time = time.time()
+        recalls = []
+        for reference, exact_top in zip(references, exact_tops):
+            candidates = read_candidates(folder, reference, media_type)
+            approximate_top = get_approximate_top(items, candidates, "movieid", reference, media_type, LIMIT)
+            # not enough candidates: the plugin falls back to the exact items
+            recalls.append(get_recall(approximate_top, exact_top) if approximate_top is not None else 1.0)
+        return time.time() - start_time, sum(recalls) / len(recalls)
+    finally:
+        shutil.rmtree(folder)
+
+
+def main():
+    '''run the benchmark for all sizes and print one line per size and mode'''
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    random.seed(1)
+    # always use the pool for the benchmark, whatever the size
+    scoring_pool.POOL_THRESHOLD = 0
+    print("pool size: %s" % get_pool_size())
+    for size in sizes:
+        items = [generate_item(count) for count in range(size)]
+        references = random.sample(items, NUM_REFERENCES)
+        for media_type in ["movies", "tvshows"]:
+            serial_top, serial_top_time = measure(top_similar, items, references[0], media_type, LIMIT)
+            pooled_top, pooled_top_time = measure(top_similar, items, references[0], media_type, LIMIT,
+                                                  parallel=True)
+            serial_scores, serial_time = measure(score_similar, items, references, media_type)
+            pooled_scores, pooled_time = measure(score_similar, items, references, media_type, parallel=True)
+            assert serial_top == pooled_top and serial_scores == pooled_scores
+            print("%6s %-7s similar: serial %7.3fs pooled %7.3fs | recommended: serial %7.3fs pooled %7.3fs"
+                  % (size, media_type, serial_top_time, pooled_top_time, serial_time, pooled_time))
+            exact_tops, exact_time = measure(lambda: [top_similar(items, reference, media_type, LIMIT)
+                                                      for reference in references])
+            approximate_time, recall = measure_approximate(items, references, media_type, exact_tops)
+            print("%6s %-7s similar of %s references: exact %7.3fs approximate %7.3fs recall %.2f%s"
+                  % (size, media_type, NUM_REFERENCES, exact_time, approximate_time, recall,
+                     "" if recall >= RECALL_TARGET else " (below target %.2f)" % RECALL_TARGET))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    script.skin.helper.widgets
+    tools/scoring_pool.py
+    spread the similarity scoring of large libraries over a pool of processes, for the benchmark.
+    It forks the running process, which is not safe inside kodi, so it is not part of the addon:
+    the widgets always score in-process. Don't import any xbmc modules here.
+'''
+
+from resources.lib.similarity import SimilarityEngine, SCORE_TERMS, OVERLAP_SIZES
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# libraries smaller than this are scored in-process, starting the pool costs more than it saves
+POOL_THRESHOLD = 5000
+# the item fields the scoring needs, the records sent to the pool processes only contain these
+RECORD_FIELDS = ["title", "year", "rating", "mpaa", "genre", "director", "writer", "studio", "setid"]
+
+
+def get_pool_size():
+    '''the amount of processes to use, 0 if there is no usable multiprocessing (e.g. no fork on this platform)'''
+    if not multiprocessing or not hasattr(multiprocessing, "get_context"):
+        return 0
+    try:
+        multiprocessing.get_context("fork")
+        return multiprocessing.cpu_count()
+    except (ValueError, NotImplementedError):
+        return 0
+
+
+def get_record(item, media_type):
+    '''compact copy of an item with only the features scored for the given type'''
+    record = dict((field, item.get(field)) for field in RECORD_FIELDS)
+    cast_size = max(OVERLAP_SIZES[feature] for feature, _, _ in SCORE_TERMS[media_type] if feature in OVERLAP_SIZES)
+    record["cast"] = [{"name": x["name"]} for x in item.get("cast", [])[:cast_size]]
+    return record
+
+
+def get_partitions(items, num_partitions):
+    '''split the items in contiguous parts: (offset, items)'''
+    size = -(-len(items) // num_partitions)
+    return [(offset, items[offset:offset + size]) for offset in range(0, len(items), size)]
+
+
+def top_partition(args):
+    '''pool job: the top limit (row, score) of a part of the candidates, rows relative to all candidates'''
+    offset, records, ref_record, media_type, limit, excluded_rows = args
+    excluded_rows = set(row - offset for row in excluded_rows if offset <= row < offset + len(records))
+    return [(row + offset, score) for row, score in
+            SimilarityEngine(records).top(ref_record, media_type, limit, excluded_rows)]
+
+
+def score_partition(args):
+    '''pool job: the summed scores of a part of the candidates with all references'''
+    records, ref_records, media_type, weights = args
+    return SimilarityEngine(records).score_many(ref_records, media_type, weights)
+
+
+def run_partitions(job, partitions, pool_size):
+    '''run the job for every partition in a pool of forked processes, returns None if the pool failed'''
+    try:
+        pool = multiprocessing.get_context("fork").Pool(pool_size)
+        try:
+            return pool.map(job, partitions)
+        finally:
+            pool.close()
+            pool.join()
+    except (OSError, RuntimeError, AttributeError):
+        return None
+
+
+def use_pool(items, parallel):
+    '''returns the amount of processes to score the items with, 0 to score them in-process'''
+    if not parallel or len(items) < POOL_THRESHOLD:
+        return 0
+    pool_size = get_pool_size()
+    return pool_size if pool_size > 1 else 0
+
+
+def top_similar(items, ref_item, media_type, limit, excluded_rows=None, parallel=False):
+    '''
+        returns (row, score) of the limit best scoring items, like SimilarityEngine.top.
+        With parallel every process takes the top of a part of the items, the parts are merged.
+    '''
+    pool_size = use_pool(items, parallel)
+    if pool_size:
+        records = [get_record(item, media_type) for item in items]
+        partitions = [(offset, part, get_record(ref_item, media_type), media_type, limit, excluded_rows or set())
+                      for offset, part in get_partitions(records, pool_size)]
+        results = run_partitions(top_partition, partitions, pool_size)
+        if results is not None:
+            # same order as a stable sort of all items by score
+            return sorted([result for part in results for result in part], key=lambda x: (-x[1], x[0]))[:limit]
+    return SimilarityEngine(items).top(ref_item, media_type, limit, excluded_rows)
+
+
+def score_similar(items, ref_items, media_type, weights=None, parallel=False):
+    '''
+        returns the (weighted) sum of the similarity scores of the items with all references, like
+        SimilarityEngine.score_many. With parallel every process scores a part of the items.
+    '''
+    pool_size = use_pool(items, parallel)
+    if pool_size:
+        records = [get_record(item, media_type) for item in items]
+        ref_records = [get_record(item, media_type) for item in ref_items]
+        partitions = [(part, ref_records, media_type, weights) for _, part in get_partitions(records, pool_size)]
+        results = run_partitions(score_partition, partitions, pool_size)
+        if results is not None:
+            return [score for part in results for score in part]
+    return SimilarityEngine(items).score_many(ref_items, media_type, weights)
+